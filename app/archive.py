@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional
+
+from app.db import archive_orders, prune_order_events
+
+logger = logging.getLogger(__name__)
+
+_TASK: Optional[asyncio.Task] = None
+
+
+async def _archive_loop(older_than_hours: float, batch: int, interval: float) -> None:
+    while True:
+        try:
+            moved = await archive_orders(older_than_hours, batch)
+        except Exception:
+            logger.exception("Order archival failed")
+            moved = 0
+        if moved:
+            logger.info("Archived %d finished (completed or expired) orders", moved)
+        try:
+            pruned = await prune_order_events(older_than_hours, batch)
+        except Exception:
+            logger.exception("Order event pruning failed")
+            pruned = 0
+        # A full batch means there is a backlog: keep going, but yield to handlers in between
+        await asyncio.sleep(0 if batch in (moved, pruned) else interval)
+
+
+def start_archiver(older_than_hours: float = 24.0, batch: int = 500, interval: float = 300.0) -> None:
+    """Periodically move old finished (completed or expired) orders out of the hot orders table in bounded batches.
+
+    Order events already pushed to passengers are deleted after the same time.
+    """
+    global _TASK
+    if _TASK is None:
+        _TASK = asyncio.create_task(_archive_loop(older_than_hours, batch, interval))
+
+
+async def stop_archiver() -> None:
+    global _TASK
+    if _TASK is None:
+        return
+    task, _TASK = _TASK, None
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
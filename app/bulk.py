@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Set, Tuple
+
+from app.db import ORDER_COLUMNS, iter_orders
+from app.repository import add_drivers
+
+# Rows per add_drivers() transaction
+IMPORT_CHUNK = 500
+MAX_NAME_LENGTH = 128
+
+
+@dataclass
+class ImportReport:
+    added: int = 0
+    existing: int = 0
+    # (line number, problem)
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+
+
+def _read_chunk(reader: Iterator[List[str]], size: int) -> List[Tuple[int, List[str]]]:
+    chunk = []
+    for row in reader:
+        chunk.append((reader.line_num, row))
+        if len(chunk) == size:
+            break
+    return chunk
+
+
+def _parse_row(row: List[str]) -> Tuple[Optional[Tuple[int, str]], Optional[str]]:
+    """(tg_id, full_name) or an error for one ``tg_id[,full_name]`` row."""
+    tg_id_raw = row[0].strip()
+    if not tg_id_raw.isdigit() or int(tg_id_raw) <= 0:
+        return None, f"tg_id должен быть положительным числом: {tg_id_raw[:32]!r}"
+    tg_id = int(tg_id_raw)
+    name = row[1].strip() if len(row) > 1 else ""
+    if len(name) > MAX_NAME_LENGTH:
+        return None, f"имя длиннее {MAX_NAME_LENGTH} символов"
+    return (tg_id, name or f"driver_{tg_id}"), None
+
+
+async def import_drivers(path: str, chunk_size: int = IMPORT_CHUNK) -> ImportReport:
+    """Register the drivers listed in a ``tg_id[,full_name]`` CSV file.
+
+    The file is read and inserted ``chunk_size`` rows at a time, one
+    transaction per chunk, so its size doesn't matter. A first line that
+    doesn't start with a number is taken as a header. Rows with a bad id,
+    ids repeated in the file and drivers that already exist are reported
+    with their line numbers; the other rows are added.
+    """
+    report = ImportReport()
+    seen: Set[int] = set()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        while True:
+            try:
+                chunk = await asyncio.to_thread(_read_chunk, reader, chunk_size)
+            except (csv.Error, UnicodeDecodeError) as e:
+                report.errors.append((reader.line_num + 1, f"файл не читается дальше: {e}"))
+                break
+            if not chunk:
+                break
+            rows: List[Tuple[int, str]] = []
+            lines = {}
+            for line, row in chunk:
+                if not row or not "".join(row).strip():
+                    continue
+                if line == 1 and not row[0].strip().isdigit():
+                    continue
+                parsed, error = _parse_row(row)
+                if parsed is None:
+                    report.errors.append((line, error))
+                elif parsed[0] in seen:
+                    report.errors.append((line, f"{parsed[0]} уже встречался в файле"))
+                else:
+                    seen.add(parsed[0])
+                    lines[parsed[0]] = line
+                    rows.append(parsed)
+            existing = await add_drivers(rows)
+            report.added += len(rows) - len(existing)
+            report.existing += len(existing)
+            report.errors += [(lines[tg_id], f"{tg_id} уже зарегистрирован") for tg_id in existing]
+    report.errors.sort()
+    return report
+
+
+def write_errors(path: str, report: ImportReport) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(("line", "error"))
+        writer.writerows(report.errors)
+
+
+async def export_orders(path: str, since: str, until: str) -> int:
+    """Write the orders created in [since, until) to a CSV file; returns the number of rows.
+
+    Rows are streamed from SQLite and written a chunk at a time, so memory
+    use doesn't depend on the size of the range.
+    """
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(ORDER_COLUMNS)
+        async for rows in iter_orders(since, until):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            await asyncio.to_thread(f.write, buffer.getvalue())
+            count += len(rows)
+    return count
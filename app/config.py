@@ -12,11 +12,75 @@ class Config:
     bot_token: str
     admin_ids: List[int]
     db_path: str
+    db_pool_size: int = 4
+    db_write_window: float = 0.001
+    db_write_batch: int = 256
+    # Per-function query timings (see app.profiler); calls slower than db_slow_query are logged
+    db_profile: bool = False
+    db_slow_query: float = 0.1
+    # Refuse to start when a hot query is not served by an index (see app.db.verify_query_plans)
+    db_check_plans: bool = False
+    cache_size: int = 1024
+    cache_ttl: float = 60.0
+    fsm_state_ttl: float = 86400.0
+    archive_after_hours: float = 24.0
+    archive_batch: int = 500
+    archive_interval: float = 300.0
+    dispatch_rate: float = 25.0
+    dispatch_concurrency: int = 8
+    presence_timeout: float = 900.0
+    presence_snapshot_interval: float = 10.0
+    # 0 disables either timer
+    order_ttl: float = 900.0
+    accept_timeout: float = 600.0
+    # Seconds between checks for order events written by other processes
+    feed_poll_interval: float = 2.0
+    # Seconds before a lookup rebuilds the nearest-order index from the database
+    geo_refresh_interval: float = 5.0
+    outbox_rate: float = 30.0
+    outbox_chat_rate: float = 1.0
+    outbox_chat_burst: int = 3
+    outbox_concurrency: int = 16
+    # "polling" or "webhook"
+    run_mode: str = "polling"
+    # Seconds a stopping process waits for running handlers before carrying their updates over
+    drain_timeout: float = 8.0
+    # Updates run in order per user (see app.scheduler): at most update_concurrency at once
+    # and update_backlog queued or running, in polling and webhook mode alike
+    update_concurrency: int = 32
+    update_backlog: int = 1000
+    telegram_api_url: str = ""
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    webhook_secret: str = ""
+    web_host: str = "0.0.0.0"
+    web_port: int = 8080
+    web_workers: int = 1
+    throttle_rate: float = 2.0
+    throttle_burst: int = 5
+    callback_dedup_window: float = 1.0
+    metrics_host: str = "127.0.0.1"
+    # 0 disables the metrics endpoint
+    metrics_port: int = 9100
 
 
 settings: Config | None = None
 
 
+def _env_int(name: str, default: int, minimum: int = 0) -> int:
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float, minimum: float = 0.0) -> float:
+    try:
+        return max(minimum, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
 def load_config(dotenv_path: str | None = None) -> Config:
     global settings
     load_dotenv(dotenv_path=dotenv_path)
@@ -38,5 +102,54 @@ def load_config(dotenv_path: str | None = None) -> Config:
 
     db_path = os.getenv("DB_PATH", os.path.join(os.getcwd(), "taxi_bot.sqlite3")).strip()
 
-    settings = Config(bot_token=bot_token, admin_ids=admin_ids, db_path=db_path)
+    run_mode = os.getenv("RUN_MODE", "polling").strip().lower()
+    if run_mode not in ("polling", "webhook"):
+        raise RuntimeError(f"Unknown RUN_MODE: {run_mode}")
+
+    settings = Config(
+        bot_token=bot_token,
+        admin_ids=admin_ids,
+        db_path=db_path,
+        db_pool_size=_env_int("DB_POOL_SIZE", 4, minimum=1),
+        db_write_window=_env_float("DB_WRITE_WINDOW_MS", 1.0) / 1000.0,
+        db_write_batch=_env_int("DB_WRITE_BATCH", 256, minimum=1),
+        db_profile=_env_int("DB_PROFILE", 0) > 0,
+        db_check_plans=_env_int("DB_CHECK_PLANS", 0) > 0,
+        db_slow_query=_env_float("DB_SLOW_QUERY_MS", 100.0) / 1000.0,
+        cache_size=_env_int("CACHE_SIZE", 1024),
+        cache_ttl=_env_float("CACHE_TTL", 60.0),
+        fsm_state_ttl=_env_float("FSM_STATE_TTL", 86400.0),
+        archive_after_hours=_env_float("ARCHIVE_AFTER_HOURS", 24.0),
+        archive_batch=_env_int("ARCHIVE_BATCH", 500, minimum=1),
+        archive_interval=_env_float("ARCHIVE_INTERVAL", 300.0, minimum=1.0),
+        dispatch_rate=_env_float("DISPATCH_RATE", 25.0),
+        dispatch_concurrency=_env_int("DISPATCH_CONCURRENCY", 8, minimum=1),
+        presence_timeout=_env_float("PRESENCE_TIMEOUT", 900.0, minimum=1.0),
+        presence_snapshot_interval=_env_float("PRESENCE_SNAPSHOT_INTERVAL", 10.0, minimum=1.0),
+        order_ttl=_env_float("ORDER_TTL", 900.0),
+        accept_timeout=_env_float("ACCEPT_TIMEOUT", 600.0),
+        feed_poll_interval=_env_float("FEED_POLL_INTERVAL", 2.0, minimum=0.1),
+        geo_refresh_interval=_env_float("GEO_REFRESH_INTERVAL", 5.0),
+        outbox_rate=_env_float("OUTBOX_RATE", 30.0),
+        outbox_chat_rate=_env_float("OUTBOX_CHAT_RATE", 1.0),
+        outbox_chat_burst=_env_int("OUTBOX_CHAT_BURST", 3, minimum=1),
+        outbox_concurrency=_env_int("OUTBOX_CONCURRENCY", 16, minimum=1),
+        run_mode=run_mode,
+        drain_timeout=_env_float("DRAIN_TIMEOUT", 8.0),
+        # Formerly webhook-only, under WEBHOOK_CONCURRENCY and WEBHOOK_QUEUE_SIZE
+        update_concurrency=_env_int("UPDATE_CONCURRENCY", _env_int("WEBHOOK_CONCURRENCY", 32, minimum=1), minimum=1),
+        update_backlog=_env_int("UPDATE_BACKLOG", _env_int("WEBHOOK_QUEUE_SIZE", 1000, minimum=1), minimum=1),
+        telegram_api_url=os.getenv("TELEGRAM_API_URL", "").strip(),
+        webhook_url=os.getenv("WEBHOOK_URL", "").strip(),
+        webhook_path=os.getenv("WEBHOOK_PATH", "/webhook").strip() or "/webhook",
+        webhook_secret=os.getenv("WEBHOOK_SECRET", "").strip(),
+        web_host=os.getenv("WEB_HOST", "0.0.0.0").strip(),
+        web_port=_env_int("WEB_PORT", 8080, minimum=1),
+        web_workers=_env_int("WEB_WORKERS", 1, minimum=1),
+        throttle_rate=_env_float("THROTTLE_RATE", 2.0),
+        throttle_burst=_env_int("THROTTLE_BURST", 5, minimum=1),
+        callback_dedup_window=_env_float("CALLBACK_DEDUP_WINDOW", 1.0),
+        metrics_host=os.getenv("METRICS_HOST", "127.0.0.1").strip(),
+        metrics_port=_env_int("METRICS_PORT", 9100),
+    )
     return settings
\ No newline at end of file
@@ -1,9 +1,37 @@
 from __future__ import annotations
 
+import asyncio
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
 import aiosqlite
-from typing import Any, Dict, List, Optional, Tuple
+
+from app.cache import MISSING, TTLCache
+from app.migrations import check_query_plans, explain, migrate
+from app.pool import ConnectionPool
+from app.profiler import PROFILER, TracedConnection, current_statements, traced, traced_op
+from app.stats import record_created, record_transition
+from app.writer import GroupCommitWriter, run_once
 
 _DB_PATH: str | None = None
+_POOL: ConnectionPool | None = None
+_WRITER: GroupCommitWriter | None = None
+
+# Read-through caches for the lookups done on every tap. Writes in this module
+# invalidate them; another process writing to the same DB file is only picked
+# up after the TTL, so main.py switches them off when several workers share it.
+_users_cache = TTLCache()
+_drivers_cache = TTLCache()
+_passenger_orders_cache = TTLCache()
+_driver_orders_cache = TTLCache()
+_CACHES: Dict[str, TTLCache] = {
+    "users": _users_cache,
+    "drivers": _drivers_cache,
+    "passenger_orders": _passenger_orders_cache,
+    "driver_orders": _driver_orders_cache,
+}
 
 
 def set_db_path(path: str) -> None:
@@ -11,6 +39,58 @@ def set_db_path(path: str) -> None:
     _DB_PATH = path
 
 
+async def open_pool(size: int = 4) -> None:
+    """Open the shared connection pool; queries fall back to one-off connections without it."""
+    global _POOL
+    if not _DB_PATH:
+        raise RuntimeError("DB path is not configured. Call set_db_path() first.")
+    if _POOL is not None:
+        return
+    pool = ConnectionPool(_DB_PATH, size=size)
+    await pool.open()
+    _POOL = pool
+
+
+async def close_pool() -> None:
+    global _POOL
+    if _POOL is None:
+        return
+    pool, _POOL = _POOL, None
+    await pool.close()
+
+
+async def open_writer(window: float = 0.001, max_batch: int = 256) -> None:
+    """Start the single writer; all mutating calls below then share group commits."""
+    global _WRITER
+    if not _DB_PATH:
+        raise RuntimeError("DB path is not configured. Call set_db_path() first.")
+    if _WRITER is not None:
+        return
+    writer = GroupCommitWriter(_DB_PATH, window=window, max_batch=max_batch)
+    await writer.start()
+    _WRITER = writer
+
+
+async def close_writer() -> None:
+    global _WRITER
+    if _WRITER is None:
+        return
+    writer, _WRITER = _WRITER, None
+    await writer.close()
+
+
+def configure_cache(maxsize: int = 1024, ttl: float = 60.0) -> None:
+    """Resize the read-through caches; maxsize 0 disables caching."""
+    for cache in _CACHES.values():
+        cache.maxsize = maxsize
+        cache.ttl = ttl
+        cache.clear()
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    return {name: cache.stats() for name, cache in _CACHES.items()}
+
+
 async def _get_db() -> aiosqlite.Connection:
     if not _DB_PATH:
         raise RuntimeError("DB path is not configured. Call set_db_path() first.")
@@ -20,211 +100,904 @@ async def _get_db() -> aiosqlite.Connection:
     return db
 
 
-async def init_db() -> None:
-    async with await _get_db() as db:
-        # Users table: passengers and potentially admins; drivers are kept in separate table
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tg_id INTEGER UNIQUE NOT NULL,
-                full_name TEXT,
-                phone TEXT
-            );
-            """
-        )
-        # Drivers table: registered by admin
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS drivers (
-                tg_id INTEGER PRIMARY KEY,
-                full_name TEXT,
-                added_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            );
-            """
-        )
-        # Orders table
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                passenger_tg_id INTEGER NOT NULL,
-                pickup TEXT NOT NULL,
-                destination TEXT NOT NULL,
-                status TEXT NOT NULL,
-                driver_tg_id INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(passenger_tg_id) REFERENCES users(tg_id) ON DELETE CASCADE
-            );
-            """
-        )
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_driver ON orders(driver_tg_id);")
-        await db.commit()
+@asynccontextmanager
+async def _connect() -> AsyncIterator[aiosqlite.Connection]:
+    # While app.profiler traces a call, the statements it runs are noted for the slow-query log
+    statements = current_statements()
+    if _POOL is not None:
+        async with _POOL.acquire() as db:
+            yield db if statements is None else TracedConnection(db, statements)
+        return
+    db = await _get_db()
+    try:
+        yield db if statements is None else TracedConnection(db, statements)
+    finally:
+        await db.close()
+
+
+async def _write(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run ``fn(conn, *args)`` in a write transaction and return its result."""
+    def op(conn: sqlite3.Connection) -> Any:
+        return fn(conn, *args)
+
+    statements = current_statements()
+    if statements is not None:
+        op = traced_op(op, statements)
+    if _WRITER is not None:
+        return await _WRITER.submit(op)
+    if not _DB_PATH:
+        raise RuntimeError("DB path is not configured. Call set_db_path() first.")
+    return await asyncio.to_thread(run_once, _DB_PATH, op)
+
+
+async def init_db(check_plans: bool = False) -> None:
+    """Bring the schema up to date; with ``check_plans`` also run verify_query_plans()."""
+    async with _connect() as db:
+        await migrate(db)
+        if check_plans:
+            # On the connection that migrated: other pooled connections may still
+            # plan against the schema they loaded before (see verify_query_plans)
+            await check_query_plans(db, HOT_QUERIES)
+
+
+# Columns copied verbatim from orders to orders_archive
+ORDER_COLUMNS = (
+    "id",
+    "passenger_tg_id",
+    "pickup",
+    "destination",
+    "status",
+    "driver_tg_id",
+    "created_at",
+    "updated_at",
+    "accepted_at",
+    "completed_at",
+    "pickup_lat",
+    "pickup_lon",
+)
+
+# Read queries on the hot path; each must be served by an index (see verify_query_plans)
+_SQL_GET_USER = "SELECT * FROM users WHERE tg_id=?"
+_SQL_IS_DRIVER = "SELECT 1 FROM drivers WHERE tg_id=?"
+_SQL_GET_ORDER = "SELECT * FROM orders WHERE id=?"
+_SQL_GET_ARCHIVED_ORDER = f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders_archive WHERE id=?"
+_SQL_LIST_NEW_ORDERS = "SELECT * FROM orders WHERE status='new' ORDER BY id ASC LIMIT ?"
+_SQL_OPEN_ORDER_LOCATIONS = (
+    "SELECT id, pickup_lat, pickup_lon FROM orders WHERE status='new' AND pickup_lat IS NOT NULL"
+)
+_SQL_DRIVER_ACTIVE_ORDER = (
+    "SELECT * FROM orders WHERE driver_tg_id=? AND status IN ('accepted','arrived') "
+    "ORDER BY updated_at DESC LIMIT 1"
+)
+# Without ANALYZE statistics SQLite prefers idx_orders_status here and sorts
+_SQL_FINISHED_ORDERS = (
+    "SELECT id FROM orders INDEXED BY idx_orders_finished "
+    "WHERE status IN ('completed','expired') AND updated_at < datetime('now', ?) "
+    "ORDER BY updated_at LIMIT ?"
+)
+_SQL_PENDING_ORDERS = (
+    "SELECT id, status, driver_tg_id, updated_at, accepted_at FROM orders WHERE status IN ('new','accepted')"
+)
+# Live and archived orders created in [since, until), merged in created_at order
+_SQL_EXPORT_ORDERS = (
+    f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders_archive WHERE created_at >= ? AND created_at < ? "
+    f"UNION ALL SELECT {', '.join(ORDER_COLUMNS)} FROM orders WHERE created_at >= ? AND created_at < ? "
+    "ORDER BY created_at"
+)
+# Keyset pages: the first page, then the rows after (next) or before (prev) a cursor row
+_SQL_DRIVERS_PAGE = "SELECT tg_id, full_name, added_at FROM drivers ORDER BY added_at DESC, tg_id DESC LIMIT ?"
+_SQL_DRIVERS_NEXT = (
+    "SELECT tg_id, full_name, added_at FROM drivers WHERE (added_at, tg_id) < (?, ?) "
+    "ORDER BY added_at DESC, tg_id DESC LIMIT ?"
+)
+_SQL_DRIVERS_PREV = (
+    "SELECT tg_id, full_name, added_at FROM drivers WHERE (added_at, tg_id) > (?, ?) "
+    "ORDER BY added_at ASC, tg_id ASC LIMIT ?"
+)
+# Filter column -> index-backed condition for the order browser
+_ORDER_FILTERS = {
+    "status": "status=?",
+    "driver_tg_id": "driver_tg_id=?",
+    "passenger_tg_id": "passenger_tg_id=?",
+}
+_SQL_PASSENGER_ACTIVE_ORDER = (
+    "SELECT * FROM orders WHERE passenger_tg_id=? AND status IN ('new','accepted','arrived') "
+    "ORDER BY created_at DESC LIMIT 1"
+)
+_SQL_ADD_ORDER_EVENT = "INSERT INTO order_events (order_id, passenger_tg_id, driver_tg_id, status) VALUES (?, ?, ?, ?)"
+# Events after the feed's cursor, with the name of the driver involved
+_SQL_ORDER_EVENTS = (
+    "SELECT e.seq, e.order_id, e.passenger_tg_id, e.driver_tg_id, e.status, d.full_name AS driver_name "
+    "FROM order_events e LEFT JOIN drivers d ON d.tg_id = e.driver_tg_id WHERE e.seq > ? ORDER BY e.seq LIMIT ?"
+)
+
+HOT_QUERIES: Dict[str, Tuple[str, Tuple[Any, ...]]] = {
+    "get_user": (_SQL_GET_USER, (0,)),
+    "is_driver": (_SQL_IS_DRIVER, (0,)),
+    "page_drivers_first": (_SQL_DRIVERS_PAGE, (21,)),
+    "export_orders": (_SQL_EXPORT_ORDERS, ("", "", "", "")),
+    "get_order": (_SQL_GET_ORDER, (0,)),
+    "get_archived_order": (_SQL_GET_ARCHIVED_ORDER, (0,)),
+    "list_new_orders": (_SQL_LIST_NEW_ORDERS, (10,)),
+    "list_open_order_locations": (_SQL_OPEN_ORDER_LOCATIONS, ()),
+    "get_driver_active_order": (_SQL_DRIVER_ACTIVE_ORDER, (0,)),
+    "get_passenger_active_order": (_SQL_PASSENGER_ACTIVE_ORDER, (0,)),
+    "archive_orders": (_SQL_FINISHED_ORDERS, ("-24 hours", 500)),
+    "list_pending_orders": (_SQL_PENDING_ORDERS, ()),
+    "order_events": (_SQL_ORDER_EVENTS, (0, 100)),
+    "page_drivers": (_SQL_DRIVERS_NEXT, ("", 0, 21)),
+    "page_drivers_prev": (_SQL_DRIVERS_PREV, ("", 0, 21)),
+}
+
+
+def _orders_page_sql(filters: Sequence[str], cursor: Optional[str]) -> str:
+    where = [_ORDER_FILTERS[name] for name in filters]
+    if cursor == "next":
+        where.append("id<?")
+    elif cursor == "prev":
+        where.append("id>?")
+    sql = "SELECT * FROM orders"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + (" ORDER BY id ASC LIMIT ?" if cursor == "prev" else " ORDER BY id DESC LIMIT ?")
+
+
+for _name in _ORDER_FILTERS:
+    HOT_QUERIES[f"page_orders_by_{_name}"] = (_orders_page_sql([_name], "next"), (0, 0, 11))
+HOT_QUERIES["page_orders"] = (_orders_page_sql([], "next"), (0, 11))
+
+
+async def _explain(sql: str, params: Sequence[Any]) -> List[str]:
+    async with _connect() as db:
+        return await explain(db, sql, params)
+
+
+PROFILER.explain = _explain
+
+
+async def verify_query_plans() -> Dict[str, List[str]]:
+    """Raise RuntimeError if EXPLAIN QUERY PLAN shows a hot query scanning or sorting.
+
+    Runs on a connection of its own: EXPLAIN QUERY PLAN does not re-check
+    the schema cookie, so a pooled connection opened before a migration
+    would plan against the indexes it saw then.
+    """
+    db = await _get_db()
+    try:
+        return await check_query_plans(db, HOT_QUERIES)
+    finally:
+        await db.close()
 
 
 # Users
+def _upsert_user_op(conn: sqlite3.Connection, tg_id: int, full_name: str) -> None:
+    conn.execute(
+        """
+        INSERT INTO users (tg_id, full_name)
+        VALUES (?, ?)
+        ON CONFLICT(tg_id) DO UPDATE SET full_name=excluded.full_name
+        """,
+        (tg_id, full_name),
+    )
+
+
+@traced
 async def upsert_user(tg_id: int, full_name: str) -> None:
-    async with await _get_db() as db:
-        await db.execute(
-            """
-            INSERT INTO users (tg_id, full_name)
-            VALUES (?, ?)
-            ON CONFLICT(tg_id) DO UPDATE SET full_name=excluded.full_name
-            """,
-            (tg_id, full_name),
-        )
-        await db.commit()
+    await _write(_upsert_user_op, tg_id, full_name)
+    _users_cache.invalidate(tg_id)
 
 
+@traced
 async def get_user(tg_id: int) -> Optional[Dict[str, Any]]:
-    async with await _get_db() as db:
-        async with db.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,)) as cur:
+    cached = _users_cache.get(tg_id)
+    if cached is not MISSING:
+        return dict(cached) if cached else None
+    epoch = _users_cache.epoch
+    async with _connect() as db:
+        async with db.execute(_SQL_GET_USER, (tg_id,)) as cur:
             row = await cur.fetchone()
-            return dict(row) if row else None
+    user = dict(row) if row else None
+    _users_cache.set(tg_id, user, epoch)
+    return dict(user) if user else None
+
+
+def _set_user_phone_op(conn: sqlite3.Connection, tg_id: int, phone: str) -> None:
+    conn.execute("UPDATE users SET phone=? WHERE tg_id=?", (phone, tg_id))
 
 
+@traced
 async def set_user_phone(tg_id: int, phone: str) -> None:
-    async with await _get_db() as db:
-        await db.execute("UPDATE users SET phone=? WHERE tg_id=?", (phone, tg_id))
-        await db.commit()
+    await _write(_set_user_phone_op, tg_id, phone)
+    _users_cache.invalidate(tg_id)
 
 
 # Drivers
-async def add_driver(tg_id: int, full_name: str) -> bool:
-    async with await _get_db() as db:
-        try:
-            await db.execute(
-                "INSERT INTO drivers (tg_id, full_name) VALUES (?, ?)",
-                (tg_id, full_name),
-            )
-            await db.commit()
-            return True
-        except Exception:
-            return False
+def _add_driver_op(conn: sqlite3.Connection, tg_id: int, full_name: str) -> None:
+    conn.execute(
+        "INSERT INTO drivers (tg_id, full_name) VALUES (?, ?)",
+        (tg_id, full_name),
+    )
 
 
+@traced
+async def add_driver(tg_id: int, full_name: str) -> bool:
+    try:
+        await _write(_add_driver_op, tg_id, full_name)
+    except Exception:
+        return False
+    _drivers_cache.invalidate(tg_id)
+    _drivers_cache.set(tg_id, True)
+    return True
+
+
+def _remove_driver_op(conn: sqlite3.Connection, tg_id: int) -> int:
+    return conn.execute("DELETE FROM drivers WHERE tg_id=?", (tg_id,)).rowcount
+
+
+def _add_drivers_op(conn: sqlite3.Connection, rows: List[Tuple[int, str]]) -> List[int]:
+    placeholders = ",".join("?" * len(rows))
+    existing = [
+        r[0] for r in conn.execute(f"SELECT tg_id FROM drivers WHERE tg_id IN ({placeholders})", [r[0] for r in rows])
+    ]
+    skip = set(existing)
+    conn.executemany("INSERT INTO drivers (tg_id, full_name) VALUES (?, ?)", [r for r in rows if r[0] not in skip])
+    return existing
+
+
+@traced
+async def add_drivers(rows: List[Tuple[int, str]]) -> List[int]:
+    """Insert (tg_id, full_name) rows in one transaction; returns the tg_ids that were already drivers."""
+    if not rows:
+        return []
+    existing = await _write(_add_drivers_op, rows)
+    skip = set(existing)
+    for tg_id, _ in rows:
+        if tg_id not in skip:
+            _drivers_cache.invalidate(tg_id)
+            _drivers_cache.set(tg_id, True)
+    return existing
+
+
+@traced
 async def remove_driver(tg_id: int) -> int:
-    async with await _get_db() as db:
-        cur = await db.execute("DELETE FROM drivers WHERE tg_id=?", (tg_id,))
-        await db.commit()
-        return cur.rowcount
+    removed = await _write(_remove_driver_op, tg_id)
+    _drivers_cache.invalidate(tg_id)
+    _drivers_cache.set(tg_id, False)
+    return removed
 
 
+@traced
 async def is_driver(tg_id: int) -> bool:
-    async with await _get_db() as db:
-        async with db.execute("SELECT 1 FROM drivers WHERE tg_id=?", (tg_id,)) as cur:
-            return (await cur.fetchone()) is not None
+    cached = _drivers_cache.get(tg_id)
+    if cached is not MISSING:
+        return cached
+    epoch = _drivers_cache.epoch
+    async with _connect() as db:
+        async with db.execute(_SQL_IS_DRIVER, (tg_id,)) as cur:
+            found = (await cur.fetchone()) is not None
+    _drivers_cache.set(tg_id, found, epoch)
+    return found
+
+
+def keyset_page(rows: List[Any], limit: int, cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], bool, bool]:
+    """Rows in display order plus (has_prev, has_next); one extra row was fetched to tell."""
+    more = len(rows) > limit
+    page = [dict(r) for r in rows[:limit]]
+    if cursor == "prev":
+        page.reverse()
+        return page, more, True
+    return page, cursor == "next", more
+
+
+@traced
+async def page_drivers(
+    after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None, limit: int = 20
+) -> Tuple[List[Dict[str, Any]], bool, bool]:
+    """One page of drivers, newest first, by keyset on (added_at, tg_id).
+
+    Pass the last row's key as ``after`` for the next page or the first row's
+    key as ``before`` for the previous one. Returns (rows, has_prev, has_next).
+    """
+    if after is not None:
+        sql, params, cursor = _SQL_DRIVERS_NEXT, (*after, limit + 1), "next"
+    elif before is not None:
+        sql, params, cursor = _SQL_DRIVERS_PREV, (*before, limit + 1), "prev"
+    else:
+        sql, params, cursor = _SQL_DRIVERS_PAGE, (limit + 1,), None
+    async with _connect() as db:
+        async with db.execute(sql, params) as cur:
+            return keyset_page(await cur.fetchall(), limit, cursor)
+
+
+# Driver presence: one row per driver on shift, shared by every process (see app.presence)
+def _start_shift_op(conn: sqlite3.Connection, row: Tuple[Any, ...]) -> None:
+    conn.execute(
+        """
+        INSERT INTO driver_presence (tg_id, online_since, last_seen, lat, lon) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(tg_id) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen),
+            lat = COALESCE(excluded.lat, lat), lon = COALESCE(excluded.lon, lon)
+        """,
+        row,
+    )
+
+
+@traced
+async def start_shift(row: Tuple[Any, ...]) -> None:
+    """Put a driver on shift: ``row`` is (tg_id, online_since, last_seen, lat, lon)."""
+    await _write(_start_shift_op, row)
+
+
+def _end_shift_op(conn: sqlite3.Connection, tg_id: int) -> None:
+    conn.execute("DELETE FROM driver_presence WHERE tg_id=?", (tg_id,))
+
+
+@traced
+async def end_shift(tg_id: int) -> None:
+    await _write(_end_shift_op, tg_id)
+
+
+def _save_presence_op(conn: sqlite3.Connection, rows: List[Tuple[Any, ...]], expire_before: float) -> None:
+    # Only rows still there are updated: a shift ended by another process stays ended
+    conn.executemany(
+        """
+        UPDATE driver_presence SET last_seen = MAX(last_seen, ?3), lat = COALESCE(?4, lat), lon = COALESCE(?5, lon)
+        WHERE tg_id = ?1
+        """,
+        [(tg_id, online_since, last_seen, lat, lon) for tg_id, online_since, last_seen, lat, lon in rows],
+    )
+    conn.execute("DELETE FROM driver_presence WHERE last_seen < ?", (expire_before,))
+
+
+@traced
+async def save_presence(rows: List[Tuple[Any, ...]], expire_before: float = 0.0) -> None:
+    """Write (tg_id, online_since, last_seen, lat, lon) ``rows`` to the shifts still on record; end those silent
+    since ``expire_before``."""
+    await _write(_save_presence_op, rows, expire_before)
+
+
+@traced
+async def load_presence() -> List[Tuple[Any, ...]]:
+    async with _connect() as db:
+        async with db.execute("SELECT tg_id, online_since, last_seen, lat, lon FROM driver_presence") as cur:
+            rows = await cur.fetchall()
+            return [tuple(r) for r in rows]
 
 
-async def list_drivers() -> List[Dict[str, Any]]:
-    async with await _get_db() as db:
-        async with db.execute("SELECT tg_id, full_name, added_at FROM drivers ORDER BY added_at DESC") as cur:
-            rows = await cur.fetchall()
-            return [dict(r) for r in rows]
+def _save_driver_activity_op(conn: sqlite3.Connection, rows: List[Tuple[int, float]]) -> None:
+    # Rows of passengers are dropped here rather than looked up by the caller
+    conn.executemany(
+        """
+        INSERT INTO driver_activity (tg_id, last_seen)
+        SELECT ?1, ?2 WHERE EXISTS (SELECT 1 FROM drivers WHERE tg_id = ?1)
+        ON CONFLICT(tg_id) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)
+        """,
+        rows,
+    )
 
 
-# Orders
-async def create_order(passenger_tg_id: int, pickup: str, destination: str) -> int:
-    async with await _get_db() as db:
-        cur = await db.execute(
-            "INSERT INTO orders (passenger_tg_id, pickup, destination, status) VALUES (?, ?, ?, 'new')",
-            (passenger_tg_id, pickup, destination),
-        )
-        await db.commit()
-        return cur.lastrowid
+@traced
+async def save_driver_activity(rows: List[Tuple[int, float]]) -> None:
+    """Record (tg_id, last_seen) heartbeats; ids that are not drivers are ignored."""
+    await _write(_save_driver_activity_op, rows)
+
+
+@traced
+async def load_driver_activity(tg_id: int) -> Optional[float]:
+    async with _connect() as db:
+        async with db.execute("SELECT last_seen FROM driver_activity WHERE tg_id=?", (tg_id,)) as cur:
+            row = await cur.fetchone()
+            return float(row[0]) if row else None
+
+
+# Offers of new orders sent to drivers (see app.dispatch)
+def _add_order_offer_op(conn: sqlite3.Connection, order_id: int, chat_id: int, message_id: int) -> None:
+    conn.execute(
+        "INSERT OR IGNORE INTO order_offers (order_id, chat_id, message_id) VALUES (?, ?, ?)",
+        (order_id, chat_id, message_id),
+    )
+
+
+@traced
+async def add_order_offer(order_id: int, chat_id: int, message_id: int) -> None:
+    await _write(_add_order_offer_op, order_id, chat_id, message_id)
+
+
+def _take_order_offers_op(
+    conn: sqlite3.Connection, order_id: int, chat_id: Optional[int], message_id: Optional[int]
+) -> List[Tuple[int, int]]:
+    if message_id is None:
+        rows = conn.execute(
+            "DELETE FROM order_offers WHERE order_id=? RETURNING chat_id, message_id", (order_id,)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "DELETE FROM order_offers WHERE order_id=? AND chat_id=? AND message_id=? RETURNING chat_id, message_id",
+            (order_id, chat_id, message_id),
+        ).fetchall()
+    return [(int(r[0]), int(r[1])) for r in rows]
+
+
+@traced
+async def take_order_offers(
+    order_id: int, chat_id: Optional[int] = None, message_id: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    """Forget the offers of an order (or just one of them) and return the (chat_id, message_id) pairs removed.
+
+    Each offer is returned to one caller only, so two processes retracting
+    the same order do not edit its messages twice.
+    """
+    return await _write(_take_order_offers_op, order_id, chat_id, message_id)
+
 
+# Update offset and carried-over updates (see app.lifecycle)
+def _save_update_offset_op(conn: sqlite3.Connection, offset: int) -> None:
+    conn.execute(
+        "INSERT INTO bot_state (key, value) VALUES ('update_offset', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        (str(offset),),
+    )
 
+
+@traced
+async def save_update_offset(offset: int) -> None:
+    await _write(_save_update_offset_op, offset)
+
+
+@traced
+async def load_update_offset() -> int:
+    """The getUpdates offset a stopping process left behind, or 0."""
+    async with _connect() as db:
+        async with db.execute("SELECT value FROM bot_state WHERE key='update_offset'") as cur:
+            row = await cur.fetchone()
+            return int(row[0]) if row else 0
+
+
+def _save_pending_updates_op(conn: sqlite3.Connection, rows: List[Tuple[int, str]]) -> None:
+    conn.executemany("INSERT OR REPLACE INTO pending_updates (update_id, payload) VALUES (?, ?)", rows)
+
+
+@traced
+async def save_pending_updates(rows: List[Tuple[int, str]]) -> None:
+    """Keep (update_id, raw JSON) of updates that could not be finished for the next process."""
+    await _write(_save_pending_updates_op, rows)
+
+
+def _take_pending_updates_op(conn: sqlite3.Connection) -> List[Tuple[int, str]]:
+    rows = conn.execute("DELETE FROM pending_updates RETURNING update_id, payload").fetchall()
+    return sorted((r[0], r[1]) for r in rows)
+
+
+@traced
+async def take_pending_updates() -> List[Tuple[int, str]]:
+    """Claim the carried-over updates, oldest first; each is handed to one process only."""
+    return await _write(_take_pending_updates_op)
+
+
+# Orders
+def _invalidate_order_caches(passenger_tg_id: Optional[int], driver_tg_id: Optional[int]) -> None:
+    if passenger_tg_id is not None:
+        _passenger_orders_cache.invalidate(passenger_tg_id)
+    if driver_tg_id is not None:
+        _driver_orders_cache.invalidate(driver_tg_id)
+
+
+def _create_order_op(
+    conn: sqlite3.Connection,
+    passenger_tg_id: int,
+    pickup: str,
+    destination: str,
+    pickup_lat: Optional[float],
+    pickup_lon: Optional[float],
+) -> int:
+    cur = conn.execute(
+        """
+        INSERT INTO orders (passenger_tg_id, pickup, destination, status, pickup_lat, pickup_lon)
+        VALUES (?, ?, ?, 'new', ?, ?)
+        """,
+        (passenger_tg_id, pickup, destination, pickup_lat, pickup_lon),
+    )
+    record_created(conn)
+    return cur.lastrowid
+
+
+@traced
+async def create_order(
+    passenger_tg_id: int,
+    pickup: str,
+    destination: str,
+    pickup_lat: Optional[float] = None,
+    pickup_lon: Optional[float] = None,
+) -> int:
+    order_id = await _write(_create_order_op, passenger_tg_id, pickup, destination, pickup_lat, pickup_lon)
+    _invalidate_order_caches(passenger_tg_id, None)
+    return order_id
+
+
+@traced
 async def get_order(order_id: int) -> Optional[Dict[str, Any]]:
-    async with await _get_db() as db:
-        async with db.execute("SELECT * FROM orders WHERE id=?", (order_id,)) as cur:
+    """Look the order up among live orders first, then in the archive."""
+    async with _connect() as db:
+        async with db.execute(_SQL_GET_ORDER, (order_id,)) as cur:
             row = await cur.fetchone()
-            return dict(row) if row else None
+        if row is None:
+            async with db.execute(_SQL_GET_ARCHIVED_ORDER, (order_id,)) as cur:
+                row = await cur.fetchone()
+    return dict(row) if row else None
 
 
+@traced
 async def list_new_orders(limit: int = 10) -> List[Dict[str, Any]]:
-    async with await _get_db() as db:
+    async with _connect() as db:
         async with db.execute(
-            "SELECT * FROM orders WHERE status='new' ORDER BY created_at ASC LIMIT ?",
+            _SQL_LIST_NEW_ORDERS,
             (limit,),
         ) as cur:
             rows = await cur.fetchall()
             return [dict(r) for r in rows]
 
 
-async def driver_accept_order(order_id: int, driver_tg_id: int) -> bool:
-    async with await _get_db() as db:
-        cur = await db.execute(
-            """
-            UPDATE orders
-            SET status='accepted', driver_tg_id=?, updated_at=CURRENT_TIMESTAMP
-            WHERE id=? AND status='new'
-            """,
-            (driver_tg_id, order_id),
-        )
-        await db.commit()
-        return cur.rowcount == 1
+@traced
+async def page_orders(
+    status: Optional[str] = None,
+    driver_tg_id: Optional[int] = None,
+    passenger_tg_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = 10,
+) -> Tuple[List[Dict[str, Any]], bool, bool]:
+    """One page of live (not archived) orders, newest first, by keyset on id.
+
+    Each filter alone is an index range ending at the cursor, so a page reads
+    at most ``limit + 1`` rows however large the table is. Returns
+    (rows, has_prev, has_next) like page_drivers.
+    """
+    filters: List[str] = []
+    params: List[Any] = []
+    for name, value in (("status", status), ("driver_tg_id", driver_tg_id), ("passenger_tg_id", passenger_tg_id)):
+        if value is not None:
+            filters.append(name)
+            params.append(value)
+    cursor: Optional[str] = None
+    if after_id is not None:
+        cursor = "next"
+        params.append(after_id)
+    elif before_id is not None:
+        cursor = "prev"
+        params.append(before_id)
+    params.append(limit + 1)
+    async with _connect() as db:
+        async with db.execute(_orders_page_sql(filters, cursor), params) as cur:
+            return keyset_page(await cur.fetchall(), limit, cursor)
+
+
+@traced
+async def iter_orders(since: str, until: str, chunk: int = 1000) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """Stream ORDER_COLUMNS rows of live and archived orders created in [since, until), ``chunk`` at a time.
+
+    One statement reads one snapshot, so orders archived meanwhile are
+    neither missed nor repeated.
+    """
+    async with _connect() as db:
+        async with db.execute(_SQL_EXPORT_ORDERS, (since, until, since, until)) as cur:
+            while True:
+                rows = await cur.fetchmany(chunk)
+                if not rows:
+                    return
+                yield [tuple(r) for r in rows]
+
+
+@traced
+async def get_new_orders(order_ids: List[int]) -> List[Dict[str, Any]]:
+    """The orders among ``order_ids`` that are still open, in no particular order."""
+    if not order_ids:
+        return []
+    placeholders = ", ".join("?" * len(order_ids))
+    async with _connect() as db:
+        async with db.execute(
+            f"SELECT * FROM orders WHERE id IN ({placeholders}) AND status='new'",
+            tuple(order_ids),
+        ) as cur:
+            rows = await cur.fetchall()
+            return [dict(r) for r in rows]
 
 
-async def driver_mark_arrived(order_id: int, driver_tg_id: int) -> bool:
-    async with await _get_db() as db:
-        cur = await db.execute(
-            """
-            UPDATE orders
-            SET status='arrived', updated_at=CURRENT_TIMESTAMP
-            WHERE id=? AND driver_tg_id=? AND status='accepted'
-            """,
-            (order_id, driver_tg_id),
-        )
-        await db.commit()
-        return cur.rowcount == 1
+@traced
+async def list_open_order_locations() -> List[Tuple[int, float, float]]:
+    async with _connect() as db:
+        async with db.execute(_SQL_OPEN_ORDER_LOCATIONS) as cur:
+            rows = await cur.fetchall()
+            return [(int(r["id"]), float(r["pickup_lat"]), float(r["pickup_lon"])) for r in rows]
+
+
+def _transition_order_op(
+    conn: sqlite3.Connection, order_id: int, sql: str, params: Tuple[Any, ...]
+) -> Optional[sqlite3.Row]:
+    # The writer holds the write lock, so the status read here is the one the UPDATE replaces
+    prev = conn.execute("SELECT status FROM orders WHERE id=?", (order_id,)).fetchone()
+    row = conn.execute(sql, params).fetchone()
+    if row is not None:
+        record_transition(conn, prev["status"], row)
+        conn.execute(_SQL_ADD_ORDER_EVENT, (row["id"], row["passenger_tg_id"], row["driver_tg_id"], row["status"]))
+    return row
+
 
+async def _transition_order(
+    order_id: int, sql: str, params: Tuple[Any, ...], driver_tg_id: Optional[int]
+) -> Optional[Dict[str, Any]]:
+    # The UPDATE returns the row so both sides of the order can be invalidated
+    row = await _write(_transition_order_op, order_id, sql, params)
+    if row is None:
+        return None
+    _invalidate_order_caches(row["passenger_tg_id"], driver_tg_id)
+    return dict(row)
 
+
+@traced
+async def driver_accept_order(order_id: int, driver_tg_id: int) -> bool:
+    return await _transition_order(
+        order_id,
+        """
+        UPDATE orders
+        SET status='accepted', driver_tg_id=?, updated_at=CURRENT_TIMESTAMP, accepted_at=CURRENT_TIMESTAMP
+        WHERE id=? AND status='new'
+        RETURNING *
+        """,
+        (driver_tg_id, order_id),
+        driver_tg_id,
+    ) is not None
+
+
+@traced
+async def driver_mark_arrived(order_id: int, driver_tg_id: int) -> bool:
+    return await _transition_order(
+        order_id,
+        """
+        UPDATE orders
+        SET status='arrived', updated_at=CURRENT_TIMESTAMP
+        WHERE id=? AND driver_tg_id=? AND status='accepted'
+        RETURNING *
+        """,
+        (order_id, driver_tg_id),
+        driver_tg_id,
+    ) is not None
+
+
+@traced
 async def driver_complete_order(order_id: int, driver_tg_id: int) -> bool:
-    async with await _get_db() as db:
-        cur = await db.execute(
-            """
-            UPDATE orders
-            SET status='completed', updated_at=CURRENT_TIMESTAMP
-            WHERE id=? AND driver_tg_id=? AND status IN ('accepted', 'arrived')
-            """,
-            (order_id, driver_tg_id),
-        )
-        await db.commit()
-        return cur.rowcount == 1
+    return await _transition_order(
+        order_id,
+        """
+        UPDATE orders
+        SET status='completed', updated_at=CURRENT_TIMESTAMP, completed_at=CURRENT_TIMESTAMP
+        WHERE id=? AND driver_tg_id=? AND status IN ('accepted', 'arrived')
+        RETURNING *
+        """,
+        (order_id, driver_tg_id),
+        driver_tg_id,
+    ) is not None
+
+
+@traced
+async def expire_order(order_id: int, ttl: float) -> Optional[Dict[str, Any]]:
+    """Mark an order nobody took within ``ttl`` seconds as expired; returns it, or None if it moved on."""
+    return await _transition_order(
+        order_id,
+        """
+        UPDATE orders
+        SET status='expired', updated_at=CURRENT_TIMESTAMP
+        WHERE id=? AND status='new' AND updated_at <= datetime('now', ?)
+        RETURNING *
+        """,
+        (order_id, f"{-float(ttl)} seconds"),
+        None,
+    )
+
+
+@traced
+async def release_order(order_id: int, driver_tg_id: int) -> Optional[Dict[str, Any]]:
+    """Take an accepted order away from ``driver_tg_id`` and reopen it; None if it moved on."""
+    return await _transition_order(
+        order_id,
+        """
+        UPDATE orders
+        SET status='new', driver_tg_id=NULL, accepted_at=NULL, updated_at=CURRENT_TIMESTAMP
+        WHERE id=? AND driver_tg_id=? AND status='accepted'
+        RETURNING *
+        """,
+        (order_id, driver_tg_id),
+        driver_tg_id,
+    )
+
+
+@traced
+async def list_pending_orders() -> List[Dict[str, Any]]:
+    """Orders still waiting for a driver or for the driver to arrive, for the expiry timers."""
+    async with _connect() as db:
+        async with db.execute(_SQL_PENDING_ORDERS) as cur:
+            rows = await cur.fetchall()
+            return [dict(r) for r in rows]
 
 
+@traced
 async def get_driver_active_order(driver_tg_id: int) -> Optional[Dict[str, Any]]:
-    async with await _get_db() as db:
+    cached = _driver_orders_cache.get(driver_tg_id)
+    if cached is not MISSING:
+        return dict(cached) if cached else None
+    epoch = _driver_orders_cache.epoch
+    async with _connect() as db:
         async with db.execute(
-            "SELECT * FROM orders WHERE driver_tg_id=? AND status IN ('accepted','arrived') ORDER BY updated_at DESC LIMIT 1",
+            _SQL_DRIVER_ACTIVE_ORDER,
             (driver_tg_id,),
         ) as cur:
             row = await cur.fetchone()
-            return dict(row) if row else None
+    order = dict(row) if row else None
+    _driver_orders_cache.set(driver_tg_id, order, epoch)
+    return dict(order) if order else None
 
 
+@traced
 async def get_passenger_active_order(passenger_tg_id: int) -> Optional[Dict[str, Any]]:
-    async with await _get_db() as db:
+    cached = _passenger_orders_cache.get(passenger_tg_id)
+    if cached is not MISSING:
+        return dict(cached) if cached else None
+    epoch = _passenger_orders_cache.epoch
+    async with _connect() as db:
         async with db.execute(
-            "SELECT * FROM orders WHERE passenger_tg_id=? AND status IN ('new','accepted','arrived') ORDER BY created_at DESC LIMIT 1",
+            _SQL_PASSENGER_ACTIVE_ORDER,
             (passenger_tg_id,),
         ) as cur:
             row = await cur.fetchone()
-            return dict(row) if row else None
+    order = dict(row) if row else None
+    _passenger_orders_cache.set(passenger_tg_id, order, epoch)
+    return dict(order) if order else None
 
 
+@traced
 async def order_stats() -> Dict[str, int]:
+    """Order count in total and per status, read from the maintained counters."""
     result: Dict[str, int] = {"total": 0}
-    async with await _get_db() as db:
-        async with db.execute("SELECT COUNT(*) as cnt FROM orders") as cur:
-            row = await cur.fetchone()
-            result["total"] = int(row["cnt"]) if row else 0
+    async with _connect() as db:
+        async with db.execute("SELECT status, cnt FROM order_counters WHERE cnt > 0 ORDER BY status") as cur:
+            rows = await cur.fetchall()
+    for r in rows:
+        result[str(r["status"])] = int(r["cnt"])
+        result["total"] += int(r["cnt"])
+    return result
+
+
+@traced
+async def order_activity(hours: int = 24) -> Dict[str, Any]:
+    """Totals over the last ``hours`` hourly rollups, including average wait and ride times."""
+    async with _connect() as db:
         async with db.execute(
-            "SELECT status, COUNT(*) as cnt FROM orders GROUP BY status"
+            """
+            SELECT COALESCE(SUM(created), 0) AS created,
+                   COALESCE(SUM(accepted), 0) AS accepted,
+                   COALESCE(SUM(completed), 0) AS completed,
+                   COALESCE(SUM(expired), 0) AS expired,
+                   COALESCE(SUM(wait_secs), 0) AS wait_secs,
+                   COALESCE(SUM(wait_n), 0) AS wait_n,
+                   COALESCE(SUM(ride_secs), 0) AS ride_secs,
+                   COALESCE(SUM(ride_n), 0) AS ride_n
+            FROM order_rollups
+            WHERE bucket > strftime('%Y-%m-%d %H', 'now', ?)
+            """,
+            (f"-{int(hours)} hours",),
         ) as cur:
-            rows = await cur.fetchall()
-            for r in rows:
-                result[str(r["status"])]= int(r["cnt"])  # type: ignore[index]
-    return result
\ No newline at end of file
+            row = await cur.fetchone()
+    return {
+        "created": int(row["created"]),
+        "accepted": int(row["accepted"]),
+        "completed": int(row["completed"]),
+        "expired": int(row["expired"]),
+        "avg_wait_secs": row["wait_secs"] / row["wait_n"] if row["wait_n"] else None,
+        "avg_ride_secs": row["ride_secs"] / row["ride_n"] if row["ride_n"] else None,
+    }
+
+
+# Order events (see app.feed)
+def _claim_order_events_op(
+    conn: sqlite3.Connection, owner: str, lease: float, limit: int
+) -> Optional[List[sqlite3.Row]]:
+    row = conn.execute("SELECT value FROM bot_state WHERE key='order_feed_lease'").fetchone()
+    now = time.time()
+    if row is not None:
+        holder, _, until = row[0].rpartition(" ")
+        if holder != owner and float(until) > now:
+            return None
+    conn.execute(
+        "INSERT INTO bot_state (key, value) VALUES ('order_feed_lease', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        (f"{owner} {now + lease}",),
+    )
+    row = conn.execute("SELECT value FROM bot_state WHERE key='order_feed_seq'").fetchone()
+    return conn.execute(_SQL_ORDER_EVENTS, (int(row[0]) if row else 0, limit)).fetchall()
+
+
+@traced
+async def claim_order_events(owner: str, lease: float = 30.0, limit: int = 100) -> Optional[List[Dict[str, Any]]]:
+    """The next ``limit`` order events to push, oldest first, or None while another process pushes them.
+
+    Claiming takes or renews a lease of ``lease`` seconds on the feed for
+    ``owner``. Only ack_order_events() moves the cursor, so the events of a
+    holder that dies mid-batch are pushed again by the next one.
+    """
+    rows = await _write(_claim_order_events_op, owner, lease, limit)
+    return None if rows is None else [dict(r) for r in rows]
+
+
+def _ack_order_events_op(conn: sqlite3.Connection, seq: int) -> None:
+    conn.execute(
+        "INSERT INTO bot_state (key, value) VALUES ('order_feed_seq', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value=MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+        (str(seq),),
+    )
+
+
+@traced
+async def ack_order_events(seq: int) -> None:
+    """Mark the order events up to ``seq`` as pushed."""
+    await _write(_ack_order_events_op, seq)
+
+
+def _release_order_feed_op(conn: sqlite3.Connection, owner: str) -> None:
+    conn.execute("DELETE FROM bot_state WHERE key='order_feed_lease' AND value LIKE ?", (f"{owner} %",))
+
+
+@traced
+async def release_order_feed(owner: str) -> None:
+    """Give the feed lease up so another process can take over without waiting for it to lapse."""
+    await _write(_release_order_feed_op, owner)
+
+
+def _prune_order_events_op(conn: sqlite3.Connection, older_than_hours: float, batch: int) -> int:
+    row = conn.execute("SELECT value FROM bot_state WHERE key='order_feed_seq'").fetchone()
+    if row is None:
+        return 0
+    return conn.execute(
+        """
+        DELETE FROM order_events WHERE seq IN (
+            SELECT seq FROM order_events WHERE seq <= ? AND created_at < datetime('now', ?) ORDER BY seq LIMIT ?
+        )
+        """,
+        (int(row[0]), f"{-float(older_than_hours)} hours", batch),
+    ).rowcount
+
+
+@traced
+async def prune_order_events(older_than_hours: float = 24.0, batch: int = 500) -> int:
+    """Delete up to ``batch`` pushed order events older than ``older_than_hours``."""
+    return await _write(_prune_order_events_op, older_than_hours, batch)
+
+
+# Archive
+def _archive_orders_op(conn: sqlite3.Connection, older_than_hours: float, batch: int) -> int:
+    ids = [
+        r[0]
+        for r in conn.execute(
+            _SQL_FINISHED_ORDERS,
+            (f"{-float(older_than_hours)} hours", batch),
+        )
+    ]
+    if not ids:
+        return 0
+    placeholders = ", ".join("?" * len(ids))
+    columns = ", ".join(ORDER_COLUMNS)
+    conn.execute(
+        f"INSERT OR REPLACE INTO orders_archive ({columns}) SELECT {columns} FROM orders WHERE id IN ({placeholders})",
+        ids,
+    )
+    conn.execute(f"DELETE FROM orders WHERE id IN ({placeholders})", ids)
+    # Offers left behind by a process that stopped before retracting them
+    conn.execute(f"DELETE FROM order_offers WHERE order_id IN ({placeholders})", ids)
+    return len(ids)
+
+
+@traced
+async def archive_orders(older_than_hours: float = 24.0, batch: int = 500) -> int:
+    """Move up to ``batch`` orders completed or expired more than ``older_than_hours`` ago to orders_archive.
+
+    Statistics are unaffected: order_counters and order_rollups are kept by
+    the status transitions, not derived from the orders table.
+    """
+    return await _write(_archive_orders_op, older_than_hours, batch)
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from typing import Any, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.methods import EditMessageText, SendMessage, TelegramMethod
+
+from app.db import add_order_offer, take_order_offers
+from app.keyboards import list_orders_kb
+from app.outbox import BROADCAST, RateLimiter, deliver
+from app.presence import online_driver_ids
+from app.render import order_line
+from app.repository import get_order
+
+
+class _Fanout:
+    __slots__ = ("order_id", "closed")
+
+    def __init__(self, order_id: int) -> None:
+        self.order_id = order_id
+        # Set once this process has retracted the order; offers still queued are not sent
+        self.closed = False
+
+
+def _closed_text(order_id: int, reason: str, chat_id: int, taken_by: Optional[int]) -> str:
+    if chat_id == taken_by:
+        return f"Заказ #{order_id} принят вами."
+    return f"Заказ #{order_id} {reason}."
+
+
+class OrderDispatch:
+    """Pushes new orders to on-shift drivers and retracts the offers once one is taken or expires.
+
+    Sent offers are recorded in the order_offers table rather than in this
+    process, so the process that sees the order accepted or expired
+    withdraws the offers of every process. An offer that lands after its
+    order was retracted is withdrawn by the process that sent it.
+    """
+
+    def __init__(self, bot: Bot, rate: float = 25.0, concurrency: int = 8, max_tracked: int = 1000) -> None:
+        self._bot = bot
+        self._limiter = RateLimiter(rate)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._max_tracked = max_tracked
+        self._fanouts: OrderedDict[int, _Fanout] = OrderedDict()
+
+    async def _call(self, method: TelegramMethod[Any]) -> Any:
+        # The outbox owns retries and the global/per-chat limits; this only
+        # caps how much of the budget order fan-out may take
+        async with self._semaphore:
+            await self._limiter.wait()
+            return await deliver(method.as_(self._bot), lane=BROADCAST)
+
+    async def _retract_message(self, text: str, chat_id: int, message_id: int) -> None:
+        await self._call(EditMessageText(text=text, chat_id=chat_id, message_id=message_id))
+
+    async def _offer(self, fanout: _Fanout, driver_id: int, text: str) -> None:
+        if fanout.closed:
+            return
+        message = await self._call(
+            SendMessage(chat_id=driver_id, text=text, reply_markup=list_orders_kb([fanout.order_id]))
+        )
+        if message is None:
+            return
+        await add_order_offer(fanout.order_id, driver_id, message.message_id)
+        # Recorded before looking at the order: a retraction that comes after
+        # this finds the offer, one that came before left the order taken
+        order = await get_order(fanout.order_id)
+        status = order["status"] if order is not None else None
+        if status == "new" and not fanout.closed:
+            return
+        if await take_order_offers(fanout.order_id, driver_id, message.message_id):
+            # The order was taken or expired while this offer was in flight
+            reason = "снят: никто не взял" if status == "expired" else "уже взят"
+            taken_by = order["driver_tg_id"] if order is not None else None
+            text = _closed_text(fanout.order_id, reason, driver_id, taken_by)
+            await self._retract_message(text, driver_id, message.message_id)
+
+    async def announce(self, order_id: int, pickup: str, destination: str) -> None:
+        fanout = _Fanout(order_id)
+        self._fanouts[order_id] = fanout
+        while len(self._fanouts) > self._max_tracked:
+            self._fanouts.popitem(last=False)
+        text = f"🆕 Новый заказ {order_line(order_id, pickup, destination)}"
+        # Offline drivers still see the order under "Свободные заказы"
+        driver_ids = online_driver_ids()
+        await asyncio.gather(*(self._offer(fanout, driver_id, text) for driver_id in driver_ids))
+
+    async def retract(
+        self,
+        order_id: int,
+        taken_by: Optional[int] = None,
+        reason: str = "уже взят",
+        keep: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        fanout = self._fanouts.pop(order_id, None)
+        if fanout is not None:
+            fanout.closed = True
+        messages = await take_order_offers(order_id)
+        await asyncio.gather(
+            *(self._retract_message(_closed_text(order_id, reason, chat_id, taken_by), chat_id, message_id)
+              for chat_id, message_id in messages if (chat_id, message_id) != keep)
+        )
+
+
+_DISPATCH: OrderDispatch | None = None
+_TASKS: Set[asyncio.Task] = set()
+
+
+def setup_dispatch(bot: Bot, rate: float = 25.0, concurrency: int = 8) -> None:
+    global _DISPATCH
+    _DISPATCH = OrderDispatch(bot, rate=rate, concurrency=concurrency)
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _TASKS.add(task)
+    task.add_done_callback(_TASKS.discard)
+
+
+def announce_order(order_id: int, pickup: str, destination: str) -> None:
+    """Offer a new order to all drivers in the background; no-op without setup_dispatch()."""
+    if _DISPATCH is not None:
+        _spawn(_DISPATCH.announce(order_id, pickup, destination))
+
+
+def retract_order(
+    order_id: int, taken_by: Optional[int] = None, reason: str = "уже взят", keep: Optional[Tuple[int, int]] = None
+) -> None:
+    """Withdraw the offers of an order that ``taken_by`` has just accepted (or that expired).
+
+    The offers ``taken_by`` got are marked as theirs; ``keep`` is the
+    (chat_id, message_id) the order was taken from, which the caller edits.
+    """
+    if _DISPATCH is not None:
+        _spawn(_DISPATCH.retract(order_id, taken_by, reason, keep))
+
+
+async def close_dispatch() -> None:
+    global _DISPATCH
+    _DISPATCH = None
+    if _TASKS:
+        await asyncio.gather(*_TASKS, return_exceptions=True)
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.methods import SendMessage
+from aiogram.types import InlineKeyboardMarkup
+
+from app.repository import expire_order, get_order, list_pending_orders, release_order
+from app.dispatch import announce_order, retract_order
+from app.geo import index_order, unindex_order
+from app.keyboards import driver_menu_kb, passenger_menu_kb
+from app.metrics import REGISTRY, Counter, Gauge
+from app.outbox import NOTIFY, deliver
+from app.presence import is_online, last_active
+from app.render import order_line
+
+logger = logging.getLogger(__name__)
+
+EXPIRE = "expire"
+RELEASE = "release"
+
+ORDER_TIMERS: Gauge = REGISTRY.register(Gauge("bot_order_timers", "Open orders with a pending expiry timer"))
+ORDERS_TIMED_OUT: Counter = REGISTRY.register(
+    Counter("bot_orders_timed_out_total", "Orders expired or taken back from a silent driver", ["action"])
+)
+
+
+def _epoch(timestamp: str) -> float:
+    # SQLite CURRENT_TIMESTAMP is UTC without a zone
+    return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+
+
+class OrderTimers:
+    """One deadline per open order, fired from a min-heap.
+
+    A ``new`` order expires ``order_ttl`` seconds after it was opened; an
+    ``accepted`` order goes back to the pool once its driver has sent nothing
+    for ``accept_timeout`` seconds. The loop sleeps until the earliest deadline
+    and is woken when an earlier one is added, so nothing polls the orders
+    table. Rescheduling or cancelling only replaces the entry in ``_pending``;
+    superseded heap entries are dropped when they reach the top.
+
+    Every action is a conditional UPDATE, so timers of several processes over
+    the same database can fire for the same order and only one of them wins.
+    A setting of 0 disables the corresponding timer.
+    """
+
+    def __init__(self, order_ttl: float = 900.0, accept_timeout: float = 600.0) -> None:
+        self.order_ttl = order_ttl
+        self.accept_timeout = accept_timeout
+        self._heap: List[Tuple[float, int, str]] = []
+        # order id -> (deadline, kind, driver the order is held by)
+        self._pending: Dict[int, Tuple[float, str, Optional[int]]] = {}
+        self._wake = asyncio.Event()
+        self._bot: Optional[Bot] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _schedule(self, order_id: int, deadline: float, kind: str, driver_tg_id: Optional[int] = None) -> None:
+        self._pending[order_id] = (deadline, kind, driver_tg_id)
+        heapq.heappush(self._heap, (deadline, order_id, kind))
+        if len(self._heap) > 2 * len(self._pending) + 64:
+            self._heap = [(d, oid, k) for oid, (d, k, _) in self._pending.items()]
+            heapq.heapify(self._heap)
+        if self._heap[0][0] == deadline:
+            self._wake.set()
+
+    def expire_at(self, order_id: int, opened_at: float) -> None:
+        if self.order_ttl > 0:
+            self._schedule(order_id, opened_at + self.order_ttl, EXPIRE)
+        else:
+            self.cancel(order_id)
+
+    def release_at(self, order_id: int, driver_tg_id: int, seen_at: float) -> None:
+        if self.accept_timeout > 0:
+            self._schedule(order_id, seen_at + self.accept_timeout, RELEASE, driver_tg_id)
+        else:
+            self.cancel(order_id)
+
+    def cancel(self, order_id: int) -> None:
+        self._pending.pop(order_id, None)
+
+    def track(self, order: Dict[str, Any], not_before: float = 0.0) -> None:
+        """Schedule ``order`` according to its current status and timestamps."""
+        if order["status"] == "new":
+            self.expire_at(order["id"], max(_epoch(order["updated_at"]), not_before - self.order_ttl))
+        elif order["status"] == "accepted" and order["driver_tg_id"] is not None:
+            seen_at = _epoch(order["accepted_at"] or order["updated_at"])
+            self.release_at(order["id"], order["driver_tg_id"], max(seen_at, not_before - self.accept_timeout))
+        else:
+            self.cancel(order["id"])
+
+    async def load(self) -> int:
+        """Schedule every open order in the database; returns how many were scheduled."""
+        for order in await list_pending_orders():
+            self.track(order)
+        return len(self._pending)
+
+    def _due(self, now: float) -> List[Tuple[int, str, Optional[int]]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, order_id, kind = heapq.heappop(self._heap)
+            entry = self._pending.get(order_id)
+            if entry is None or entry[0] != deadline or entry[1] != kind:
+                continue
+            del self._pending[order_id]
+            due.append((order_id, kind, entry[2]))
+        return due
+
+    async def run(self) -> None:
+        while True:
+            self._wake.clear()
+            for order_id, kind, driver_tg_id in self._due(time.time()):
+                try:
+                    if kind == EXPIRE:
+                        await self._expire(order_id)
+                    else:
+                        await self._release(order_id, driver_tg_id)
+                except Exception:
+                    logger.exception("Order timer for #%s failed", order_id)
+            delay = max(0.0, self._heap[0][0] - time.time()) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _resync(self, order_id: int) -> None:
+        # The order changed under us (taken, finished, or touched by another
+        # process); follow its current state, at least a second from now
+        order = await get_order(order_id)
+        if order is not None:
+            self.track(order, not_before=time.time() + 1.0)
+
+    async def _expire(self, order_id: int) -> None:
+        order = await expire_order(order_id, self.order_ttl)
+        if order is None:
+            await self._resync(order_id)
+            return
+        ORDERS_TIMED_OUT.inc("expired")
+        unindex_order(order_id)
+        retract_order(order_id, reason="снят: никто не взял")
+        self._notify(
+            order["passenger_tg_id"],
+            f"Заказ {order_line(order_id, order['pickup'], order['destination'])} отменен — "
+            "свободных водителей не нашлось. Попробуйте вызвать такси еще раз.",
+            passenger_menu_kb(has_active=False),
+        )
+
+    async def _release(self, order_id: int, driver_tg_id: int) -> None:
+        seen = await last_active(driver_tg_id)
+        if seen is None:
+            # Nothing on record (say, a crash before the first heartbeat was written):
+            # no proof of silence, so look again after another timeout
+            self.release_at(order_id, driver_tg_id, time.time())
+            return
+        if seen + self.accept_timeout > time.time():
+            # The driver is still active; check again once they could have gone silent
+            self.release_at(order_id, driver_tg_id, seen)
+            return
+        order = await release_order(order_id, driver_tg_id)
+        if order is None:
+            await self._resync(order_id)
+            return
+        ORDERS_TIMED_OUT.inc("released")
+        logger.info("Order #%s taken back from silent driver %s", order_id, driver_tg_id)
+        if order["pickup_lat"] is not None and order["pickup_lon"] is not None:
+            index_order(order_id, order["pickup_lat"], order["pickup_lon"])
+        announce_order(order_id, order["pickup"], order["destination"])
+        self.expire_at(order_id, time.time())
+        self._notify(
+            order["passenger_tg_id"],
+            f"Водитель не выходит на связь. Ищем другого водителя для заказа #{order_id}.",
+            passenger_menu_kb(has_active=True),
+        )
+        self._notify(
+            driver_tg_id,
+            f"Заказ #{order_id} снят с вас: от вас не было ответа. Он снова доступен другим водителям.",
+            driver_menu_kb(has_active=False, on_shift=is_online(driver_tg_id)),
+        )
+
+    def _notify(self, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup) -> None:
+        if self._bot is not None:
+            deliver(SendMessage(chat_id=chat_id, text=text, reply_markup=reply_markup).as_(self._bot), lane=NOTIFY)
+
+
+_TIMERS = OrderTimers()
+_TASK: Optional[asyncio.Task] = None
+
+ORDER_TIMERS.set_function(lambda: len(_TIMERS))
+
+
+def schedule_expiry(order_id: int) -> None:
+    """Start the clock on an order that has just been opened."""
+    _TIMERS.expire_at(order_id, time.time())
+
+
+def schedule_release(order_id: int, driver_tg_id: int) -> None:
+    """Start watching the driver who has just accepted ``order_id``."""
+    _TIMERS.release_at(order_id, driver_tg_id, time.time())
+
+
+def cancel_timer(order_id: int) -> None:
+    _TIMERS.cancel(order_id)
+
+
+async def start_expiry(bot: Bot, order_ttl: float = 900.0, accept_timeout: float = 600.0) -> None:
+    """Schedule the open orders found in the database and start firing their timers."""
+    global _TASK
+    _TIMERS._bot = bot
+    _TIMERS.order_ttl = order_ttl
+    _TIMERS.accept_timeout = accept_timeout
+    loaded = await _TIMERS.load()
+    logger.info("Order timers: %d open orders scheduled", loaded)
+    if _TASK is None:
+        _TASK = asyncio.create_task(_TIMERS.run())
+
+
+async def stop_expiry() -> None:
+    global _TASK
+    if _TASK is None:
+        return
+    task, _TASK = _TASK, None
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import uuid
+from html import escape
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.methods import SendMessage
+
+from app.db import ack_order_events, claim_order_events, release_order_feed
+from app.keyboards import passenger_menu_kb
+from app.metrics import REGISTRY, Counter
+from app.outbox import NOTIFY, deliver
+
+logger = logging.getLogger(__name__)
+
+ORDER_EVENTS_PUSHED: Counter = REGISTRY.register(
+    Counter("bot_order_events_pushed_total", "Order status changes pushed to passengers", ["status"])
+)
+
+# Status -> message to the passenger. Expiry and release are told by app.expiry.
+_MESSAGES = {
+    "accepted": "Водитель{driver} принял заказ #{order_id} и едет к вам.",
+    "arrived": "Водитель{driver} на месте. Выходите, заказ #{order_id}.",
+    "completed": "Поездка по заказу #{order_id} завершена. Спасибо, что выбрали нас!",
+}
+
+
+def _text(event: Dict[str, Any]) -> str:
+    name = event["driver_name"]
+    driver = f" {escape(name, quote=False)}" if name else ""
+    return _MESSAGES[event["status"]].format(driver=driver, order_id=event["order_id"])
+
+
+class OrderFeed:
+    """Pushes the order event log (order_events, see app.db) to the passengers' chats.
+
+    The events are read on from a cursor kept in the database, which only
+    moves past an event once its message was delivered, so after a restart
+    the feed resumes with the first event that was not (an event may be
+    sent twice, never lost). A send that fails (outbox full, network error,
+    flood limits) stops the cursor there and the rest of the batch is pushed
+    again after a backoff of up to ``max_backoff`` seconds; a message that
+    still fails after ``max_attempts`` pushes (a passenger who blocked the
+    bot, say) is given up with a warning. Several processes can
+    share a database: one of them holds a lease on the feed and pushes,
+    the others take over once it lapses.
+
+    Handlers call :meth:`wake` after a transition so that it is pushed
+    right away; events written by other processes are picked up within
+    ``poll_interval`` seconds. When a batch has several events for one
+    order only the latest is sent.
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = 2.0,
+        batch: int = 100,
+        lease: float = 30.0,
+        max_attempts: int = 5,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        # seq -> pushes that failed to deliver it
+        self._attempts: Dict[int, int] = {}
+        self._backoff = 0.0
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._bot: Optional[Bot] = None
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    async def push(self) -> int:
+        """Push one batch; returns how many events were acknowledged, 0 if none (or the feed is elsewhere)."""
+        if self._bot is None:
+            return 0
+        events = await claim_order_events(self.owner, self.lease, self.batch)
+        if not events:
+            return 0
+        latest: Dict[int, Dict[str, Any]] = {}
+        for event in events:
+            latest.pop(event["order_id"], None)
+            latest[event["order_id"]] = event
+        sent = []
+        sends = []
+        for event in latest.values():
+            if event["status"] not in _MESSAGES:
+                continue
+            method = SendMessage(
+                chat_id=event["passenger_tg_id"],
+                text=_text(event),
+                reply_markup=passenger_menu_kb(has_active=event["status"] != "completed"),
+            )
+            sent.append(event)
+            sends.append(deliver(method.as_(self._bot), lane=NOTIFY))
+        # Failed sends resolve to None; the cursor stops before the first of them
+        stop_at: Optional[int] = None
+        for event, result in sorted(zip(sent, await asyncio.gather(*sends)), key=lambda pair: pair[0]["seq"]):
+            if result is not None:
+                ORDER_EVENTS_PUSHED.inc(event["status"])
+                continue
+            attempts = self._attempts.get(event["seq"], 0) + 1
+            if attempts < self.max_attempts:
+                self._attempts[event["seq"]] = attempts
+                stop_at = event["seq"]
+                break
+            logger.warning(
+                "Giving up on order %d event %r for chat %d after %d attempts",
+                event["order_id"], event["status"], event["passenger_tg_id"], attempts,
+            )
+        acked = [event for event in events if stop_at is None or event["seq"] < stop_at]
+        if acked:
+            await ack_order_events(acked[-1]["seq"])
+        last = acked[-1]["seq"] if acked else 0
+        self._attempts = {seq: n for seq, n in self._attempts.items() if seq > last}
+        if stop_at is None:
+            self._backoff = 0.0
+        else:
+            self._backoff = min(self.max_backoff, max(self.poll_interval, self._backoff * 2))
+        return len(acked)
+
+    async def run(self) -> None:
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                pushed = await self.push()
+            except Exception:
+                logger.exception("Order feed failed")
+                pushed = 0
+            if self._backoff:
+                # Wakes from new transitions would only hit the same failing send again
+                await self._sleep(self._backoff)
+                continue
+            if pushed == self.batch:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sleep(self, delay: float) -> None:
+        deadline = asyncio.get_running_loop().time() + delay
+        while not self._stopping:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+
+_FEED = OrderFeed()
+_TASK: Optional[asyncio.Task] = None
+
+
+def wake_feed() -> None:
+    """Push the order events written so far without waiting for the next poll."""
+    _FEED.wake()
+
+
+def start_feed(bot: Bot, poll_interval: float = 2.0) -> None:
+    global _TASK
+    _FEED._bot = bot
+    _FEED.poll_interval = poll_interval
+    _FEED._stopping = False
+    if _TASK is None:
+        _TASK = asyncio.create_task(_FEED.run())
+
+
+async def stop_feed(timeout: float = 5.0) -> None:
+    """Let the batch being pushed finish (up to ``timeout`` seconds) and give the lease up."""
+    global _TASK
+    if _TASK is None:
+        return
+    task, _TASK = _TASK, None
+    _FEED._stopping = True
+    _FEED.wake()
+    try:
+        await asyncio.wait_for(task, timeout)
+    except asyncio.TimeoutError:
+        pass
+    except Exception:
+        logger.exception("Order feed failed")
+    try:
+        await release_order_feed(_FEED.owner)
+    except Exception:
+        logger.exception("Failed to release the order feed")
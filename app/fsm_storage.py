@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated_at", "seq")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float, seq: int = 0) -> None:
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+        self.seq = seq
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage kept in the bot's SQLite database.
+
+    Writes land in a pending buffer and are flushed by a background task, so
+    the several state/data writes a single update makes, and the writes of
+    concurrent updates, share one transaction. Recently used keys stay in a
+    small in-process cache. Every write stamps the row with a DB-wide
+    sequence number; whenever ``PRAGMA data_version`` shows that another
+    connection committed, keys rewritten since the last check are evicted,
+    which keeps caches of several processes on the same file consistent.
+    States untouched for ``state_ttl`` seconds are treated as absent and
+    purged in batches.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        key_builder: Optional[KeyBuilder] = None,
+        flush_interval: float = 0.01,
+        cache_size: int = 1024,
+        state_ttl: float = 24 * 3600,
+        purge_interval: float = 600.0,
+        purge_batch: int = 500,
+    ) -> None:
+        self._path = path
+        self._key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._flush_interval = flush_interval
+        self._cache_size = cache_size
+        self._state_ttl = state_ttl
+        self._purge_interval = purge_interval
+        self._purge_batch = purge_batch
+        self._db: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._cache: OrderedDict[str, _Record] = OrderedDict()
+        self._pending: Dict[str, _Record] = {}
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+        self._data_version = 0
+        self._last_seq = 0
+        self._next_purge = 0.0
+
+    async def _connection(self) -> aiosqlite.Connection:
+        if self._db is not None:
+            return self._db
+        async with self._open_lock:
+            if self._db is None:
+                db = await aiosqlite.connect(self._path)
+                await db.execute("PRAGMA journal_mode = WAL;")
+                await db.execute("PRAGMA synchronous = NORMAL;")
+                await db.execute("PRAGMA busy_timeout = 5000;")
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS fsm_storage (
+                        key TEXT PRIMARY KEY,
+                        state TEXT,
+                        data TEXT NOT NULL DEFAULT '{}',
+                        updated_at REAL NOT NULL,
+                        seq INTEGER NOT NULL DEFAULT 0
+                    );
+                    """
+                )
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_seq ON fsm_storage(seq);")
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage(updated_at);")
+                await db.commit()
+                async with db.execute("SELECT COALESCE(MAX(seq), 0) FROM fsm_storage") as cur:
+                    self._last_seq = (await cur.fetchone())[0]
+                async with db.execute("PRAGMA data_version") as cur:
+                    self._data_version = (await cur.fetchone())[0]
+                self._next_purge = time.time() + self._purge_interval
+                self._db = db
+                self._flusher = asyncio.create_task(self._flush_loop())
+        return self._db
+
+    def _expired(self, record: _Record) -> bool:
+        return self._state_ttl > 0 and record.updated_at < time.time() - self._state_ttl
+
+    async def _sync(self, db: aiosqlite.Connection) -> None:
+        # Evict cached keys that another connection has rewritten since the last check
+        # Reads go through execute_fetchall so no half-read cursor keeps a stale
+        # snapshot open while flush() runs BEGIN IMMEDIATE on the same connection
+        ((version,),) = await db.execute_fetchall("PRAGMA data_version")
+        if version == self._data_version:
+            return
+        self._data_version = version
+        rows = await db.execute_fetchall("SELECT key, seq FROM fsm_storage WHERE seq > ?", (self._last_seq,))
+        for key, seq in rows:
+            record = self._cache.get(key)
+            if record is not None and record.seq != seq:
+                del self._cache[key]
+            self._last_seq = max(self._last_seq, seq)
+
+    def _remember(self, key: str, record: _Record) -> None:
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> _Record:
+        record = self._pending.get(key)
+        if record is None:
+            db = await self._connection()
+            await self._sync(db)
+            record = self._cache.get(key)
+            if record is None:
+                rows = await db.execute_fetchall(
+                    "SELECT state, data, updated_at, seq FROM fsm_storage WHERE key=?", (key,)
+                )
+                row = rows[0] if rows else None
+                if row is None:
+                    record = _Record(None, {}, time.time())
+                else:
+                    record = _Record(row[0], json.loads(row[1]), row[2], row[3])
+                self._remember(key, record)
+            else:
+                self._cache.move_to_end(key)
+        if self._expired(record):
+            return _Record(None, {}, time.time())
+        return record
+
+    def _store(self, key: str, record: _Record) -> None:
+        self._pending[key] = record
+        self._remember(key, record)
+        self._wakeup.set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        built = self._key_builder.build(key)
+        current = await self._load(built)
+        value = state.state if isinstance(state, State) else state
+        self._store(built, _Record(value, current.data, time.time(), current.seq))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self._key_builder.build(key))).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        built = self._key_builder.build(key)
+        current = await self._load(built)
+        self._store(built, _Record(current.state, dict(data), time.time(), current.seq))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._load(self._key_builder.build(key))).data)
+
+    async def flush(self) -> None:
+        """Write all pending states in one transaction."""
+        if not self._pending or self._db is None:
+            return
+        db = self._db
+        batch, self._pending = self._pending, {}
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute("SELECT COALESCE(MAX(seq), 0) FROM fsm_storage") as cur:
+                seq = (await cur.fetchone())[0]
+            rows = []
+            for key, record in batch.items():
+                # Cleared states are kept as empty rows so the seq change is visible
+                # to other processes; the purge removes them once they expire
+                seq += 1
+                record.seq = seq
+                rows.append((key, record.state, json.dumps(record.data), record.updated_at, seq))
+            await db.executemany(
+                "INSERT OR REPLACE INTO fsm_storage (key, state, data, updated_at, seq) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            # Put the batch back unless a newer write for the key arrived meanwhile
+            for key, record in batch.items():
+                self._pending.setdefault(key, record)
+            raise
+
+    async def _purge(self) -> None:
+        db = await self._connection()
+        cutoff = time.time() - self._state_ttl
+        while True:
+            cur = await db.execute(
+                "DELETE FROM fsm_storage WHERE key IN "
+                "(SELECT key FROM fsm_storage WHERE updated_at < ? LIMIT ?)",
+                (cutoff, self._purge_batch),
+            )
+            await db.commit()
+            if cur.rowcount < self._purge_batch:
+                break
+        for key in [k for k, r in self._cache.items() if r.updated_at < cutoff]:
+            del self._cache[key]
+
+    async def _flush_loop(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._purge_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._closing:
+                break
+            if self._flush_interval:
+                await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+                if self._state_ttl > 0 and time.time() >= self._next_purge:
+                    self._next_purge = time.time() + self._purge_interval
+                    await self._purge()
+            except Exception:
+                logger.exception("FSM storage flush failed")
+                await asyncio.sleep(1.0)
+                self._wakeup.set()
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._closing = True
+            self._wakeup.set()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._db is not None:
+            await self.flush()
+            await self._db.close()
+            self._db = None
+        self._cache.clear()
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import math
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.repository import get_new_orders, list_open_order_locations
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+Cell = Tuple[int, int]
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle (haversine) distance."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """Points bucketed into a fixed lat/lon grid for k-nearest lookups.
+
+    ``nearest`` walks square rings of cells outwards from the query point and
+    stops as soon as no unvisited cell can be closer than the k-th best point
+    found, so a lookup touches a handful of cells however many points there are.
+    """
+
+    def __init__(self, cell_deg: float = 0.01) -> None:
+        self.cell_deg = cell_deg
+        self._cells: Dict[Cell, Set[int]] = {}
+        self._points: Dict[int, Tuple[float, float, Cell]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._points
+
+    def _cell(self, lat: float, lon: float) -> Cell:
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def add(self, key: int, lat: float, lon: float) -> None:
+        self.remove(key)
+        cell = self._cell(lat, lon)
+        self._points[key] = (lat, lon, cell)
+        self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key: int) -> None:
+        point = self._points.pop(key, None)
+        if point is None:
+            return
+        cell = point[2]
+        keys = self._cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self._cells[cell]
+
+    def clear(self) -> None:
+        self._cells.clear()
+        self._points.clear()
+
+    def _ring(self, center: Cell, radius: int) -> List[Cell]:
+        cy, cx = center
+        if radius == 0:
+            return [center]
+        cells = []
+        for dx in range(-radius, radius + 1):
+            cells.append((cy - radius, cx + dx))
+            cells.append((cy + radius, cx + dx))
+        for dy in range(-radius + 1, radius):
+            cells.append((cy + dy, cx - radius))
+            cells.append((cy + dy, cx + radius))
+        return cells
+
+    def nearest(
+        self, lat: float, lon: float, k: int = 10, max_km: Optional[float] = None
+    ) -> List[Tuple[float, int]]:
+        """Up to ``k`` (distance_km, key) pairs closest to the point, nearest first."""
+        if k <= 0 or not self._points:
+            return []
+        center = self._cell(lat, lon)
+        # A ring r cells out is at least this far away (a lon degree shrinks with latitude)
+        shrink = math.cos(math.radians(min(89.0, abs(lat) + self.cell_deg)))
+        cell_km = self.cell_deg * KM_PER_DEGREE * shrink
+        best: List[Tuple[float, int]] = []  # max-heap of the k best as (-distance, key)
+        seen = 0
+        radius = 0
+        while seen < len(self._points):
+            if radius and (radius - 1) * cell_km > (max_km if max_km is not None else math.inf):
+                break
+            if len(best) == k and (radius - 1) * cell_km > -best[0][0]:
+                break
+            ring = self._ring(center, radius)
+            if len(ring) > len(self._cells):
+                # Sparse and far away: visiting the occupied cells beats walking the ring
+                ring = [
+                    cell for cell in self._cells
+                    if max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) >= radius
+                ]
+            for cell in ring:
+                keys = self._cells.get(cell)
+                if not keys:
+                    continue
+                seen += len(keys)
+                for key in keys:
+                    plat, plon, _ = self._points[key]
+                    dist = distance_km(lat, lon, plat, plon)
+                    if max_km is not None and dist > max_km:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist, key))
+                    elif dist < -best[0][0]:
+                        heapq.heapreplace(best, (-dist, key))
+            radius += 1
+        return sorted((-d, key) for d, key in best)
+
+
+# Open orders that have pickup coordinates. The handlers of this process keep
+# it in step with their own changes; orders created or released by other
+# processes come in when a lookup finds it older than _REFRESH_INTERVAL and
+# rebuilds it. The database stays authoritative (see nearest_open_orders).
+_ORDERS = GridIndex()
+_REFRESH_INTERVAL = 5.0
+_loaded_at = -math.inf
+_loading = asyncio.Lock()
+
+
+async def load_open_orders(refresh_interval: Optional[float] = None) -> int:
+    """Rebuild the order index from the database; returns the number of orders indexed."""
+    global _REFRESH_INTERVAL, _loaded_at
+    if refresh_interval is not None:
+        _REFRESH_INTERVAL = refresh_interval
+    started = time.monotonic()
+    rows = await list_open_order_locations()
+    _ORDERS.clear()
+    for order_id, lat, lon in rows:
+        _ORDERS.add(order_id, lat, lon)
+    _loaded_at = started
+    return len(_ORDERS)
+
+
+async def _refresh() -> None:
+    if time.monotonic() - _loaded_at < _REFRESH_INTERVAL:
+        return
+    async with _loading:
+        # Another lookup may have rebuilt it while this one waited
+        if time.monotonic() - _loaded_at >= _REFRESH_INTERVAL:
+            await load_open_orders()
+
+
+def index_order(order_id: int, lat: float, lon: float) -> None:
+    _ORDERS.add(order_id, lat, lon)
+
+
+def unindex_order(order_id: int) -> None:
+    _ORDERS.remove(order_id)
+
+
+async def nearest_open_orders(lat: float, lon: float, limit: int = 10) -> List[Dict]:
+    """Open orders closest to the point, nearest first, each with a ``distance_km`` key.
+
+    Candidates come from the in-memory index and are confirmed with one
+    primary-key lookup, so orders taken by another process meanwhile are
+    skipped and dropped from the index.
+    """
+    await _refresh()
+    candidates = _ORDERS.nearest(lat, lon, k=limit * 2)
+    if not candidates:
+        return []
+    rows = {o["id"]: o for o in await get_new_orders([key for _, key in candidates])}
+    result = []
+    for dist, order_id in candidates:
+        order = rows.get(order_id)
+        if order is None:
+            _ORDERS.remove(order_id)
+            continue
+        order["distance_km"] = dist
+        result.append(order)
+        if len(result) == limit:
+            break
+    return result
@@ -1,70 +1,121 @@
-from aiogram.types import (
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
-    ReplyKeyboardMarkup,
-    KeyboardButton,
+from typing import Dict, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from app.render import (
+    RenderedInlineKeyboard,
+    RenderedReplyKeyboard,
+    RowTemplate,
+    inline_keyboard,
+    static_inline_keyboard,
+    static_reply_keyboard,
 )
 
+# Static keyboards are built once and shared; the parameterized ones are
+# assembled from pre-serialized rows (see app.render).
 
-def role_choice_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="🧑‍🦱 Пассажир", callback_data="role:passenger")],
-            [InlineKeyboardButton(text="🚕 Водитель", callback_data="role:driver")],
-            [InlineKeyboardButton(text="🛠 Администратор", callback_data="role:admin")],
-        ]
-    )
+_ROLE_CHOICE = static_inline_keyboard([
+    [("🧑‍🦱 Пассажир", "role:passenger")],
+    [("🚕 Водитель", "role:driver")],
+    [("🛠 Администратор", "role:admin")],
+])
+
+_REQUEST_PHONE = static_reply_keyboard(
+    {"text": "📱 Отправить телефон", "request_contact": True}, resize_keyboard=True, one_time_keyboard=True
+)
+
+_REQUEST_LOCATION = static_reply_keyboard(
+    {"text": "📍 Отправить геопозицию", "request_location": True}, resize_keyboard=True, one_time_keyboard=True
+)
 
+_PASSENGER_MENU: Dict[bool, RenderedInlineKeyboard] = {
+    has_active: static_inline_keyboard(
+        [[("📲 Вызвать такси", "pass:order")]] + ([[("🧾 Мой заказ", "pass:my")]] if has_active else [])
+    )
+    for has_active in (False, True)
+}
 
-def request_phone_kb() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="📱 Отправить телефон", request_contact=True)]],
-        resize_keyboard=True,
-        one_time_keyboard=True,
+_DRIVER_MENU: Dict[Tuple[bool, bool], RenderedInlineKeyboard] = {
+    (has_active, on_shift): static_inline_keyboard(
+        [[("🆕 Свободные заказы", "drv:new")]]
+        + ([[("🚗 Мой заказ", "drv:my")]] if has_active else [])
+        + [[("⏸ Уйти с линии", "drv:shift")] if on_shift else [("🟢 Выйти на линию", "drv:shift")]]
     )
+    for has_active in (False, True)
+    for on_shift in (False, True)
+}
+
+_ADMIN_MENU = static_inline_keyboard([
+    [("➕ Добавить водителя", "adm:add_driver")],
+    [("👨‍🔧 Список водителей", "adm:list_drivers")],
+    [("📥 Импорт водителей (CSV)", "adm:import_drivers")],
+    [("📋 Заказы", "adm:orders:all")],
+    [("📤 Экспорт заказов (CSV)", "adm:export_orders")],
+    [("📊 Статистика", "adm:stats")],
+])
 
+_ORDER_FILTERS = (
+    (("Все", "adm:orders:all"), ("Новые", "adm:orders:new"), ("Приняты", "adm:orders:accepted")),
+    (("На месте", "adm:orders:arrived"), ("Завершены", "adm:orders:completed"), ("Истекли", "adm:orders:expired")),
+)
 
-def passenger_menu_kb(has_active: bool) -> InlineKeyboardMarkup:
-    buttons = []
-    buttons.append([InlineKeyboardButton(text="📲 Вызвать такси", callback_data="pass:order")])
-    if has_active:
-        buttons.append([InlineKeyboardButton(text="🧾 Мой заказ", callback_data="pass:my")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+_NO_ORDERS = static_inline_keyboard([[("Обновить", "drv:new")]])
+_TAKE_ROW = RowTemplate("Взять заказ #%d", "drv:take:%d")
+_ARRIVED_ROW = RowTemplate("🅿️ На месте", "drv:arrived:%d")
+_COMPLETE_ROW = RowTemplate("✅ Завершить", "drv:complete:%d")
+_ACTION_ROWS = {
+    "accepted": (_ARRIVED_ROW, _COMPLETE_ROW),
+    "arrived": (_COMPLETE_ROW,),
+}
 
 
-def driver_menu_kb(has_active: bool) -> InlineKeyboardMarkup:
-    buttons = []
-    buttons.append([InlineKeyboardButton(text="🆕 Свободные заказы", callback_data="drv:new")])
-    if has_active:
-        buttons.append([InlineKeyboardButton(text="🚗 Мой заказ", callback_data="drv:my")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+def role_choice_kb() -> RenderedInlineKeyboard:
+    return _ROLE_CHOICE
 
 
-def admin_menu_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="➕ Добавить водителя", callback_data="adm:add_driver")],
-            [InlineKeyboardButton(text="👨‍🔧 Список водителей", callback_data="adm:list_drivers")],
-            [InlineKeyboardButton(text="📊 Статистика", callback_data="adm:stats")],
-        ]
-    )
+def request_phone_kb() -> RenderedReplyKeyboard:
+    return _REQUEST_PHONE
+
+
+def request_location_kb() -> RenderedReplyKeyboard:
+    return _REQUEST_LOCATION
+
+
+def passenger_menu_kb(has_active: bool) -> RenderedInlineKeyboard:
+    return _PASSENGER_MENU[bool(has_active)]
+
+
+def driver_menu_kb(has_active: bool, on_shift: bool = False) -> RenderedInlineKeyboard:
+    return _DRIVER_MENU[bool(has_active), bool(on_shift)]
+
+
+def admin_menu_kb() -> RenderedInlineKeyboard:
+    return _ADMIN_MENU
+
+
+def list_orders_kb(order_ids: list[int]) -> RenderedInlineKeyboard:
+    if not order_ids:
+        return _NO_ORDERS
+    return inline_keyboard([(_TAKE_ROW, oid) for oid in order_ids])
+
+
+def driver_actions_kb(order_id: int, status: str) -> RenderedInlineKeyboard:
+    return inline_keyboard([(row, order_id) for row in _ACTION_ROWS.get(status, ())])
 
 
-def list_orders_kb(order_ids: list[int]) -> InlineKeyboardMarkup:
-    keyboard = []
-    for oid in order_ids:
-        keyboard.append([
-            InlineKeyboardButton(text=f"Взять заказ #{oid}", callback_data=f"drv:take:{oid}")
-        ])
-    if not keyboard:
-        keyboard = [[InlineKeyboardButton(text="Обновить", callback_data="drv:new")]]
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-
-def driver_actions_kb(order_id: int, status: str) -> InlineKeyboardMarkup:
-    buttons = []
-    if status == "accepted":
-        buttons.append([InlineKeyboardButton(text="🅿️ На месте", callback_data=f"drv:arrived:{order_id}")])
-    if status in {"accepted", "arrived"}:
-        buttons.append([InlineKeyboardButton(text="✅ Завершить", callback_data=f"drv:complete:{order_id}")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
\ No newline at end of file
+def admin_page_kb(
+    prev_data: Optional[str], next_data: Optional[str], order_filters: bool = False
+) -> InlineKeyboardMarkup:
+    # Page buttons carry cursors, so these are built per call and sent the regular way
+    rows = []
+    pager = []
+    if prev_data:
+        pager.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=prev_data))
+    if next_data:
+        pager.append(InlineKeyboardButton(text="Далее ➡️", callback_data=next_data))
+    if pager:
+        rows.append(pager)
+    if order_filters:
+        rows += [[InlineKeyboardButton(text=text, callback_data=data) for text, data in row] for row in _ORDER_FILTERS]
+    rows.append([InlineKeyboardButton(text="🏠 Меню", callback_data="adm:menu")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
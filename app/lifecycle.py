@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import signal
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramConflictError
+from aiogram.methods import GetUpdates
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+from app.db import load_update_offset, save_pending_updates, save_update_offset, take_pending_updates
+from app.scheduler import UpdateScheduler
+
+logger = logging.getLogger(__name__)
+
+_BACKOFF = BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1)
+
+
+async def replay_pending(handle: Callable[[Dict[str, Any]], Awaitable[None]], recheck_after: float) -> None:
+    """Hand the updates a stopped process left unfinished to ``handle``.
+
+    Checked at startup and once more after ``recheck_after`` seconds: during a
+    hot restart the old process is still draining when the new one starts and
+    only stores its leftovers once its drain deadline has passed.
+    """
+    while True:
+        for update_id, payload in await take_pending_updates():
+            logger.info("Replaying update %d carried over from the previous process", update_id)
+            await handle(json.loads(payload))
+        if recheck_after <= 0:
+            return
+        await asyncio.sleep(recheck_after)
+        recheck_after = 0
+
+
+class UpdatePoller:
+    """Long-polls getUpdates and hands the updates to an UpdateScheduler.
+
+    Telegram confirms an update once getUpdates is called with a higher
+    offset, so a stop hands over without losing or repeating updates:
+    the pending getUpdates is cancelled (which confirms nothing) and the
+    offset past the last update taken is saved, so a new process can start
+    polling right away; the queued and running updates then get
+    ``drain_timeout`` seconds to finish. Those that never started are stored
+    for the next process to replay; handlers still running are cancelled
+    and their updates dropped, since their writes may have gone through
+    (see UpdateScheduler). After a crash the next process
+    resumes from the last saved offset and receives the unconfirmed updates
+    again. While ``backlog`` updates are pending no more are fetched, so a
+    flood waits at Telegram rather than in memory.
+
+    Updates are fetched from :meth:`start` on but only dispatched after
+    :meth:`ready`, so the first getUpdates is in flight while the startup
+    handlers warm up.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dp: Dispatcher,
+        allowed_updates: Optional[List[str]] = None,
+        polling_timeout: int = 30,
+        drain_timeout: float = 8.0,
+        concurrency: int = 32,
+        backlog: int = 1000,
+        **workflow_data: Any,
+    ) -> None:
+        self._bot = bot
+        self._allowed_updates = allowed_updates
+        self._polling_timeout = polling_timeout
+        self._drain_timeout = drain_timeout
+        self._scheduler = UpdateScheduler(bot, dp, concurrency=concurrency, backlog=backlog, **workflow_data)
+        self._ready = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.offset = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._scheduler.pending
+
+    async def start(self) -> None:
+        self.offset = await load_update_offset()
+        self._scheduler.start()
+        self._tasks = [asyncio.create_task(self._fetch()), asyncio.create_task(self._replay())]
+
+    def ready(self) -> None:
+        self._ready.set()
+
+    async def _replay(self) -> None:
+        async def handle(data: Dict[str, Any]) -> None:
+            await self._scheduler.put(Update.model_validate(data, context={"bot": self._bot}))
+
+        await self._ready.wait()
+        await replay_pending(handle, recheck_after=self._drain_timeout + 1.0)
+
+    async def _fetch(self) -> None:
+        get_updates = GetUpdates(timeout=self._polling_timeout, allowed_updates=self._allowed_updates)
+        kwargs = {}
+        if self._bot.session.timeout:
+            kwargs["request_timeout"] = int(self._bot.session.timeout + self._polling_timeout)
+        backoff = Backoff(config=_BACKOFF)
+        while True:
+            get_updates.offset = self.offset or None
+            try:
+                updates = await self._bot(get_updates, **kwargs)
+            except TelegramConflictError:
+                # Another process is polling the same bot, e.g. the one being replaced
+                logger.warning("getUpdates conflict, retrying in %.1fs", backoff.next_delay)
+                await backoff.asleep()
+                continue
+            except Exception as e:
+                logger.error("Failed to fetch updates - %s: %s", type(e).__name__, e)
+                await backoff.asleep()
+                continue
+            backoff.reset()
+            await self._ready.wait()
+            for update in updates:
+                if update.update_id < self.offset:
+                    continue
+                await self._scheduler.put(update)
+                self.offset = update.update_id + 1
+
+    async def stop(self) -> None:
+        """Stop fetching, save the offset, drain the handlers and carry over the rest."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.offset:
+            await save_update_offset(self.offset)
+        if self._scheduler.pending:
+            logger.info("Stopped polling at offset %d, draining %d updates", self.offset, self._scheduler.pending)
+        unfinished = await self._scheduler.stop(timeout=self._drain_timeout)
+        if not unfinished:
+            return
+        rows = [(update.update_id, update.model_dump_json(by_alias=True, exclude_unset=True)) for update in unfinished]
+        await save_pending_updates(rows)
+        logger.warning("Carried %d updates that never started over to the next process", len(rows))
+
+
+async def run_polling(
+    bot: Bot, dp: Dispatcher, drain_timeout: float = 8.0, concurrency: int = 32, backlog: int = 1000
+) -> None:
+    """Poll until SIGTERM or SIGINT, then stop as described in UpdatePoller."""
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stopping.set)
+
+    workflow_data = {"dispatcher": dp, "bots": (bot,), **dp.workflow_data}
+    poller = UpdatePoller(
+        bot,
+        dp,
+        allowed_updates=dp.resolve_used_update_types(),
+        drain_timeout=drain_timeout,
+        concurrency=concurrency,
+        backlog=backlog,
+        **workflow_data,
+    )
+    await poller.start()
+    try:
+        await dp.emit_startup(bot=bot, **workflow_data)
+        poller.ready()
+        logger.info("Polling from offset %d", poller.offset)
+        await stopping.wait()
+    finally:
+        await poller.stop()
+        try:
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+        finally:
+            await bot.session.close()
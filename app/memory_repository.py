@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import itertools
+import time
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.db import keyset_page
+from app.repository import Page, Repository
+from app.stats import seconds_between
+
+_ACTIVE_PASSENGER = ("new", "accepted", "arrived")
+_ACTIVE_DRIVER = ("accepted", "arrived")
+
+
+def _remove(ids: List[Any], key: Any) -> None:
+    i = bisect_left(ids, key)
+    if i < len(ids) and ids[i] == key:
+        del ids[i]
+
+
+class MemoryRepository(Repository):
+    """The repository kept in process memory, for tests, benchmarks and single-process trials.
+
+    Rows live in dicts keyed like the tables' primary keys. Every query the
+    SQLite engine serves from an index is served here from a sorted list of
+    keys (bisect gives the keyset ranges on either side of a cursor) or a set
+    of active orders per passenger and driver; order counts and hourly
+    rollups are kept as the write ops change them, as app.stats does.
+    Nothing awaits between reading and writing a row, so transitions are
+    atomic just like the conditional UPDATEs. Timestamps come from ``clock``
+    at second resolution. Unlike the database there is no archive (finished
+    orders stay), no order event log for app.feed and no foreign key from
+    orders to users.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        self._clock = clock
+        self._users: Dict[int, Dict[str, Any]] = {}
+        # Like AUTOINCREMENT with an upsert, every insert attempt takes an id
+        self._user_ids = itertools.count(1)
+        self._drivers: Dict[int, Dict[str, Any]] = {}
+        # (added_at, tg_id), ascending
+        self._driver_keys: List[Tuple[str, int]] = []
+        self._orders: Dict[int, Dict[str, Any]] = {}
+        self._order_ids = itertools.count(1)
+        # Order ids, ascending: all of them and per status, driver and passenger
+        self._ids: List[int] = []
+        self._by_status: Dict[str, List[int]] = {}
+        self._by_driver: Dict[int, List[int]] = {}
+        self._by_passenger: Dict[int, List[int]] = {}
+        self._driver_active: Dict[int, Set[int]] = {}
+        self._passenger_active: Dict[int, Set[int]] = {}
+        self._counts: Dict[str, int] = {}
+        # 'YYYY-MM-DD HH' -> column -> sum, the columns of order_rollups
+        self._rollups: Dict[str, Dict[str, float]] = {}
+
+    def _now(self) -> str:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self._clock()))
+
+    # Users
+    async def upsert_user(self, tg_id: int, full_name: str) -> None:
+        user_id = next(self._user_ids)
+        user = self._users.get(tg_id)
+        if user is None:
+            self._users[tg_id] = {"id": user_id, "tg_id": tg_id, "full_name": full_name, "phone": None}
+        else:
+            user["full_name"] = full_name
+
+    async def get_user(self, tg_id: int) -> Optional[Dict[str, Any]]:
+        user = self._users.get(tg_id)
+        return dict(user) if user else None
+
+    async def set_user_phone(self, tg_id: int, phone: str) -> None:
+        user = self._users.get(tg_id)
+        if user is not None:
+            user["phone"] = phone
+
+    # Drivers
+    def _insert_driver(self, tg_id: int, full_name: str, added_at: str) -> None:
+        self._drivers[tg_id] = {"tg_id": tg_id, "full_name": full_name, "added_at": added_at}
+        insort(self._driver_keys, (added_at, tg_id))
+
+    async def add_driver(self, tg_id: int, full_name: str) -> bool:
+        if tg_id in self._drivers:
+            return False
+        self._insert_driver(tg_id, full_name, self._now())
+        return True
+
+    async def add_drivers(self, rows: List[Tuple[int, str]]) -> List[int]:
+        existing = [tg_id for tg_id, _ in rows if tg_id in self._drivers]
+        now = self._now()
+        for tg_id, full_name in rows:
+            if tg_id not in self._drivers:
+                self._insert_driver(tg_id, full_name, now)
+        return existing
+
+    async def remove_driver(self, tg_id: int) -> int:
+        driver = self._drivers.pop(tg_id, None)
+        if driver is None:
+            return 0
+        _remove(self._driver_keys, (driver["added_at"], tg_id))
+        return 1
+
+    async def is_driver(self, tg_id: int) -> bool:
+        return tg_id in self._drivers
+
+    async def page_drivers(
+        self, after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None, limit: int = 20
+    ) -> Page:
+        keys = self._driver_keys
+        if after is not None:
+            end = bisect_left(keys, tuple(after))
+            selected, cursor = keys[max(0, end - limit - 1):end][::-1], "next"
+        elif before is not None:
+            start = bisect_right(keys, tuple(before))
+            selected, cursor = keys[start:start + limit + 1], "prev"
+        else:
+            selected, cursor = keys[-limit - 1:][::-1], None
+        return keyset_page([self._drivers[tg_id] for _, tg_id in selected], limit, cursor)
+
+    # Orders
+    async def create_order(
+        self,
+        passenger_tg_id: int,
+        pickup: str,
+        destination: str,
+        pickup_lat: Optional[float] = None,
+        pickup_lon: Optional[float] = None,
+    ) -> int:
+        order_id = next(self._order_ids)
+        now = self._now()
+        self._orders[order_id] = {
+            "id": order_id,
+            "passenger_tg_id": passenger_tg_id,
+            "pickup": pickup,
+            "destination": destination,
+            "status": "new",
+            "driver_tg_id": None,
+            "created_at": now,
+            "updated_at": now,
+            "accepted_at": None,
+            "completed_at": None,
+            "pickup_lat": None if pickup_lat is None else float(pickup_lat),
+            "pickup_lon": None if pickup_lon is None else float(pickup_lon),
+        }
+        self._ids.append(order_id)
+        self._by_status.setdefault("new", []).append(order_id)
+        self._by_passenger.setdefault(passenger_tg_id, []).append(order_id)
+        self._passenger_active.setdefault(passenger_tg_id, set()).add(order_id)
+        self._counts["new"] = self._counts.get("new", 0) + 1
+        self._bump_rollup("created")
+        return order_id
+
+    async def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        order = self._orders.get(order_id)
+        return dict(order) if order else None
+
+    async def list_new_orders(self, limit: int = 10) -> List[Dict[str, Any]]:
+        return [dict(self._orders[i]) for i in self._by_status.get("new", [])[:limit]]
+
+    async def get_new_orders(self, order_ids: List[int]) -> List[Dict[str, Any]]:
+        orders = (self._orders.get(i) for i in sorted(set(order_ids)))
+        return [dict(o) for o in orders if o is not None and o["status"] == "new"]
+
+    async def list_open_order_locations(self) -> List[Tuple[int, float, float]]:
+        orders = (self._orders[i] for i in self._by_status.get("new", []))
+        return [(o["id"], o["pickup_lat"], o["pickup_lon"]) for o in orders if o["pickup_lat"] is not None]
+
+    async def page_orders(
+        self,
+        status: Optional[str] = None,
+        driver_tg_id: Optional[int] = None,
+        passenger_tg_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10,
+    ) -> Page:
+        filters = [
+            (name, value, index)
+            for name, value, index in (
+                ("status", status, self._by_status),
+                ("driver_tg_id", driver_tg_id, self._by_driver),
+                ("passenger_tg_id", passenger_tg_id, self._by_passenger),
+            )
+            if value is not None
+        ]
+        # Walk the shortest matching index and check the other filters on the way
+        ids = min((index.get(value, []) for _, value, index in filters), key=len, default=self._ids)
+        walk: Iterable[int]
+        if after_id is not None:
+            walk, cursor = reversed(ids[:bisect_left(ids, after_id)]), "next"
+        elif before_id is not None:
+            walk, cursor = itertools.islice(ids, bisect_right(ids, before_id), None), "prev"
+        else:
+            walk, cursor = reversed(ids), None
+        rows: List[Dict[str, Any]] = []
+        for order_id in walk:
+            order = self._orders[order_id]
+            if all(order[name] == value for name, value, _ in filters):
+                rows.append(order)
+                if len(rows) > limit:
+                    break
+        return keyset_page(rows, limit, cursor)
+
+    def _bump_rollup(self, column: str, secs_column: Optional[str] = None, secs: Optional[float] = None) -> None:
+        bucket = time.strftime("%Y-%m-%d %H", time.gmtime(self._clock()))
+        rollup = self._rollups.setdefault(bucket, {})
+        rollup[column] = rollup.get(column, 0) + 1
+        if secs_column and secs is not None:
+            rollup[f"{secs_column}_secs"] = rollup.get(f"{secs_column}_secs", 0) + secs
+            rollup[f"{secs_column}_n"] = rollup.get(f"{secs_column}_n", 0) + 1
+
+    def _transition(self, order: Dict[str, Any], stamp: Tuple[str, ...] = (), **changes: Any) -> Dict[str, Any]:
+        """Apply ``changes`` to ``order`` and set updated_at and the ``stamp`` columns to now.
+
+        The order is moved between the indexes and counted like app.stats does.
+        """
+        order_id = order["id"]
+        old_status, old_driver = order["status"], order["driver_tg_id"]
+        now = self._now()
+        order.update(changes, updated_at=now)
+        for column in stamp:
+            order[column] = now
+        status, driver = order["status"], order["driver_tg_id"]
+        if status != old_status:
+            _remove(self._by_status[old_status], order_id)
+            insort(self._by_status.setdefault(status, []), order_id)
+            self._counts[old_status] -= 1
+            self._counts[status] = self._counts.get(status, 0) + 1
+            if status == "accepted":
+                self._bump_rollup("accepted", "wait", seconds_between(order["created_at"], order["accepted_at"]))
+            elif status == "completed":
+                self._bump_rollup("completed", "ride", seconds_between(order["accepted_at"], order["completed_at"]))
+            elif status == "expired":
+                self._bump_rollup("expired")
+        if driver != old_driver:
+            if old_driver is not None:
+                _remove(self._by_driver[old_driver], order_id)
+            if driver is not None:
+                insort(self._by_driver.setdefault(driver, []), order_id)
+        if old_driver is not None:
+            self._discard_active(self._driver_active, old_driver, order_id)
+        if driver is not None and status in _ACTIVE_DRIVER:
+            self._driver_active.setdefault(driver, set()).add(order_id)
+        if status not in _ACTIVE_PASSENGER:
+            self._discard_active(self._passenger_active, order["passenger_tg_id"], order_id)
+        return dict(order)
+
+    @staticmethod
+    def _discard_active(active: Dict[int, Set[int]], tg_id: int, order_id: int) -> None:
+        ids = active.get(tg_id)
+        if ids is not None:
+            ids.discard(order_id)
+            if not ids:
+                del active[tg_id]
+
+    def _held(self, order_id: int, driver_tg_id: int, statuses: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        order = self._orders.get(order_id)
+        if order is None or order["driver_tg_id"] != driver_tg_id or order["status"] not in statuses:
+            return None
+        return order
+
+    async def driver_accept_order(self, order_id: int, driver_tg_id: int) -> bool:
+        order = self._orders.get(order_id)
+        if order is None or order["status"] != "new":
+            return False
+        self._transition(order, ("accepted_at",), status="accepted", driver_tg_id=driver_tg_id)
+        return True
+
+    async def driver_mark_arrived(self, order_id: int, driver_tg_id: int) -> bool:
+        order = self._held(order_id, driver_tg_id, ("accepted",))
+        if order is None:
+            return False
+        self._transition(order, status="arrived")
+        return True
+
+    async def driver_complete_order(self, order_id: int, driver_tg_id: int) -> bool:
+        order = self._held(order_id, driver_tg_id, _ACTIVE_DRIVER)
+        if order is None:
+            return False
+        self._transition(order, ("completed_at",), status="completed")
+        return True
+
+    async def expire_order(self, order_id: int, ttl: float) -> Optional[Dict[str, Any]]:
+        order = self._orders.get(order_id)
+        if order is None or order["status"] != "new":
+            return None
+        # Compared as text at second resolution, as SQLite compares with datetime('now', '-ttl seconds')
+        if order["updated_at"] > time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self._clock() - float(ttl))):
+            return None
+        return self._transition(order, status="expired")
+
+    async def release_order(self, order_id: int, driver_tg_id: int) -> Optional[Dict[str, Any]]:
+        order = self._held(order_id, driver_tg_id, ("accepted",))
+        if order is None:
+            return None
+        return self._transition(order, status="new", driver_tg_id=None, accepted_at=None)
+
+    async def list_pending_orders(self) -> List[Dict[str, Any]]:
+        return [
+            {key: self._orders[i][key] for key in ("id", "status", "driver_tg_id", "updated_at", "accepted_at")}
+            for status in ("new", "accepted")
+            for i in self._by_status.get(status, [])
+        ]
+
+    async def get_driver_active_order(self, driver_tg_id: int) -> Optional[Dict[str, Any]]:
+        ids = self._driver_active.get(driver_tg_id)
+        if not ids:
+            return None
+        return dict(max((self._orders[i] for i in ids), key=lambda o: (o["updated_at"], o["id"])))
+
+    async def get_passenger_active_order(self, passenger_tg_id: int) -> Optional[Dict[str, Any]]:
+        ids = self._passenger_active.get(passenger_tg_id)
+        if not ids:
+            return None
+        return dict(max((self._orders[i] for i in ids), key=lambda o: (o["created_at"], o["id"])))
+
+    async def order_stats(self) -> Dict[str, int]:
+        result: Dict[str, int] = {"total": 0}
+        for status in sorted(self._counts):
+            if self._counts[status] > 0:
+                result[status] = self._counts[status]
+                result["total"] += self._counts[status]
+        return result
+
+    async def order_activity(self, hours: int = 24) -> Dict[str, Any]:
+        since = time.strftime("%Y-%m-%d %H", time.gmtime(self._clock() - int(hours) * 3600))
+        totals: Dict[str, float] = {}
+        for bucket, rollup in self._rollups.items():
+            if bucket > since:
+                for column, value in rollup.items():
+                    totals[column] = totals.get(column, 0) + value
+        return {
+            "created": int(totals.get("created", 0)),
+            "accepted": int(totals.get("accepted", 0)),
+            "completed": int(totals.get("completed", 0)),
+            "expired": int(totals.get("expired", 0)),
+            "avg_wait_secs": totals["wait_secs"] / totals["wait_n"] if totals.get("wait_n") else None,
+            "avg_ride_secs": totals["ride_secs"] / totals["ride_n"] if totals.get("ride_n") else None,
+        }
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import logging
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Process-local metrics rendered in the Prometheus text format (version 0.0.4).
+# Recording is a dict lookup plus an addition, cheap enough for every update
+# and every Bot API call; nothing is formatted until /metrics is scraped.
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]: ...
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def set_function(self, fn: Callable[[], float], *labels: str) -> None:
+        """Read the value from ``fn`` at scrape time instead of tracking it."""
+        self._functions[labels] = fn
+
+    def value(self, *labels: str) -> float:
+        fn = self._functions.get(labels)
+        return fn() if fn is not None else self._values.get(labels, 0.0)
+
+    def samples(self) -> List[str]:
+        values = dict(self._values)
+        for labels, fn in self._functions.items():
+            try:
+                values[labels] = fn()
+            except Exception:
+                logger.exception("Gauge %s callback failed", self.name)
+        return [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return int(sum(series[:-1])) if series else 0
+
+    def samples(self) -> List[str]:
+        lines: List[str] = []
+        bounds = self.buckets + (float("inf"),)
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATES_IN_FLIGHT: Gauge = REGISTRY.register(
+    Gauge("bot_updates_in_flight", "Updates currently being processed", ["update_type"])
+)
+UPDATE_DURATION: Histogram = REGISTRY.register(
+    Histogram("bot_update_duration_seconds", "Time to process an update end to end", ["update_type"])
+)
+HANDLER_DURATION: Histogram = REGISTRY.register(
+    Histogram("bot_handler_duration_seconds", "Handler execution time", ["handler"])
+)
+HANDLER_ERRORS: Counter = REGISTRY.register(
+    Counter("bot_handler_errors_total", "Exceptions raised by handlers", ["handler", "error"])
+)
+API_DURATION: Histogram = REGISTRY.register(
+    Histogram("bot_api_request_duration_seconds", "Outbound Bot API call time", ["method"])
+)
+API_ERRORS: Counter = REGISTRY.register(
+    Counter("bot_api_errors_total", "Failed Bot API calls, RetryAfter included", ["method", "error"])
+)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer update middleware: in-flight gauge and end-to-end update latency."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        update_type = event.event_type if isinstance(event, Update) else type(event).__name__
+        UPDATES_IN_FLIGHT.inc(update_type)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATE_DURATION.observe(time.perf_counter() - started, update_type)
+            UPDATES_IN_FLIGHT.dec(update_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware: latency and errors per resolved handler (``module:function``)."""
+
+    def __init__(self) -> None:
+        self._names: Dict[int, str] = {}
+
+    def _name(self, handler: Optional[HandlerObject]) -> str:
+        if handler is None:
+            return "unknown"
+        name = self._names.get(id(handler))
+        if name is None:
+            callback = handler.callback
+            module = getattr(callback, "__module__", "") or ""
+            name = f"{module.rsplit('.', 1)[-1]}:{getattr(callback, '__name__', type(callback).__name__)}"
+            self._names[id(handler)] = name
+        return name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = self._name(data.get("handler"))
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as exc:
+            HANDLER_ERRORS.inc(name, type(exc).__name__)
+            raise
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - started, name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: per-method call time and failures (RetryAfter, BadRequest, ...)."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as exc:
+            API_ERRORS.inc(name, type(exc).__name__)
+            raise
+        finally:
+            API_DURATION.observe(time.perf_counter() - started, name)
+
+
+def instrument_dispatcher(dp: Dispatcher) -> None:
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    # Inner middlewares of the dispatcher apply to the handlers of every nested router
+    handler_metrics = HandlerMetricsMiddleware()
+    for event_name, observer in dp.observers.items():
+        if event_name not in ("update", "error"):
+            observer.middleware(handler_metrics)
+
+
+def instrument_bot(bot: Bot) -> None:
+    bot.session.middleware(ApiMetricsMiddleware())
+
+
+_RUNNER: Optional[web.AppRunner] = None
+
+
+async def _handle_metrics(_: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str = "127.0.0.1", port: int = 9100, ports: int = 1) -> None:
+    """Serve GET /metrics on a separate local port; port 0 disables it.
+
+    The registry is per process, so every process serves its own: each takes
+    the first free port of ``port`` .. ``port + ports - 1``. Several webhook
+    workers (sharing one config) thus end up on one port each, and Prometheus
+    scrapes them all and sums across them.
+    """
+    global _RUNNER
+    if _RUNNER is not None or not port:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    for candidate in range(port, port + max(1, ports)):
+        try:
+            await web.TCPSite(runner, host, candidate).start()
+        except OSError as exc:
+            error = exc
+            continue
+        _RUNNER = runner
+        logger.info("Metrics available at http://%s:%d/metrics", host, candidate)
+        return
+    logger.warning("Metrics endpoint not started on %s:%d-%d: %s", host, port, port + max(1, ports) - 1, error)
+    await runner.cleanup()
+
+
+async def stop_metrics_server() -> None:
+    global _RUNNER
+    if _RUNNER is None:
+        return
+    runner, _RUNNER = _RUNNER, None
+    await runner.cleanup()
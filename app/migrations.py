@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+from typing import Any, Dict, List, Sequence, Tuple
+
+import aiosqlite
+
+# Each entry upgrades the schema by one version; PRAGMA user_version stores how
+# many have been applied. Never edit an applied entry, append a new one instead.
+MIGRATIONS: List[Tuple[str, ...]] = [
+    # 1: base schema. IF NOT EXISTS keeps it safe for databases created before
+    # versioning, which already have these tables but user_version = 0.
+    (
+        # Users table: passengers and potentially admins; drivers are kept in separate table
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tg_id INTEGER UNIQUE NOT NULL,
+            full_name TEXT,
+            phone TEXT
+        );
+        """,
+        # Drivers table: registered by admin
+        """
+        CREATE TABLE IF NOT EXISTS drivers (
+            tg_id INTEGER PRIMARY KEY,
+            full_name TEXT,
+            added_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            passenger_tg_id INTEGER NOT NULL,
+            pickup TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            status TEXT NOT NULL,
+            driver_tg_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(passenger_tg_id) REFERENCES users(tg_id) ON DELETE CASCADE
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);",
+        "CREATE INDEX IF NOT EXISTS idx_orders_driver ON orders(driver_tg_id);",
+    ),
+    # 2: indexes matched to the hot queries in app.db
+    (
+        # list_new_orders: equality on status, then already sorted by created_at; it also
+        # served the GROUP BY status order_stats ran then (order_counters since migration 3).
+        # Replaced by idx_orders_status again in migration 9.
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at);",
+        "DROP INDEX IF EXISTS idx_orders_status;",
+        # get_passenger_active_order: only live orders are indexed, newest first per passenger
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_passenger_active
+        ON orders(passenger_tg_id, created_at)
+        WHERE status IN ('new','accepted','arrived');
+        """,
+        # get_driver_active_order: a driver has at most a couple of live orders
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_driver_active
+        ON orders(driver_tg_id, updated_at)
+        WHERE status IN ('accepted','arrived');
+        """,
+        # Driver list: ORDER BY added_at without a temp B-tree
+        "CREATE INDEX IF NOT EXISTS idx_drivers_added ON drivers(added_at);",
+    ),
+    # 3: incrementally maintained order statistics (see app.stats)
+    (
+        "ALTER TABLE orders ADD COLUMN accepted_at DATETIME;",
+        "ALTER TABLE orders ADD COLUMN completed_at DATETIME;",
+        """
+        CREATE TABLE IF NOT EXISTS order_counters (
+            status TEXT PRIMARY KEY,
+            cnt INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS order_rollups (
+            bucket TEXT PRIMARY KEY,
+            created INTEGER NOT NULL DEFAULT 0,
+            accepted INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            wait_secs REAL NOT NULL DEFAULT 0,
+            wait_n INTEGER NOT NULL DEFAULT 0,
+            ride_secs REAL NOT NULL DEFAULT 0,
+            ride_n INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        # Backfill from existing history; acceptance times were never recorded before
+        "INSERT INTO order_counters (status, cnt) SELECT status, COUNT(*) FROM orders GROUP BY status;",
+        """
+        INSERT INTO order_rollups (bucket, created)
+        SELECT strftime('%Y-%m-%d %H', created_at), COUNT(*) FROM orders GROUP BY 1;
+        """,
+        """
+        INSERT INTO order_rollups (bucket, completed)
+        SELECT strftime('%Y-%m-%d %H', updated_at), COUNT(*) FROM orders WHERE status = 'completed' GROUP BY 1
+        ON CONFLICT(bucket) DO UPDATE SET completed = excluded.completed;
+        """,
+    ),
+    # 4: cold storage for finished orders (see app.archive). orders keeps
+    # AUTOINCREMENT, so ids moved here are never reused by new orders.
+    (
+        """
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            id INTEGER PRIMARY KEY,
+            passenger_tg_id INTEGER NOT NULL,
+            pickup TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            status TEXT NOT NULL,
+            driver_tg_id INTEGER,
+            created_at DATETIME,
+            updated_at DATETIME,
+            accepted_at DATETIME,
+            completed_at DATETIME,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # Finished orders are picked oldest first by finish time
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_finished
+        ON orders(status, updated_at)
+        WHERE status = 'completed';
+        """,
+    ),
+    # 5: pickup coordinates shared as a Telegram location (see app.geo)
+    (
+        "ALTER TABLE orders ADD COLUMN pickup_lat REAL;",
+        "ALTER TABLE orders ADD COLUMN pickup_lon REAL;",
+        "ALTER TABLE orders_archive ADD COLUMN pickup_lat REAL;",
+        "ALTER TABLE orders_archive ADD COLUMN pickup_lon REAL;",
+    ),
+    # 6: periodic snapshot of the drivers on shift (see app.presence)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS driver_presence (
+            tg_id INTEGER PRIMARY KEY,
+            online_since REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            lat REAL,
+            lon REAL
+        );
+        """,
+    ),
+    # 7: orders expired by app.expiry are counted and archived like completed ones
+    (
+        "ALTER TABLE order_rollups ADD COLUMN expired INTEGER NOT NULL DEFAULT 0;",
+        "DROP INDEX IF EXISTS idx_orders_finished;",
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_finished
+        ON orders(updated_at)
+        WHERE status IN ('completed','expired');
+        """,
+    ),
+    # 8: polling offset and updates left unfinished by a stopping process (see app.lifecycle)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pending_updates (
+            update_id INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL,
+            saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ),
+    # 9: keyset pages of the admin order browser, newest first by id. An index on
+    # status alone is (status, rowid), so it serves "status=? AND id<? ORDER BY id"
+    # as well as list_new_orders; it replaces (status, created_at) from migration 2.
+    (
+        "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);",
+        "DROP INDEX IF EXISTS idx_orders_status_created;",
+        # Browsing by passenger; also keeps the ON DELETE CASCADE from users off a full scan
+        "CREATE INDEX IF NOT EXISTS idx_orders_passenger ON orders(passenger_tg_id);",
+    ),
+    # 10: order export by creation date merges both tables in created_at order (see app.bulk)
+    (
+        "CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at);",
+        "CREATE INDEX IF NOT EXISTS idx_orders_archive_created ON orders_archive(created_at);",
+    ),
+    # 11: append-only log of order status changes, written with each transition and
+    # pushed to passengers by app.feed; seq is the rowid, so reading on from a cursor is a range
+    (
+        """
+        CREATE TABLE IF NOT EXISTS order_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            passenger_tg_id INTEGER NOT NULL,
+            driver_tg_id INTEGER,
+            status TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ),
+    # 12: last update seen from each driver by any process, on shift or not (see app.presence);
+    # app.expiry only takes an order back from a driver whose silence is on record here
+    (
+        """
+        CREATE TABLE IF NOT EXISTS driver_activity (
+            tg_id INTEGER PRIMARY KEY,
+            last_seen REAL NOT NULL
+        );
+        """,
+    ),
+    # 13: offers of new orders sent to drivers (see app.dispatch), so whichever process
+    # sees the order taken or expired can withdraw the offers every process sent
+    (
+        """
+        CREATE TABLE IF NOT EXISTS order_offers (
+            order_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (order_id, chat_id, message_id)
+        ) WITHOUT ROWID;
+        """,
+    ),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    async with db.execute("PRAGMA user_version") as cur:
+        row = await cur.fetchone()
+        return int(row[0]) if row else 0
+
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Bring the schema up to SCHEMA_VERSION; returns the version found before migrating."""
+    current = await get_schema_version(db)
+    if current >= SCHEMA_VERSION:
+        return current
+    # Serialize concurrent starters (several webhook workers) and re-check under the lock
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        current = await get_schema_version(db)
+        for version in range(current, SCHEMA_VERSION):
+            for statement in MIGRATIONS[version]:
+                await db.execute(statement)
+        await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return current
+
+
+def _uses_index(details: Sequence[str]) -> bool:
+    for detail in details:
+        if detail.startswith("SCAN") and "INDEX" not in detail:
+            return False
+        if "TEMP B-TREE" in detail:
+            return False
+    return any("INDEX" in detail or "PRIMARY KEY" in detail for detail in details)
+
+
+async def explain(db: aiosqlite.Connection, sql: str, params: Sequence[Any] = ()) -> List[str]:
+    async with db.execute("EXPLAIN QUERY PLAN " + sql, tuple(params)) as cur:
+        return [str(row[3]) for row in await cur.fetchall()]
+
+
+async def check_query_plans(
+    db: aiosqlite.Connection, queries: Dict[str, Tuple[str, Sequence[Any]]]
+) -> Dict[str, List[str]]:
+    """Assert that every query is answered through an index, without full scans or sorts."""
+    plans: Dict[str, List[str]] = {}
+    failures: List[str] = []
+    for name, (sql, params) in queries.items():
+        details = await explain(db, sql, params)
+        plans[name] = details
+        if not _uses_index(details):
+            failures.append(f"{name}: {'; '.join(details)}")
+    if failures:
+        raise RuntimeError("Queries not served by an index:\n" + "\n".join(failures))
+    return plans
+
+
+async def _main(path: str) -> None:
+    from app.db import HOT_QUERIES
+
+    async with aiosqlite.connect(path) as db:
+        before = await migrate(db)
+        print(f"schema version {before} -> {SCHEMA_VERSION}")
+        plans = await check_query_plans(db, HOT_QUERIES)
+    for name, details in plans.items():
+        print(f"{name}: {'; '.join(details)}")
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.migrations path/to/taxi_bot.sqlite3
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m app.migrations DB_PATH")
+    asyncio.run(_main(sys.argv[1]))
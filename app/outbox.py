@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import EditMessageCaption, EditMessageReplyMarkup, EditMessageText, TelegramMethod
+
+from app.metrics import REGISTRY, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, drained strictly in this order
+INTERACTIVE = 0  # replies to the user who is pressing buttons right now, callback answers
+NOTIFY = 1  # messages to other users about their own orders
+BROADCAST = 2  # order offers to every driver and their retractions
+LANE_NAMES = ("interactive", "notify", "broadcast")
+
+# Edits of one message that are still queued collapse into the newest one
+_COALESCED_METHODS = (EditMessageText, EditMessageReplyMarkup, EditMessageCaption)
+
+OUTBOX_QUEUED: Gauge = REGISTRY.register(
+    Gauge("bot_outbox_queued", "Bot API calls waiting in the outbox", ["lane"])
+)
+OUTBOX_EVENTS: Counter = REGISTRY.register(
+    Counter("bot_outbox_events_total", "Outbox calls coalesced, retried after RetryAfter, failed or dropped", ["event"])
+)
+
+
+class RateLimiter:
+    """Spaces calls evenly so that at most ``rate`` of them start per second."""
+
+    def __init__(self, rate: float) -> None:
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self._interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _Job:
+    __slots__ = ("method", "chat_id", "lane", "future", "key", "attempts")
+
+    def __init__(self, method: TelegramMethod[Any], chat_id: Optional[int], lane: int, key: Optional[Tuple]) -> None:
+        self.method = method
+        self.chat_id = chat_id
+        self.lane = lane
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.key = key
+        self.attempts = 0
+
+
+def _chat_of(method: TelegramMethod[Any]) -> Optional[int]:
+    chat_id = getattr(method, "chat_id", None)
+    return chat_id if isinstance(chat_id, int) else None
+
+
+def _coalesce_key(method: TelegramMethod[Any], chat_id: Optional[int]) -> Optional[Tuple]:
+    if isinstance(method, _COALESCED_METHODS) and chat_id is not None and method.message_id is not None:
+        return type(method).__name__, chat_id, method.message_id
+    return None
+
+
+def _log_failure(method: TelegramMethod[Any], error: Exception) -> None:
+    if isinstance(error, TelegramBadRequest) and "not modified" in str(error):
+        return
+    logger.warning("Bot API call %s failed: %s", method.__api_method__, error)
+
+
+class Outbox:
+    """Queue for outbound Bot API calls that keeps the bot under Telegram's flood limits.
+
+    Calls are taken from the highest-priority lane first and, within a lane,
+    round-robin over chats, so one busy chat cannot hold up the others. Every
+    chat has its own token bucket (``chat_rate`` per second, ``chat_burst``
+    tokens) on top of the global ``rate``, and at most one call per chat is in
+    flight, which keeps the calls of a chat in the order they were queued.
+    A RetryAfter pauses the chat (or, for calls without a chat, the whole
+    outbox) for the requested time and requeues the call in front. Queued
+    edits of the same message are coalesced: only the newest text/markup is
+    sent and every caller gets its result.
+
+    Failed calls are logged and resolve to None instead of raising, so a
+    handler can hand a call over and return without waiting on the network.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: int = 3,
+        concurrency: int = 16,
+        max_retries: int = 3,
+        max_queued: int = 10000,
+        max_chats: int = 10000,
+    ) -> None:
+        self._bot = bot
+        self._limiter = RateLimiter(rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = float(chat_burst)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._max_retries = max_retries
+        self._max_queued = max_queued
+        self._max_chats = max_chats
+        self._lanes: List[OrderedDict[Optional[int], Deque[_Job]]] = [OrderedDict() for _ in LANE_NAMES]
+        self._lane_sizes = [0] * len(LANE_NAMES)
+        self._pending_edits: Dict[Tuple, _Job] = {}
+        # chat id -> [tokens, last refill, paused until]
+        self._chats: OrderedDict[int, List[float]] = OrderedDict()
+        self._paused_until = 0.0
+        self._busy: Set[int] = set()
+        self._in_flight: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        for lane, name in enumerate(LANE_NAMES):
+            OUTBOX_QUEUED.set_function(lambda lane=lane: self._lane_sizes[lane], name)
+
+    @property
+    def queued(self) -> int:
+        return sum(self._lane_sizes)
+
+    def start(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    def submit(self, method: TelegramMethod[Any], lane: int = INTERACTIVE) -> asyncio.Future:
+        chat_id = _chat_of(method)
+        key = _coalesce_key(method, chat_id)
+        if key is not None:
+            queued = self._pending_edits.get(key)
+            if queued is not None:
+                queued.method = method
+                if lane < queued.lane:
+                    self._promote(queued, lane)
+                OUTBOX_EVENTS.inc("coalesced")
+                return queued.future
+        job = _Job(method, chat_id, lane, key)
+        if lane != INTERACTIVE and self.queued >= self._max_queued:
+            OUTBOX_EVENTS.inc("dropped")
+            logger.warning("Outbox full, dropping %s to chat %s", method.__api_method__, chat_id)
+            job.future.set_result(None)
+            return job.future
+        if key is not None:
+            self._pending_edits[key] = job
+        self._enqueue(job)
+        return job.future
+
+    def _enqueue(self, job: _Job, front: bool = False) -> None:
+        lane = self._lanes[job.lane]
+        jobs = lane.get(job.chat_id)
+        if jobs is None:
+            jobs = lane[job.chat_id] = deque()
+        if front:
+            jobs.appendleft(job)
+            lane.move_to_end(job.chat_id, last=False)
+        else:
+            jobs.append(job)
+        self._lane_sizes[job.lane] += 1
+        self._wakeup.set()
+
+    def _promote(self, job: _Job, lane: int) -> None:
+        queued = self._lanes[job.lane]
+        jobs = queued[job.chat_id]
+        jobs.remove(job)
+        if not jobs:
+            del queued[job.chat_id]
+        self._lane_sizes[job.lane] -= 1
+        job.lane = lane
+        self._enqueue(job)
+
+    def _chat_ready_at(self, chat_id: int, now: float) -> float:
+        state = self._chats.get(chat_id)
+        if state is None:
+            return now
+        tokens, last, paused_until = state
+        if self._chat_rate > 0:
+            tokens = min(self._chat_burst, tokens + (now - last) * self._chat_rate)
+            if tokens < 1.0:
+                return max(paused_until, now + (1.0 - tokens) / self._chat_rate)
+        return max(paused_until, now)
+
+    def _take_chat_token(self, chat_id: int, now: float) -> None:
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = [self._chat_burst, now, 0.0]
+            if len(self._chats) > self._max_chats:
+                # Forgetting an idle chat only hands it a fresh burst
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+            if self._chat_rate > 0:
+                state[0] = min(self._chat_burst, state[0] + (now - state[1]) * self._chat_rate)
+        state[0] -= 1.0
+        state[1] = now
+
+    def _pick(self, now: float) -> Tuple[Optional[_Job], Optional[float]]:
+        """Next job that may start now, or the time worth waiting until for one."""
+        if now < self._paused_until:
+            return None, self._paused_until
+        wake_at: Optional[float] = None
+        for lane_index, lane in enumerate(self._lanes):
+            for chat_id, jobs in lane.items():
+                if chat_id is not None:
+                    if chat_id in self._busy:
+                        continue
+                    ready_at = self._chat_ready_at(chat_id, now)
+                    if ready_at > now:
+                        wake_at = ready_at if wake_at is None else min(wake_at, ready_at)
+                        continue
+                    self._take_chat_token(chat_id, now)
+                    self._busy.add(chat_id)
+                job = jobs.popleft()
+                if jobs:
+                    lane.move_to_end(chat_id)
+                else:
+                    del lane[chat_id]
+                self._lane_sizes[lane_index] -= 1
+                if job.key is not None and self._pending_edits.get(job.key) is job:
+                    # Edits queued from now on are newer than what is being sent
+                    del self._pending_edits[job.key]
+                return job, None
+        return None, wake_at
+
+    async def _run(self) -> None:
+        while True:
+            await self._semaphore.acquire()
+            job = None
+            try:
+                while job is None:
+                    job, wake_at = self._pick(time.monotonic())
+                    if job is None:
+                        self._wakeup.clear()
+                        timeout = None if wake_at is None else max(0.0, wake_at - time.monotonic())
+                        try:
+                            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                        except asyncio.TimeoutError:
+                            pass
+                await self._limiter.wait()
+            except BaseException:
+                self._semaphore.release()
+                if job is not None:
+                    if job.key is not None:
+                        self._pending_edits.setdefault(job.key, job)
+                    self._enqueue(job, front=True)
+                    self._busy.discard(job.chat_id)
+                raise
+            task = asyncio.create_task(self._send(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, job: _Job) -> None:
+        try:
+            result = await self._bot(job.method)
+        except TelegramRetryAfter as e:
+            if job.attempts < self._max_retries:
+                job.attempts += 1
+                OUTBOX_EVENTS.inc("retried")
+                self._pause(job.chat_id, e.retry_after)
+                if job.key is not None:
+                    newer = self._pending_edits.get(job.key)
+                    if newer is not None:
+                        # A newer edit was queued meanwhile; this one is obsolete
+                        newer.future.add_done_callback(lambda f: _chain(f, job.future))
+                        return
+                    self._pending_edits[job.key] = job
+                self._enqueue(job, front=True)
+                return
+            OUTBOX_EVENTS.inc("failed")
+            _log_failure(job.method, e)
+            job.future.set_result(None)
+        except TelegramAPIError as e:
+            OUTBOX_EVENTS.inc("failed")
+            _log_failure(job.method, e)
+            job.future.set_result(None)
+        except Exception:
+            OUTBOX_EVENTS.inc("failed")
+            logger.exception("Bot API call %s failed", job.method.__api_method__)
+            job.future.set_result(None)
+        else:
+            job.future.set_result(result)
+        finally:
+            if job.chat_id is not None:
+                self._busy.discard(job.chat_id)
+            self._semaphore.release()
+            self._wakeup.set()
+
+    def _pause(self, chat_id: Optional[int], seconds: float) -> None:
+        until = time.monotonic() + seconds
+        if chat_id is None:
+            self._paused_until = max(self._paused_until, until)
+            return
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = [self._chat_burst, time.monotonic(), 0.0]
+        state[2] = max(state[2], until)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Send what is queued (up to ``timeout`` seconds), then stop."""
+        deadline = time.monotonic() + timeout
+        while (self.queued or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        if self._in_flight:
+            await asyncio.wait(self._in_flight, timeout=max(0.0, deadline - time.monotonic()))
+        dropped = 0
+        for lane in self._lanes:
+            for jobs in lane.values():
+                for job in jobs:
+                    dropped += 1
+                    if not job.future.done():
+                        job.future.set_result(None)
+            lane.clear()
+        self._lane_sizes = [0] * len(LANE_NAMES)
+        self._pending_edits.clear()
+        if dropped:
+            OUTBOX_EVENTS.inc("dropped", amount=dropped)
+            logger.warning("Outbox closed with %d unsent calls", dropped)
+
+
+def _chain(source: asyncio.Future, target: asyncio.Future) -> None:
+    if not target.done():
+        target.set_result(None if source.cancelled() else source.result())
+
+
+async def _call_directly(method: TelegramMethod[Any], max_retries: int = 3) -> Any:
+    for attempt in range(max_retries + 1):
+        try:
+            return await method
+        except TelegramRetryAfter as e:
+            if attempt == max_retries:
+                _log_failure(method, e)
+                return None
+            await asyncio.sleep(e.retry_after)
+        except TelegramAPIError as e:
+            _log_failure(method, e)
+            return None
+    return None
+
+
+_OUTBOX: Outbox | None = None
+
+
+def setup_outbox(
+    bot: Bot, rate: float = 30.0, chat_rate: float = 1.0, chat_burst: int = 3, concurrency: int = 16
+) -> None:
+    global _OUTBOX
+    _OUTBOX = Outbox(bot, rate=rate, chat_rate=chat_rate, chat_burst=chat_burst, concurrency=concurrency)
+    _OUTBOX.start()
+
+
+def deliver(method: TelegramMethod[Any], lane: int = INTERACTIVE) -> asyncio.Future:
+    """Hand a bound Bot API call (``message.answer(...)``, ``cb.answer()``...) over for sending.
+
+    Returns a future with the call's result (None if it failed); handlers
+    normally don't await it. Without setup_outbox() the call starts right away.
+    """
+    if _OUTBOX is not None:
+        return _OUTBOX.submit(method, lane)
+    return asyncio.ensure_future(_call_directly(method))
+
+
+async def close_outbox() -> None:
+    global _OUTBOX
+    if _OUTBOX is None:
+        return
+    outbox, _OUTBOX = _OUTBOX, None
+    await outbox.close()
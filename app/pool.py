@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
+
+import aiosqlite
+
+# Applied once to every pooled connection right after it is opened
+_PRAGMAS = (
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA temp_store = MEMORY;",
+)
+
+
+class ConnectionPool:
+    """Fixed-size pool of warm aiosqlite connections.
+
+    Each connection keeps its own worker thread and sqlite3 statement cache
+    alive between queries, so repeated queries skip both the connect and the
+    prepare step.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int = 4,
+        cache_size_kib: int = 16384,
+        mmap_size: int = 256 * 1024 * 1024,
+        cached_statements: int = 256,
+    ) -> None:
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._path = path
+        self._size = size
+        self._cache_size_kib = cache_size_kib
+        self._mmap_size = mmap_size
+        self._cached_statements = cached_statements
+        self._idle: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._connections: List[aiosqlite.Connection] = []
+        self._closed = True
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def _open_connection(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self._path, cached_statements=self._cached_statements)
+        db.row_factory = aiosqlite.Row
+        for pragma in _PRAGMAS:
+            await db.execute(pragma)
+        await db.execute(f"PRAGMA cache_size = -{int(self._cache_size_kib)};")
+        await db.execute(f"PRAGMA mmap_size = {int(self._mmap_size)};")
+        return db
+
+    async def open(self) -> None:
+        if not self._closed:
+            return
+        for _ in range(self._size):
+            db = await self._open_connection()
+            self._connections.append(db)
+            self._idle.put_nowait(db)
+        self._closed = False
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        db = await self._idle.get()
+        try:
+            yield db
+        finally:
+            # Never hand out a connection with a half-finished transaction
+            if db.in_transaction:
+                await db.rollback()
+            self._idle.put_nowait(db)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        # Wait for borrowed connections to come back before closing them
+        try:
+            for _ in range(len(self._connections)):
+                await asyncio.wait_for(self._idle.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        for db in self._connections:
+            await db.close()
+        self._connections.clear()
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.db import end_shift, load_driver_activity, load_presence, save_driver_activity, save_presence, start_shift
+from app.metrics import REGISTRY, Gauge
+
+logger = logging.getLogger(__name__)
+
+DRIVERS_ONLINE: Gauge = REGISTRY.register(Gauge("bot_drivers_online", "Drivers currently on shift"))
+
+
+class _Shift:
+    __slots__ = ("online_since", "last_seen", "lat", "lon")
+
+    def __init__(self, online_since: float, last_seen: float) -> None:
+        self.online_since = online_since
+        self.last_seen = last_seen
+        self.lat: Optional[float] = None
+        self.lon: Optional[float] = None
+
+
+class Presence:
+    """Which drivers are on shift right now, with their last known location.
+
+    Shifts are kept in an OrderedDict ordered by last heartbeat, so lookups
+    and the online count are O(1) and expiring the drivers that went silent
+    for ``timeout`` seconds only touches the expired entries at the front.
+    Any driver interaction or live location update counts as a heartbeat.
+
+    This is one process's copy of driver_presence, where every shift is a
+    row of its own: going on and off shift writes the driver's row at once,
+    heartbeats and locations are written to existing rows with every
+    snapshot, and the snapshot then reads the table back, so shifts started
+    or ended by other processes show up here within a snapshot interval.
+
+    Updates from anyone, on shift or not, are also noted as activity (LRU-
+    bounded by ``max_users``) and written to driver_activity with every
+    snapshot, which is what app.expiry goes by before taking an order back.
+    """
+
+    def __init__(self, timeout: float = 900.0, max_users: int = 10000) -> None:
+        self.timeout = timeout
+        self.max_users = max_users
+        self.snapshot_interval = 10.0
+        self._shifts: OrderedDict[int, _Shift] = OrderedDict()
+        # user id -> time of their last update, and those not written to driver_activity yet
+        self._heard: OrderedDict[int, float] = OrderedDict()
+        self._unsaved: Dict[int, float] = {}
+        # Locations survive going off shift so a returning driver is matched at once
+        self._locations: Dict[int, Tuple[float, float]] = {}
+        # Shifts with heartbeats or locations not written yet
+        self._dirty: Set[int] = set()
+        # driver -> when this process last started or ended their shift
+        self._toggled: Dict[int, float] = {}
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.timeout
+        while self._shifts:
+            tg_id, shift = next(iter(self._shifts.items()))
+            if shift.last_seen >= cutoff:
+                break
+            del self._shifts[tg_id]
+            self._dirty.discard(tg_id)
+            logger.info("Driver %s went offline after %.0fs without a heartbeat", tg_id, now - shift.last_seen)
+
+    def go_online(self, tg_id: int, now: Optional[float] = None) -> Optional[_Shift]:
+        """Start or extend the shift; returns the shift if it has just started."""
+        now = time.time() if now is None else now
+        shift = self._shifts.get(tg_id)
+        if shift is not None:
+            shift.last_seen = now
+            self._shifts.move_to_end(tg_id)
+            self._dirty.add(tg_id)
+            return None
+        shift = self._shifts[tg_id] = _Shift(now, now)
+        location = self._locations.get(tg_id)
+        if location is not None:
+            shift.lat, shift.lon = location
+        self._toggled[tg_id] = now
+        return shift
+
+    def go_offline(self, tg_id: int) -> bool:
+        self._dirty.discard(tg_id)
+        if self._shifts.pop(tg_id, None) is None:
+            return False
+        self._toggled[tg_id] = time.time()
+        return True
+
+    def touch(self, tg_id: int, now: Optional[float] = None) -> None:
+        """Heartbeat; notes the activity of anyone, extends the shift of drivers on shift."""
+        now = time.time() if now is None else now
+        self._heard[tg_id] = now
+        self._heard.move_to_end(tg_id)
+        if len(self._heard) > self.max_users:
+            self._heard.popitem(last=False)
+        self._unsaved[tg_id] = now
+        shift = self._shifts.get(tg_id)
+        if shift is not None:
+            shift.last_seen = now
+            self._shifts.move_to_end(tg_id)
+            self._dirty.add(tg_id)
+
+    def set_location(self, tg_id: int, lat: float, lon: float) -> None:
+        self._locations[tg_id] = (lat, lon)
+        shift = self._shifts.get(tg_id)
+        if shift is not None:
+            shift.lat, shift.lon = lat, lon
+        self.touch(tg_id)
+
+    def location(self, tg_id: int) -> Optional[Tuple[float, float]]:
+        return self._locations.get(tg_id)
+
+    def is_online(self, tg_id: int) -> bool:
+        shift = self._shifts.get(tg_id)
+        return shift is not None and shift.last_seen >= time.time() - self.timeout
+
+    def last_heard(self, tg_id: int) -> Optional[float]:
+        shift = self._shifts.get(tg_id)
+        known = [t for t in (self._heard.get(tg_id), shift.last_seen if shift is not None else None) if t is not None]
+        return max(known) if known else None
+
+    def take_unsaved(self) -> List[Tuple[int, float]]:
+        rows, self._unsaved = list(self._unsaved.items()), {}
+        return rows
+
+    def online_ids(self) -> List[int]:
+        self._expire(time.time())
+        return list(self._shifts)
+
+    def online_count(self) -> int:
+        self._expire(time.time())
+        return len(self._shifts)
+
+    def row(self, tg_id: int, shift: _Shift) -> Tuple[int, float, float, Optional[float], Optional[float]]:
+        return (tg_id, shift.online_since, shift.last_seen, shift.lat, shift.lon)
+
+    def take_dirty(self) -> List[Tuple[int, float, float, Optional[float], Optional[float]]]:
+        rows = [self.row(tg_id, self._shifts[tg_id]) for tg_id in self._dirty if tg_id in self._shifts]
+        self._dirty.clear()
+        return rows
+
+    def merge(self, rows: List[Tuple[int, float, float, Optional[float], Optional[float]]], read_at: float) -> None:
+        """Make the shifts those of ``rows``, as read from driver_presence at ``read_at``.
+
+        Drivers whose shift this process started or ended after the read keep
+        their local state; the heartbeats and locations not written yet are kept.
+        """
+        stored = {row[0]: row for row in rows}
+        for tg_id in [t for t in self._shifts if t not in stored and self._toggled.get(t, 0.0) < read_at]:
+            del self._shifts[tg_id]
+            self._dirty.discard(tg_id)
+        for tg_id, online_since, last_seen, lat, lon in sorted(rows, key=lambda r: r[2]):
+            if self._toggled.get(tg_id, 0.0) >= read_at:
+                continue
+            shift = self._shifts.get(tg_id)
+            if shift is None:
+                shift = self._shifts[tg_id] = _Shift(online_since, last_seen)
+            else:
+                shift.online_since = online_since
+                shift.last_seen = max(shift.last_seen, last_seen)
+            if lat is not None and lon is not None and tg_id not in self._dirty:
+                shift.lat, shift.lon = lat, lon
+                self._locations[tg_id] = (lat, lon)
+        self._shifts = OrderedDict(sorted(self._shifts.items(), key=lambda item: item[1].last_seen))
+        self._toggled = {t: at for t, at in self._toggled.items() if at >= read_at}
+        self._expire(time.time())
+
+
+_PRESENCE = Presence()
+_TASK: Optional[asyncio.Task] = None
+
+DRIVERS_ONLINE.set_function(lambda: _PRESENCE.online_count())
+
+
+async def go_online(tg_id: int) -> None:
+    shift = _PRESENCE.go_online(tg_id)
+    if shift is not None:
+        await start_shift(_PRESENCE.row(tg_id, shift))
+
+
+async def go_offline(tg_id: int) -> None:
+    if _PRESENCE.go_offline(tg_id):
+        await end_shift(tg_id)
+
+
+def set_driver_location(tg_id: int, lat: float, lon: float) -> None:
+    _PRESENCE.set_location(tg_id, lat, lon)
+
+
+def get_driver_location(tg_id: int) -> Optional[Tuple[float, float]]:
+    return _PRESENCE.location(tg_id)
+
+
+def is_online(tg_id: int) -> bool:
+    return _PRESENCE.is_online(tg_id)
+
+
+async def last_active(tg_id: int) -> Optional[float]:
+    """Time of the driver's last update seen by this process or any other, None if there is no record.
+
+    Other processes write their heartbeats once per snapshot interval, so a
+    stored one is taken to be that much later: a driver busy in another
+    process is never taken for a silent one.
+    """
+    stored = await load_driver_activity(tg_id)
+    known = [t for t in (_PRESENCE.last_heard(tg_id), stored) if t is not None]
+    if stored is not None:
+        known.append(stored + _PRESENCE.snapshot_interval)
+    return max(known) if known else None
+
+
+def online_driver_ids() -> List[int]:
+    return _PRESENCE.online_ids()
+
+
+def online_count() -> int:
+    return _PRESENCE.online_count()
+
+
+class PresenceMiddleware(BaseMiddleware):
+    """Counts every update from an on-shift driver as a heartbeat."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            _PRESENCE.touch(user.id)
+        return await handler(event, data)
+
+
+async def _snapshot(sync: bool = True) -> None:
+    heard = _PRESENCE.take_unsaved()
+    if heard:
+        await save_driver_activity(heard)
+    await save_presence(_PRESENCE.take_dirty(), expire_before=time.time() - _PRESENCE.timeout)
+    if sync:
+        read_at = time.time()
+        _PRESENCE.merge(await load_presence(), read_at)
+
+
+async def _presence_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await _snapshot()
+        except Exception:
+            logger.exception("Presence snapshot failed")
+
+
+async def start_presence(timeout: float = 900.0, snapshot_interval: float = 10.0) -> None:
+    """Read the shifts from driver_presence, then write and re-read them every ``snapshot_interval`` seconds."""
+    global _TASK
+    _PRESENCE.timeout = timeout
+    _PRESENCE.snapshot_interval = snapshot_interval
+    _PRESENCE.merge(await load_presence(), time.time())
+    if _TASK is None:
+        _TASK = asyncio.create_task(_presence_loop(snapshot_interval))
+
+
+async def stop_presence() -> None:
+    global _TASK
+    if _TASK is not None:
+        task, _TASK = _TASK, None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    try:
+        await _snapshot(sync=False)
+    except Exception:
+        logger.exception("Final presence snapshot failed")
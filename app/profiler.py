@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import logging
+import signal
+import sqlite3
+import time
+from contextlib import suppress
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (sql, params) run by the traced call in progress; None while nothing is traced
+Statement = Tuple[str, Tuple[Any, ...]]
+_STATEMENTS: ContextVar[Optional[List[Statement]]] = ContextVar("db_statements", default=None)
+
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def current_statements() -> Optional[List[Statement]]:
+    """Where the query function being traced collects its statements, or None."""
+    return _STATEMENTS.get()
+
+
+def _rows(result: Any) -> int:
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        # (rows, has_prev, has_next) pages
+        return len(result[0])
+    if isinstance(result, int):
+        # Counts of rows written (archive_orders, prune_order_events); True/False for claims
+        return int(result)
+    return 0 if result is None else 1
+
+
+@dataclass
+class QueryStats:
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    rows: int = 0
+    slow: int = 0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+
+class TracedConnection:
+    """An aiosqlite connection that notes every statement executed through it."""
+
+    def __init__(self, conn: Any, statements: List[Statement]) -> None:
+        self._conn = conn
+        self._statements = statements
+
+    def execute(self, sql: str, parameters: Sequence[Any] = ()) -> Any:
+        self._statements.append((sql, tuple(parameters or ())))
+        return self._conn.execute(sql, parameters)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+
+def traced_op(op: Callable[[sqlite3.Connection], Any], statements: List[Statement]) -> Callable[..., Any]:
+    """Wrap a write op so the statements it runs (with their parameters inlined) are noted."""
+
+    def run(conn: sqlite3.Connection) -> Any:
+        conn.set_trace_callback(lambda sql: statements.append((sql, ())))
+        try:
+            return op(conn)
+        finally:
+            conn.set_trace_callback(None)
+
+    return run
+
+
+class QueryProfiler:
+    """Per-function call counts, latency and rows of the query functions in app.db.
+
+    Off by default; while off a traced function costs one flag check. When
+    on, every call is timed (including the wait for a pooled connection or
+    the group commit, which is what the handler sees) and a call slower than
+    ``slow_threshold`` seconds is logged with the EXPLAIN QUERY PLAN of each
+    statement it ran, at most once per ``slow_log_interval`` seconds per
+    function. Async generators are timed while they produce rows, not while
+    the caller consumes them.
+    """
+
+    def __init__(self, slow_threshold: float = 0.1, slow_log_interval: float = 10.0) -> None:
+        self.enabled = False
+        self.slow_threshold = slow_threshold
+        self.slow_log_interval = slow_log_interval
+        self.stats: Dict[str, QueryStats] = {}
+        # EXPLAIN QUERY PLAN runner, set by app.db
+        self.explain: Optional[Callable[[str, Sequence[Any]], Awaitable[List[str]]]] = None
+        self._slow_logged: Dict[str, float] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def reset(self) -> None:
+        self.stats.clear()
+        self._slow_logged.clear()
+
+    def _record(self, name: str, elapsed: float, rows: int) -> QueryStats:
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = QueryStats()
+        stats.calls += 1
+        stats.total += elapsed
+        stats.rows += rows
+        if elapsed > stats.max:
+            stats.max = elapsed
+        return stats
+
+    def _slow(self, name: str, elapsed: float, stats: QueryStats, statements: List[Statement]) -> None:
+        stats.slow += 1
+        now = time.monotonic()
+        if now - self._slow_logged.get(name, -self.slow_log_interval) < self.slow_log_interval:
+            return
+        self._slow_logged[name] = now
+        task = asyncio.create_task(self._log_slow(name, elapsed, statements))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _log_slow(self, name: str, elapsed: float, statements: List[Statement]) -> None:
+        _STATEMENTS.set(None)
+        lines = [f"Slow query: {name} took {elapsed * 1000:.1f} ms"]
+        for sql, params in dict.fromkeys(statements):
+            lines.append("  " + " ".join(sql.split()) + (f"  params={params!r}" if params else ""))
+            if self.explain is None or not sql.lstrip().upper().startswith(_EXPLAINABLE):
+                continue
+            try:
+                plan = await self.explain(sql, params)
+            except Exception as e:
+                plan = [f"EXPLAIN failed: {e}"]
+            lines += [f"    {detail}" for detail in plan]
+        logger.warning("\n".join(lines))
+
+    def trace(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        name = fn.__name__
+        if inspect.isasyncgenfunction(fn):
+
+            @functools.wraps(fn)
+            async def generator(*args: Any, **kwargs: Any) -> Any:
+                if not self.enabled:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                    return
+                elapsed, rows = 0.0, 0
+                agen = fn(*args, **kwargs)
+                try:
+                    while True:
+                        started = time.perf_counter()
+                        try:
+                            item = await agen.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            elapsed += time.perf_counter() - started
+                        rows += _rows(item)
+                        yield item
+                finally:
+                    await agen.aclose()
+                    self._record(name, elapsed, rows)
+
+            return generator
+
+        @functools.wraps(fn)
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            if not self.enabled:
+                return await fn(*args, **kwargs)
+            statements: List[Statement] = []
+            token = _STATEMENTS.set(statements)
+            started = time.perf_counter()
+            result = None
+            try:
+                result = await fn(*args, **kwargs)
+                return result
+            finally:
+                elapsed = time.perf_counter() - started
+                _STATEMENTS.reset(token)
+                stats = self._record(name, elapsed, _rows(result))
+                if elapsed >= self.slow_threshold:
+                    self._slow(name, elapsed, stats, statements)
+
+        return call
+
+    def report(self, limit: Optional[int] = None) -> str:
+        """The functions by total time spent, as a fixed-width table."""
+        rows = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+        total = sum(s.total for s in self.stats.values())
+        lines = [
+            f"{'function':<27}{'calls':>8}{'total ms':>10}{'%':>5}{'mean ms':>9}{'max ms':>9}{'rows':>9}{'slow':>6}"
+        ]
+        for name, s in rows:
+            lines.append(
+                f"{name[:26]:<27}{s.calls:>8}{s.total * 1000:>10.1f}{s.total / total * 100 if total else 0:>5.0f}"
+                f"{s.mean * 1000:>9.2f}{s.max * 1000:>9.1f}{s.rows:>9}{s.slow:>6}"
+            )
+        if not rows:
+            lines.append("(no calls recorded)")
+        return "\n".join(lines)
+
+
+PROFILER = QueryProfiler()
+
+
+def traced(fn: Callable[..., Any]) -> Callable[..., Any]:
+    return PROFILER.trace(fn)
+
+
+def configure_profiler(enabled: bool, slow_threshold: float = 0.1) -> None:
+    PROFILER.enabled = enabled
+    PROFILER.slow_threshold = slow_threshold
+
+
+def log_report_on_signal(sig: int = getattr(signal, "SIGUSR1", 0)) -> None:
+    """Log the report whenever the process receives ``sig`` (``kill -USR1 <pid>``)."""
+    with suppress(NotImplementedError, ValueError, RuntimeError):
+        if sig:
+            asyncio.get_running_loop().add_signal_handler(
+                sig, lambda: logger.info("DB query profile (enabled=%s):\n%s", PROFILER.enabled, PROFILER.report())
+            )
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+from collections import OrderedDict
+from html import escape
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+from aiohttp import FormData
+from pydantic import ConfigDict, PrivateAttr
+
+# Keyboards are built once (or from pre-serialized fragments) and carry the
+# JSON they are sent as; RenderingSession puts that JSON on the wire instead
+# of dumping and re-encoding the markup on every call. Rendered markups are
+# frozen because they (and their buttons) are shared between handlers.
+
+
+class RenderedInlineKeyboard(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+    _json: str = PrivateAttr(default="")
+
+
+class RenderedReplyKeyboard(ReplyKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+    _json: str = PrivateAttr(default="")
+
+
+_RENDERED = (RenderedInlineKeyboard, RenderedReplyKeyboard)
+
+# (text, callback_data) per button, one list per row
+Rows = Sequence[Sequence[Tuple[str, str]]]
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def static_inline_keyboard(rows: Rows) -> RenderedInlineKeyboard:
+    """A keyboard that never changes; build it once at import time and share it."""
+    markup = RenderedInlineKeyboard(
+        inline_keyboard=[[InlineKeyboardButton(text=text, callback_data=data) for text, data in row] for row in rows]
+    )
+    markup._json = _dumps(
+        {"inline_keyboard": [[{"text": text, "callback_data": data} for text, data in row] for row in rows]}
+    )
+    return markup
+
+
+def static_reply_keyboard(button: Dict[str, Any], **options: Any) -> RenderedReplyKeyboard:
+    """A one-button reply keyboard, e.g. ``{"text": ..., "request_contact": True}``."""
+    markup = RenderedReplyKeyboard(keyboard=[[KeyboardButton(**button)]], **options)
+    markup._json = _dumps({"keyboard": [[button]], **options})
+    return markup
+
+
+class RowTemplate:
+    """A one-button row whose text and callback data may hold a ``%d`` placeholder.
+
+    The JSON is serialized once with the placeholder in it; the button rows
+    for recent values are kept, since the same open orders are listed to
+    many drivers.
+    """
+
+    __slots__ = ("text", "data", "_json", "_rows", "_max_rows")
+
+    def __init__(self, text: str, data: str, max_rows: int = 1024) -> None:
+        self.text = text
+        self.data = data
+        self._json = _dumps([{"text": text, "callback_data": data}])
+        self._rows: OrderedDict[int, List[InlineKeyboardButton]] = OrderedDict()
+        self._max_rows = max_rows
+
+    def row(self, value: int) -> List[InlineKeyboardButton]:
+        row = self._rows.get(value)
+        if row is None:
+            value_str = str(value)
+            row = self._rows[value] = [
+                InlineKeyboardButton(
+                    text=self.text.replace("%d", value_str), callback_data=self.data.replace("%d", value_str)
+                )
+            ]
+            if len(self._rows) > self._max_rows:
+                self._rows.popitem(last=False)
+        else:
+            self._rows.move_to_end(value)
+        return row
+
+    def json(self, value: int) -> str:
+        return self._json.replace("%d", str(value))
+
+
+def inline_keyboard(rows: Sequence[Tuple[RowTemplate, int]]) -> RenderedInlineKeyboard:
+    """Join pre-serialized row fragments instead of dumping and encoding a new markup."""
+    markup = RenderedInlineKeyboard(inline_keyboard=[template.row(value) for template, value in rows])
+    markup._json = '{"inline_keyboard":[' + ",".join(template.json(value) for template, value in rows) + "]}"
+    return markup
+
+
+class RenderingSession(AiohttpSession):
+    """AiohttpSession that sends rendered keyboards as the JSON they carry."""
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod[Any]) -> FormData:
+        markup = getattr(method, "reply_markup", None)
+        if not isinstance(markup, _RENDERED):
+            return super().build_form_data(bot, method)
+        form = FormData(quote_fields=False)
+        files: Dict[str, Any] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", markup._json)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
+
+
+# Order texts shared by the routers and background senders. Addresses are
+# typed by passengers, so they are escaped for the bot's HTML parse mode.
+def route(pickup: str, destination: str) -> str:
+    return f"{escape(pickup, quote=False)} → {escape(destination, quote=False)}"
+
+
+def order_line(order_id: int, pickup: str, destination: str) -> str:
+    return f"#{order_id}: {route(pickup, destination)}"
+
+
+def order_status(title: str, order: Mapping[str, Any]) -> str:
+    return f"{title} #{order['id']}: {route(order['pickup'], order['destination'])} (статус: {order['status']})"
+
+
+def order_list(title: str, lines: List[str]) -> str:
+    return title + "\n" + ("\n".join(lines) if lines else "Нет заказов")
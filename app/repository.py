@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import db
+
+# (rows, has_prev, has_next), see app.db.page_drivers
+Page = Tuple[List[Dict[str, Any]], bool, bool]
+
+
+class Repository(ABC):
+    """Users, drivers and orders as the handlers and background services use them.
+
+    Rows are plain dicts with the columns of the SQLite tables, timestamps
+    as SQLite's ``YYYY-MM-DD HH:MM:SS`` UTC text. Order transitions are
+    conditional on the current status and return whether (or the row that)
+    they applied, so of two drivers taking the same order exactly one wins.
+    Bookkeeping that only makes sense for the database (presence snapshot,
+    update offset, archive, export, the order event log) stays in app.db.
+    """
+
+    # Users
+    @abstractmethod
+    async def upsert_user(self, tg_id: int, full_name: str) -> None: ...
+
+    @abstractmethod
+    async def get_user(self, tg_id: int) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def set_user_phone(self, tg_id: int, phone: str) -> None: ...
+
+    # Drivers
+    @abstractmethod
+    async def add_driver(self, tg_id: int, full_name: str) -> bool:
+        """False if ``tg_id`` is already a driver."""
+
+    @abstractmethod
+    async def add_drivers(self, rows: List[Tuple[int, str]]) -> List[int]:
+        """Add (tg_id, full_name) rows at once; returns the tg_ids that were already drivers."""
+
+    @abstractmethod
+    async def remove_driver(self, tg_id: int) -> int: ...
+
+    @abstractmethod
+    async def is_driver(self, tg_id: int) -> bool: ...
+
+    @abstractmethod
+    async def page_drivers(
+        self, after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None, limit: int = 20
+    ) -> Page:
+        """Drivers newest first, by keyset on (added_at, tg_id)."""
+
+    # Orders
+    @abstractmethod
+    async def create_order(
+        self,
+        passenger_tg_id: int,
+        pickup: str,
+        destination: str,
+        pickup_lat: Optional[float] = None,
+        pickup_lon: Optional[float] = None,
+    ) -> int: ...
+
+    @abstractmethod
+    async def get_order(self, order_id: int) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def list_new_orders(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Open orders, oldest first."""
+
+    @abstractmethod
+    async def get_new_orders(self, order_ids: List[int]) -> List[Dict[str, Any]]:
+        """The orders among ``order_ids`` that are still open."""
+
+    @abstractmethod
+    async def list_open_order_locations(self) -> List[Tuple[int, float, float]]: ...
+
+    @abstractmethod
+    async def page_orders(
+        self,
+        status: Optional[str] = None,
+        driver_tg_id: Optional[int] = None,
+        passenger_tg_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10,
+    ) -> Page:
+        """Orders newest first, by keyset on id."""
+
+    @abstractmethod
+    async def driver_accept_order(self, order_id: int, driver_tg_id: int) -> bool:
+        """Take a ``new`` order; False if it is no longer new."""
+
+    @abstractmethod
+    async def driver_mark_arrived(self, order_id: int, driver_tg_id: int) -> bool: ...
+
+    @abstractmethod
+    async def driver_complete_order(self, order_id: int, driver_tg_id: int) -> bool: ...
+
+    @abstractmethod
+    async def expire_order(self, order_id: int, ttl: float) -> Optional[Dict[str, Any]]:
+        """Expire a ``new`` order untouched for ``ttl`` seconds; returns it, or None if it moved on."""
+
+    @abstractmethod
+    async def release_order(self, order_id: int, driver_tg_id: int) -> Optional[Dict[str, Any]]:
+        """Reopen an order ``driver_tg_id`` accepted; returns it, or None if it moved on."""
+
+    @abstractmethod
+    async def list_pending_orders(self) -> List[Dict[str, Any]]:
+        """id, status, driver_tg_id, updated_at and accepted_at of the new and accepted orders."""
+
+    @abstractmethod
+    async def get_driver_active_order(self, driver_tg_id: int) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def get_passenger_active_order(self, passenger_tg_id: int) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def order_stats(self) -> Dict[str, int]:
+        """Order count in total and per non-empty status."""
+
+    @abstractmethod
+    async def order_activity(self, hours: int = 24) -> Dict[str, Any]: ...
+
+
+class SQLiteRepository(Repository):
+    """The tables in the bot's database, through app.db and its caches."""
+
+    async def upsert_user(self, tg_id: int, full_name: str) -> None:
+        await db.upsert_user(tg_id, full_name)
+
+    async def get_user(self, tg_id: int) -> Optional[Dict[str, Any]]:
+        return await db.get_user(tg_id)
+
+    async def set_user_phone(self, tg_id: int, phone: str) -> None:
+        await db.set_user_phone(tg_id, phone)
+
+    async def add_driver(self, tg_id: int, full_name: str) -> bool:
+        return await db.add_driver(tg_id, full_name)
+
+    async def add_drivers(self, rows: List[Tuple[int, str]]) -> List[int]:
+        return await db.add_drivers(rows)
+
+    async def remove_driver(self, tg_id: int) -> int:
+        return await db.remove_driver(tg_id)
+
+    async def is_driver(self, tg_id: int) -> bool:
+        return await db.is_driver(tg_id)
+
+    async def page_drivers(
+        self, after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None, limit: int = 20
+    ) -> Page:
+        return await db.page_drivers(after=after, before=before, limit=limit)
+
+    async def create_order(
+        self,
+        passenger_tg_id: int,
+        pickup: str,
+        destination: str,
+        pickup_lat: Optional[float] = None,
+        pickup_lon: Optional[float] = None,
+    ) -> int:
+        return await db.create_order(passenger_tg_id, pickup, destination, pickup_lat, pickup_lon)
+
+    async def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        return await db.get_order(order_id)
+
+    async def list_new_orders(self, limit: int = 10) -> List[Dict[str, Any]]:
+        return await db.list_new_orders(limit)
+
+    async def get_new_orders(self, order_ids: List[int]) -> List[Dict[str, Any]]:
+        return await db.get_new_orders(order_ids)
+
+    async def list_open_order_locations(self) -> List[Tuple[int, float, float]]:
+        return await db.list_open_order_locations()
+
+    async def page_orders(
+        self,
+        status: Optional[str] = None,
+        driver_tg_id: Optional[int] = None,
+        passenger_tg_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 10,
+    ) -> Page:
+        return await db.page_orders(status, driver_tg_id, passenger_tg_id, after_id, before_id, limit)
+
+    async def driver_accept_order(self, order_id: int, driver_tg_id: int) -> bool:
+        return await db.driver_accept_order(order_id, driver_tg_id)
+
+    async def driver_mark_arrived(self, order_id: int, driver_tg_id: int) -> bool:
+        return await db.driver_mark_arrived(order_id, driver_tg_id)
+
+    async def driver_complete_order(self, order_id: int, driver_tg_id: int) -> bool:
+        return await db.driver_complete_order(order_id, driver_tg_id)
+
+    async def expire_order(self, order_id: int, ttl: float) -> Optional[Dict[str, Any]]:
+        return await db.expire_order(order_id, ttl)
+
+    async def release_order(self, order_id: int, driver_tg_id: int) -> Optional[Dict[str, Any]]:
+        return await db.release_order(order_id, driver_tg_id)
+
+    async def list_pending_orders(self) -> List[Dict[str, Any]]:
+        return await db.list_pending_orders()
+
+    async def get_driver_active_order(self, driver_tg_id: int) -> Optional[Dict[str, Any]]:
+        return await db.get_driver_active_order(driver_tg_id)
+
+    async def get_passenger_active_order(self, passenger_tg_id: int) -> Optional[Dict[str, Any]]:
+        return await db.get_passenger_active_order(passenger_tg_id)
+
+    async def order_stats(self) -> Dict[str, int]:
+        return await db.order_stats()
+
+    async def order_activity(self, hours: int = 24) -> Dict[str, Any]:
+        return await db.order_activity(hours)
+
+
+# The repository the bot runs on; the functions below forward to it, so
+# modules import them once and follow use_repository().
+_REPOSITORY: Repository = SQLiteRepository()
+
+
+def use_repository(repository: Repository) -> None:
+    global _REPOSITORY
+    _REPOSITORY = repository
+
+
+def get_repository() -> Repository:
+    return _REPOSITORY
+
+
+async def upsert_user(tg_id: int, full_name: str) -> None:
+    await _REPOSITORY.upsert_user(tg_id, full_name)
+
+
+async def get_user(tg_id: int) -> Optional[Dict[str, Any]]:
+    return await _REPOSITORY.get_user(tg_id)
+
+
+async def set_user_phone(tg_id: int, phone: str) -> None:
+    await _REPOSITORY.set_user_phone(tg_id, phone)
+
+
+async def add_driver(tg_id: int, full_name: str) -> bool:
+    return await _REPOSITORY.add_driver(tg_id, full_name)
+
+
+async def add_drivers(rows: List[Tuple[int, str]]) -> List[int]:
+    return await _REPOSITORY.add_drivers(rows)
+
+
+async def remove_driver(tg_id: int) -> int:
+    return await _REPOSITORY.remove_driver(tg_id)
+
+
+async def is_driver(tg_id: int) -> bool:
+    return await _REPOSITORY.is_driver(tg_id)
+
+
+async def page_drivers(
+    after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None, limit: int = 20
+) -> Page:
+    return await _REPOSITORY.page_drivers(after=after, before=before, limit=limit)
+
+
+async def create_order(
+    passenger_tg_id: int,
+    pickup: str,
+    destination: str,
+    pickup_lat: Optional[float] = None,
+    pickup_lon: Optional[float] = None,
+) -> int:
+    return await _REPOSITORY.create_order(passenger_tg_id, pickup, destination, pickup_lat, pickup_lon)
+
+
+async def get_order(order_id: int) -> Optional[Dict[str, Any]]:
+    return await _REPOSITORY.get_order(order_id)
+
+
+async def list_new_orders(limit: int = 10) -> List[Dict[str, Any]]:
+    return await _REPOSITORY.list_new_orders(limit)
+
+
+async def get_new_orders(order_ids: List[int]) -> List[Dict[str, Any]]:
+    return await _REPOSITORY.get_new_orders(order_ids)
+
+
+async def list_open_order_locations() -> List[Tuple[int, float, float]]:
+    return await _REPOSITORY.list_open_order_locations()
+
+
+async def page_orders(
+    status: Optional[str] = None,
+    driver_tg_id: Optional[int] = None,
+    passenger_tg_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = 10,
+) -> Page:
+    return await _REPOSITORY.page_orders(status, driver_tg_id, passenger_tg_id, after_id, before_id, limit)
+
+
+async def driver_accept_order(order_id: int, driver_tg_id: int) -> bool:
+    return await _REPOSITORY.driver_accept_order(order_id, driver_tg_id)
+
+
+async def driver_mark_arrived(order_id: int, driver_tg_id: int) -> bool:
+    return await _REPOSITORY.driver_mark_arrived(order_id, driver_tg_id)
+
+
+async def driver_complete_order(order_id: int, driver_tg_id: int) -> bool:
+    return await _REPOSITORY.driver_complete_order(order_id, driver_tg_id)
+
+
+async def expire_order(order_id: int, ttl: float) -> Optional[Dict[str, Any]]:
+    return await _REPOSITORY.expire_order(order_id, ttl)
+
+
+async def release_order(order_id: int, driver_tg_id: int) -> Optional[Dict[str, Any]]:
+    return await _REPOSITORY.release_order(order_id, driver_tg_id)
+
+
+async def list_pending_orders() -> List[Dict[str, Any]]:
+    return await _REPOSITORY.list_pending_orders()
+
+
+async def get_driver_active_order(driver_tg_id: int) -> Optional[Dict[str, Any]]:
+    return await _REPOSITORY.get_driver_active_order(driver_tg_id)
+
+
+async def get_passenger_active_order(passenger_tg_id: int) -> Optional[Dict[str, Any]]:
+    return await _REPOSITORY.get_passenger_active_order(passenger_tg_id)
+
+
+async def order_stats() -> Dict[str, int]:
+    return await _REPOSITORY.order_stats()
+
+
+async def order_activity(hours: int = 24) -> Dict[str, Any]:
+    return await _REPOSITORY.order_activity(hours)
@@ -1,35 +1,76 @@
 from __future__ import annotations
 
-from aiogram import Router, F
+import os
+import tempfile
+from datetime import date, timedelta
+from html import escape
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot, Router, F
+from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, FSInputFile, InlineKeyboardMarkup
+
+from app import config
+from app.bulk import export_orders, import_drivers, write_errors
+from app.repository import add_driver, remove_driver, page_drivers, page_orders, order_stats, order_activity
+from app.keyboards import admin_menu_kb, admin_page_kb
+from app.outbox import deliver
+from app.presence import is_online, online_count
+from app.profiler import PROFILER
+from app.render import order_line, order_list
 
-from app.config import settings
-from app.db import add_driver, remove_driver, list_drivers, order_stats
-from app.keyboards import admin_menu_kb
+DRIVERS_PER_PAGE = 20
+ORDERS_PER_PAGE = 10
+ORDER_STATUSES = ("new", "accepted", "arrived", "completed", "expired")
+# Bot API bots can download files up to 20 MB
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+ERRORS_IN_MESSAGE = 20
+# Functions shown by /dbprofile, slowest in total first; keeps the table within one message
+DBPROFILE_ROWS = 25
 
 
 class AdminForm(StatesGroup):
     add_driver_wait_id = State()
     remove_driver_wait_id = State()
+    import_drivers_wait_file = State()
+    export_orders_wait_range = State()
 
 
 router = Router(name="admin")
 
 
 def _is_admin(user_id: int) -> bool:
-    return bool(settings and (user_id in settings.admin_ids))
+    return bool(config.settings and (user_id in config.settings.admin_ids))
+
+
+def _clip(text: str, limit: int = 40) -> str:
+    # Keeps a full page well under Telegram's 4096 characters
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def _format_duration(secs: float | None) -> str:
+    if secs is None:
+        return "—"
+    minutes, seconds = divmod(int(secs), 60)
+    return f"{minutes} мин {seconds} с" if minutes else f"{seconds} с"
+
+
+@router.message(StateFilter(AdminForm), F.text == "/cancel")
+async def admin_cancel(message: Message, state: FSMContext) -> None:
+    await state.clear()
+    deliver(message.answer("Отменено.", reply_markup=admin_menu_kb()))
 
 
 @router.callback_query(F.data == "adm:add_driver")
 async def admin_add_driver(cb: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(cb.from_user.id):
-        await cb.answer("Нет доступа", show_alert=True)
+        deliver(cb.answer("Нет доступа", show_alert=True))
         return
     await state.set_state(AdminForm.add_driver_wait_id)
-    await cb.message.edit_text("Отправьте tg_id водителя (число). Либо /cancel.")
-    await cb.answer()
+    deliver(cb.message.edit_text("Отправьте tg_id водителя (число). Либо /cancel."))
+    deliver(cb.answer())
 
 
 @router.message(AdminForm.add_driver_wait_id)
@@ -38,35 +79,294 @@ async def admin_add_driver_input(message: Message, state: FSMContext) -> None:
         return
     text = message.text.strip()
     if not text.isdigit():
-        await message.answer("Нужно число tg_id. Попробуйте снова или /cancel")
+        deliver(message.answer("Нужно число tg_id. Попробуйте снова или /cancel"))
         return
     tg_id = int(text)
     ok = await add_driver(tg_id, f"driver_{tg_id}")
     if ok:
-        await message.answer("Водитель добавлен.", reply_markup=admin_menu_kb())
+        deliver(message.answer("Водитель добавлен.", reply_markup=admin_menu_kb()))
         await state.clear()
     else:
-        await message.answer("Не удалось добавить (возможно уже существует). Попробуйте другой tg_id.")
+        deliver(message.answer("Не удалось добавить (возможно уже существует). Попробуйте другой tg_id."))
+
+
+async def _send_file(message: Message, path: str, filename: str, caption: str) -> None:
+    try:
+        await deliver(message.answer_document(FSInputFile(path, filename=filename), caption=caption))
+    finally:
+        os.unlink(path)
+
+
+def _temp_path(suffix: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+
+@router.callback_query(F.data == "adm:import_drivers")
+async def admin_import_drivers(cb: CallbackQuery, state: FSMContext) -> None:
+    if not _is_admin(cb.from_user.id):
+        deliver(cb.answer("Нет доступа", show_alert=True))
+        return
+    await state.set_state(AdminForm.import_drivers_wait_file)
+    deliver(cb.message.edit_text(
+        "Отправьте CSV-файл: по строке на водителя, tg_id и имя через запятую "
+        "(имя можно не указывать). Либо /cancel."
+    ))
+    deliver(cb.answer())
+
+
+@router.message(AdminForm.import_drivers_wait_file, F.document)
+async def admin_import_drivers_file(message: Message, state: FSMContext, bot: Bot) -> None:
+    if not _is_admin(message.from_user.id):
+        return
+    document = message.document
+    if document.file_size and document.file_size > MAX_UPLOAD_BYTES:
+        deliver(message.answer("Файл больше 20 МБ. Разбейте его на части или /cancel"))
+        return
+    path = _temp_path(".csv")
+    try:
+        await bot.download(document, destination=path)
+        report = await import_drivers(path)
+    finally:
+        os.unlink(path)
+    await state.clear()
+    text = (
+        f"Импорт завершен: добавлено {report.added}, уже были зарегистрированы {report.existing}, "
+        f"строк с замечаниями {len(report.errors)}."
+    )
+    if report.errors:
+        text += "\n" + "\n".join(
+            f"строка {line}: {escape(error, quote=False)}" for line, error in report.errors[:ERRORS_IN_MESSAGE]
+        )
+    deliver(message.answer(text, reply_markup=admin_menu_kb()))
+    if len(report.errors) > ERRORS_IN_MESSAGE:
+        path = _temp_path(".csv")
+        write_errors(path, report)
+        await _send_file(message, path, "import_errors.csv", "Все замечания по строкам")
+
+
+@router.message(AdminForm.import_drivers_wait_file)
+async def admin_import_drivers_not_file(message: Message) -> None:
+    deliver(message.answer("Нужен CSV-файл документом. Либо /cancel"))
+
+
+def _parse_range(args: list[str]) -> Optional[Tuple[date, date]]:
+    """``FROM [TO]`` as ISO dates, both inclusive; one date means that day."""
+    if not 1 <= len(args) <= 2:
+        return None
+    try:
+        since = date.fromisoformat(args[0])
+        until = date.fromisoformat(args[-1])
+    except ValueError:
+        return None
+    return (since, until) if since <= until else None
+
+
+async def _export(message: Message, since: date, until: date) -> None:
+    path = _temp_path(".csv")
+    try:
+        # created_at is stored in UTC as "YYYY-MM-DD HH:MM:SS"
+        count = await export_orders(path, f"{since} 00:00:00", f"{until + timedelta(days=1)} 00:00:00")
+    except Exception:
+        os.unlink(path)
+        raise
+    await _send_file(message, path, f"orders_{since}_{until}.csv", f"Заказы за {since} — {until} (UTC): {count}")
+
+
+@router.callback_query(F.data == "adm:export_orders")
+async def admin_export_orders(cb: CallbackQuery, state: FSMContext) -> None:
+    if not _is_admin(cb.from_user.id):
+        deliver(cb.answer("Нет доступа", show_alert=True))
+        return
+    await state.set_state(AdminForm.export_orders_wait_range)
+    deliver(cb.message.edit_text(
+        "Отправьте период по дате создания (UTC), например: 2024-05-01 2024-05-31. Либо /cancel."
+    ))
+    deliver(cb.answer())
+
+
+@router.message(AdminForm.export_orders_wait_range)
+async def admin_export_orders_input(message: Message, state: FSMContext) -> None:
+    if not _is_admin(message.from_user.id):
+        return
+    period = _parse_range((message.text or "").split())
+    if period is None:
+        deliver(message.answer("Нужны даты ГГГГ-ММ-ДД: начало и конец периода. Попробуйте снова или /cancel"))
+        return
+    await state.clear()
+    await _export(message, *period)
+
+
+@router.message(F.text.startswith("/export"))
+async def admin_export_command(message: Message) -> None:
+    """/export FROM [TO]"""
+    if not _is_admin(message.from_user.id):
+        return
+    period = _parse_range(message.text.split()[1:])
+    if period is None:
+        deliver(message.answer("Использование: /export ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]"))
+        return
+    await _export(message, *period)
+
+
+@router.callback_query(F.data == "adm:menu")
+async def admin_menu(cb: CallbackQuery) -> None:
+    if not _is_admin(cb.from_user.id):
+        deliver(cb.answer("Нет доступа", show_alert=True))
+        return
+    deliver(cb.message.edit_text("Режим администратора.", reply_markup=admin_menu_kb()))
+    deliver(cb.answer())
+
+
+def _driver_cursor(driver: Dict[str, Any]) -> str:
+    return f"{driver['tg_id']}:{driver['added_at']}"
+
+
+async def _drivers_page(
+    after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None
+) -> Tuple[str, InlineKeyboardMarkup]:
+    drivers, has_prev, has_next = await page_drivers(after=after, before=before, limit=DRIVERS_PER_PAGE)
+    if not drivers:
+        if after is not None or before is not None:
+            # The page emptied since it was shown; start over
+            return await _drivers_page()
+        return "Список водителей пуст.", admin_menu_kb()
+    lines = [
+        f"{'🟢' if is_online(d['tg_id']) else '⚪️'} {d['tg_id']} — {escape(_clip(d['full_name'] or ''), quote=False)} "
+        f"(добавлен: {d['added_at']})"
+        for d in drivers
+    ]
+    markup = admin_page_kb(
+        f"adm:drivers:p:{_driver_cursor(drivers[0])}" if has_prev else None,
+        f"adm:drivers:n:{_driver_cursor(drivers[-1])}" if has_next else None,
+    )
+    return f"Водители (на линии: {online_count()}):\n" + "\n".join(lines), markup
 
 
 @router.callback_query(F.data == "adm:list_drivers")
 async def admin_list_drivers(cb: CallbackQuery) -> None:
     if not _is_admin(cb.from_user.id):
-        await cb.answer("Нет доступа", show_alert=True)
+        deliver(cb.answer("Нет доступа", show_alert=True))
         return
-    drivers = await list_drivers()
-    if not drivers:
-        await cb.message.edit_text("Список водителей пуст.", reply_markup=admin_menu_kb())
+    text, markup = await _drivers_page()
+    deliver(cb.message.edit_text(text, reply_markup=markup))
+    deliver(cb.answer())
+
+
+@router.callback_query(F.data.startswith("adm:drivers:"))
+async def admin_drivers_page(cb: CallbackQuery) -> None:
+    if not _is_admin(cb.from_user.id):
+        deliver(cb.answer("Нет доступа", show_alert=True))
+        return
+    # adm:drivers:<n|p>:<tg_id>:<added_at>; added_at has colons of its own
+    _, _, direction, tg_id, added_at = cb.data.split(":", 4)
+    key = (added_at, int(tg_id))
+    if direction == "n":
+        text, markup = await _drivers_page(after=key)
     else:
-        lines = [f"{d['tg_id']} — {d['full_name']} (добавлен: {d['added_at']})" for d in drivers]
-        await cb.message.edit_text("Зарегистрированные водители:\n" + "\n".join(lines), reply_markup=admin_menu_kb())
-    await cb.answer()
+        text, markup = await _drivers_page(before=key)
+    deliver(cb.message.edit_text(text, reply_markup=markup))
+    deliver(cb.answer())
+
+
+def _order_filter(token: str) -> Tuple[str, Dict[str, Any]]:
+    """Title and page_orders() filter for a filter token: all, a status, d<driver id>, p<passenger id>."""
+    if token in ORDER_STATUSES:
+        return f"Заказы ({token})", {"status": token}
+    if token[:1] == "d" and token[1:].isdigit():
+        return f"Заказы водителя {token[1:]}", {"driver_tg_id": int(token[1:])}
+    if token[:1] == "p" and token[1:].isdigit():
+        return f"Заказы пассажира {token[1:]}", {"passenger_tg_id": int(token[1:])}
+    return "Заказы", {}
+
+
+async def _orders_page(
+    token: str, after_id: Optional[int] = None, before_id: Optional[int] = None
+) -> Tuple[str, InlineKeyboardMarkup]:
+    title, filters = _order_filter(token)
+    orders, has_prev, has_next = await page_orders(
+        **filters, after_id=after_id, before_id=before_id, limit=ORDERS_PER_PAGE
+    )
+    if not orders and (after_id is not None or before_id is not None):
+        return await _orders_page(token)
+    lines = []
+    for o in orders:
+        line = f"{order_line(o['id'], _clip(o['pickup']), _clip(o['destination']))} — {o['status']}"
+        if o["driver_tg_id"] is not None:
+            line += f", водитель {o['driver_tg_id']}"
+        lines.append(line)
+    markup = admin_page_kb(
+        f"adm:orders:{token}:p:{orders[0]['id']}" if has_prev else None,
+        f"adm:orders:{token}:n:{orders[-1]['id']}" if has_next else None,
+        order_filters=True,
+    )
+    return order_list(title + ":", lines), markup
+
+
+@router.callback_query(F.data.startswith("adm:orders:"))
+async def admin_orders_page(cb: CallbackQuery) -> None:
+    if not _is_admin(cb.from_user.id):
+        deliver(cb.answer("Нет доступа", show_alert=True))
+        return
+    # adm:orders:<filter>[:<n|p>:<order id>]
+    parts = cb.data.split(":")
+    token = parts[2]
+    if len(parts) == 5 and parts[4].isdigit() and parts[3] == "n":
+        text, markup = await _orders_page(token, after_id=int(parts[4]))
+    elif len(parts) == 5 and parts[4].isdigit():
+        text, markup = await _orders_page(token, before_id=int(parts[4]))
+    else:
+        text, markup = await _orders_page(token)
+    deliver(cb.message.edit_text(text, reply_markup=markup))
+    deliver(cb.answer())
+
+
+@router.message(F.text.startswith("/orders"))
+async def admin_orders_command(message: Message) -> None:
+    """/orders [new|accepted|arrived|completed|expired|driver <id>|passenger <id>]"""
+    if not _is_admin(message.from_user.id):
+        return
+    args = message.text.split()[1:]
+    token = "all"
+    if len(args) == 1 and args[0] in ORDER_STATUSES:
+        token = args[0]
+    elif len(args) == 2 and args[0] in ("driver", "passenger") and args[1].isdigit():
+        token = args[0][0] + args[1]
+    elif args:
+        deliver(message.answer(
+            "Использование: /orders [new|accepted|arrived|completed|expired|driver ID|passenger ID]"
+        ))
+        return
+    text, markup = await _orders_page(token)
+    deliver(message.answer(text, reply_markup=markup))
+
+
+@router.message(F.text.startswith("/dbprofile"))
+async def admin_dbprofile_command(message: Message) -> None:
+    """/dbprofile [on|off|reset]"""
+    if not _is_admin(message.from_user.id):
+        return
+    args = message.text.split()[1:]
+    if args == ["on"]:
+        PROFILER.enabled = True
+    elif args == ["off"]:
+        PROFILER.enabled = False
+    elif args == ["reset"]:
+        PROFILER.reset()
+    elif args:
+        deliver(message.answer("Использование: /dbprofile [on|off|reset]"))
+        return
+    state = "включено" if PROFILER.enabled else "выключено"
+    deliver(message.answer(
+        f"Профилирование запросов {state}.\n<pre>{escape(PROFILER.report(DBPROFILE_ROWS), quote=False)}</pre>"
+    ))
 
 
 @router.callback_query(F.data == "adm:stats")
 async def admin_show_stats(cb: CallbackQuery) -> None:
     if not _is_admin(cb.from_user.id):
-        await cb.answer("Нет доступа", show_alert=True)
+        deliver(cb.answer("Нет доступа", show_alert=True))
         return
     stats = await order_stats()
     parts = [f"Всего заказов: {stats.get('total', 0)}"]
@@ -74,5 +374,13 @@ async def admin_show_stats(cb: CallbackQuery) -> None:
         if k == "total":
             continue
         parts.append(f"{k}: {v}")
-    await cb.message.edit_text("Статистика:\n" + "\n".join(parts), reply_markup=admin_menu_kb())
-    await cb.answer()
\ No newline at end of file
+    for title, hours in (("За час", 1), ("За 24 часа", 24), ("За 7 дней", 24 * 7)):
+        activity = await order_activity(hours)
+        parts.append(
+            f"\n{title}: создано {activity['created']}, принято {activity['accepted']}, "
+            f"завершено {activity['completed']}, истекло {activity['expired']}"
+        )
+        parts.append(f"Ожидание водителя: {_format_duration(activity['avg_wait_secs'])}")
+        parts.append(f"Поездка: {_format_duration(activity['avg_ride_secs'])}")
+    deliver(cb.message.edit_text("Статистика:\n" + "\n".join(parts), reply_markup=admin_menu_kb()))
+    deliver(cb.answer())
\ No newline at end of file
@@ -3,9 +3,11 @@ from __future__ import annotations
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 
-from app.db import upsert_user, get_user
+from app.repository import upsert_user, get_user
 from app.keyboards import role_choice_kb, passenger_menu_kb, driver_menu_kb, admin_menu_kb
-from app.config import settings
+from app.outbox import deliver
+from app import config
+from app.presence import is_online
 
 router = Router(name="common")
 
@@ -14,28 +16,29 @@ router = Router(name="common")
 async def cmd_start(message: Message) -> None:
     await upsert_user(message.from_user.id, message.from_user.full_name)
     user = await get_user(message.from_user.id)
-    await message.answer(
+    deliver(message.answer(
         "Привет! Выберите роль:", reply_markup=role_choice_kb()
-    )
+    ))
 
 
 @router.callback_query(F.data.startswith("role:"))
 async def on_role_choice(cb: CallbackQuery) -> None:
     role = cb.data.split(":", 1)[1]
     if role == "passenger":
-        await cb.message.edit_text(
+        deliver(cb.message.edit_text(
             "Режим пассажира.", reply_markup=passenger_menu_kb(has_active=False)
-        )
+        ))
     elif role == "driver":
         # Show driver menu regardless of registration, real access checks in driver router
-        await cb.message.edit_text(
-            "Режим водителя.", reply_markup=driver_menu_kb(has_active=False)
-        )
+        deliver(cb.message.edit_text(
+            "Режим водителя.", reply_markup=driver_menu_kb(has_active=False, on_shift=is_online(cb.from_user.id))
+        ))
     elif role == "admin":
-        if cb.from_user.id in (settings.admin_ids if settings else []):
-            await cb.message.edit_text(
+        if cb.from_user.id in (config.settings.admin_ids if config.settings else []):
+            deliver(cb.message.edit_text(
                 "Режим администратора.", reply_markup=admin_menu_kb()
-            )
+            ))
         else:
-            await cb.answer("Нет доступа", show_alert=True)
-    await cb.answer()
\ No newline at end of file
+            deliver(cb.answer("Нет доступа", show_alert=True))
+            return
+    deliver(cb.answer())
\ No newline at end of file
@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 from aiogram import Router, F
-from aiogram.types import CallbackQuery
+from aiogram.types import CallbackQuery, Message
 
-from app.db import (
+from app.repository import (
     is_driver,
     list_new_orders,
     driver_accept_order,
@@ -11,86 +11,166 @@ from app.db import (
     driver_mark_arrived,
     driver_complete_order,
 )
+from app.dispatch import retract_order
+from app.expiry import cancel_timer, schedule_release
+from app.feed import wake_feed
+from app.geo import nearest_open_orders, unindex_order
+from app.presence import get_driver_location, go_offline, go_online, is_online, set_driver_location
 from app.keyboards import list_orders_kb, driver_actions_kb, driver_menu_kb
+from app.outbox import deliver
+from app.render import order_line, order_list, order_status, route
 
 router = Router(name="driver")
 
 
+async def _open_orders_for(driver_tg_id: int, limit: int = 10) -> list:
+    """Nearest open orders when the driver has shared a location, topped up with the oldest ones."""
+    location = get_driver_location(driver_tg_id)
+    orders = await nearest_open_orders(*location, limit=limit) if location else []
+    if len(orders) < limit:
+        seen = {o["id"] for o in orders}
+        orders += [o for o in await list_new_orders(limit=limit) if o["id"] not in seen][: limit - len(orders)]
+    return orders
+
+
+def _format_open_order(order: dict) -> str:
+    line = order_line(order["id"], order["pickup"], order["destination"])
+    if "distance_km" in order:
+        line += f" ({order['distance_km']:.1f} км)"
+    return line
+
+
 @router.callback_query(F.data == "drv:new")
 async def driver_list_new(cb: CallbackQuery) -> None:
     if not await is_driver(cb.from_user.id):
-        await cb.answer("Вы не зарегистрированы водителем", show_alert=True)
+        deliver(cb.answer("Вы не зарегистрированы водителем", show_alert=True))
         return
-    orders = await list_new_orders(limit=10)
-    await cb.message.edit_text(
-        "Свободные заказы:" + ("\n" + "\n".join([f"#{o['id']}: {o['pickup']} → {o['destination']}" for o in orders]) if orders else "\nНет заказов"),
+    orders = await _open_orders_for(cb.from_user.id)
+    hint = "" if get_driver_location(cb.from_user.id) else "\n\nОтправьте геопозицию, чтобы видеть ближайшие заказы."
+    deliver(cb.message.edit_text(
+        order_list("Свободные заказы:", [_format_open_order(o) for o in orders]) + hint,
         reply_markup=list_orders_kb([o["id"] for o in orders]),
-    )
-    await cb.answer()
+    ))
+    deliver(cb.answer())
+
+
+@router.callback_query(F.data == "drv:shift")
+async def driver_toggle_shift(cb: CallbackQuery) -> None:
+    if not await is_driver(cb.from_user.id):
+        deliver(cb.answer("Вы не зарегистрированы водителем", show_alert=True))
+        return
+    if is_online(cb.from_user.id):
+        await go_offline(cb.from_user.id)
+        text = "Вы ушли с линии. Новые заказы не будут приходить."
+    else:
+        await go_online(cb.from_user.id)
+        text = "Вы на линии. Новые заказы будут приходить сюда; поделитесь геопозицией, чтобы видеть ближайшие."
+    active = await get_driver_active_order(cb.from_user.id)
+    deliver(cb.message.edit_text(
+        text, reply_markup=driver_menu_kb(has_active=active is not None, on_shift=is_online(cb.from_user.id))
+    ))
+    deliver(cb.answer())
+
+
+@router.message(F.location)
+async def driver_location(message: Message) -> None:
+    if not await is_driver(message.from_user.id):
+        return
+    # Sharing a location (live or static) puts the driver on shift
+    await go_online(message.from_user.id)
+    set_driver_location(message.from_user.id, message.location.latitude, message.location.longitude)
+    orders = await _open_orders_for(message.from_user.id)
+    deliver(message.answer(
+        order_list("Вы на линии. Ближайшие заказы:", [_format_open_order(o) for o in orders]),
+        reply_markup=list_orders_kb([o["id"] for o in orders]),
+    ))
+
+
+@router.edited_message(F.location)
+async def driver_live_location(message: Message) -> None:
+    # Live location updates arrive as edits of the original location message
+    if is_online(message.from_user.id):
+        set_driver_location(message.from_user.id, message.location.latitude, message.location.longitude)
 
 
 @router.callback_query(F.data.startswith("drv:take:"))
 async def driver_take_order(cb: CallbackQuery) -> None:
     if not await is_driver(cb.from_user.id):
-        await cb.answer("Вы не зарегистрированы водителем", show_alert=True)
+        deliver(cb.answer("Вы не зарегистрированы водителем", show_alert=True))
         return
     order_id = int(cb.data.rsplit(":", 1)[1])
     ok = await driver_accept_order(order_id, cb.from_user.id)
     if ok:
+        unindex_order(order_id)
+        retract_order(order_id, cb.from_user.id, keep=(cb.message.chat.id, cb.message.message_id))
+        schedule_release(order_id, cb.from_user.id)
+        wake_feed()
         order = await get_driver_active_order(cb.from_user.id)
-        await cb.message.edit_text(
-            f"Заказ принят #{order_id}. Едем: {order['pickup']} → {order['destination']}",
+        deliver(cb.message.edit_text(
+            f"Заказ принят #{order_id}. Едем: {route(order['pickup'], order['destination'])}",
             reply_markup=driver_actions_kb(order_id, order["status"] if order else "accepted"),
-        )
+        ))
     else:
-        await cb.answer("Не удалось принять заказ. Возможно, его уже взяли.", show_alert=True)
-    await cb.answer()
+        deliver(cb.answer("Не удалось принять заказ. Возможно, его уже взяли.", show_alert=True))
+        return
+    deliver(cb.answer())
 
 
 @router.callback_query(F.data == "drv:my")
 async def driver_my(cb: CallbackQuery) -> None:
     if not await is_driver(cb.from_user.id):
-        await cb.answer("Вы не зарегистрированы водителем", show_alert=True)
+        deliver(cb.answer("Вы не зарегистрированы водителем", show_alert=True))
         return
     order = await get_driver_active_order(cb.from_user.id)
     if not order:
-        await cb.message.edit_text("У вас нет активного заказа.", reply_markup=driver_menu_kb(has_active=False))
+        deliver(cb.message.edit_text(
+            "У вас нет активного заказа.",
+            reply_markup=driver_menu_kb(has_active=False, on_shift=is_online(cb.from_user.id)),
+        ))
     else:
-        await cb.message.edit_text(
-            f"Текущий заказ #{order['id']}: {order['pickup']} → {order['destination']} (статус: {order['status']})",
+        deliver(cb.message.edit_text(
+            order_status("Текущий заказ", order),
             reply_markup=driver_actions_kb(order["id"], order["status"]),
-        )
-    await cb.answer()
+        ))
+    deliver(cb.answer())
 
 
 @router.callback_query(F.data.startswith("drv:arrived:"))
 async def driver_arrived(cb: CallbackQuery) -> None:
     if not await is_driver(cb.from_user.id):
-        await cb.answer("Вы не зарегистрированы водителем", show_alert=True)
+        deliver(cb.answer("Вы не зарегистрированы водителем", show_alert=True))
         return
     order_id = int(cb.data.rsplit(":", 1)[1])
     ok = await driver_mark_arrived(order_id, cb.from_user.id)
     if not ok:
-        await cb.answer("Не удалось отметить \"на месте\".", show_alert=True)
+        deliver(cb.answer("Не удалось отметить \"на месте\".", show_alert=True))
         return
+    cancel_timer(order_id)
+    wake_feed()
     order = await get_driver_active_order(cb.from_user.id)
     if order:
-        await cb.message.edit_text(
-            f"Текущий заказ #{order['id']}: {order['pickup']} → {order['destination']} (статус: {order['status']})",
+        deliver(cb.message.edit_text(
+            order_status("Текущий заказ", order),
             reply_markup=driver_actions_kb(order["id"], order["status"]),
-        )
-    await cb.answer()
+        ))
+    deliver(cb.answer())
 
 
 @router.callback_query(F.data.startswith("drv:complete:"))
 async def driver_complete(cb: CallbackQuery) -> None:
     if not await is_driver(cb.from_user.id):
-        await cb.answer("Вы не зарегистрированы водителем", show_alert=True)
+        deliver(cb.answer("Вы не зарегистрированы водителем", show_alert=True))
         return
     order_id = int(cb.data.rsplit(":", 1)[1])
     ok = await driver_complete_order(order_id, cb.from_user.id)
     if ok:
-        await cb.message.edit_text("Заказ завершен. Спасибо за поездку!", reply_markup=driver_menu_kb(has_active=False))
+        cancel_timer(order_id)
+        wake_feed()
+        deliver(cb.message.edit_text(
+            "Заказ завершен. Спасибо за поездку!",
+            reply_markup=driver_menu_kb(has_active=False, on_shift=is_online(cb.from_user.id)),
+        ))
     else:
-        await cb.answer("Не удалось завершить заказ.", show_alert=True)
-    await cb.answer()
\ No newline at end of file
+        deliver(cb.answer("Не удалось завершить заказ.", show_alert=True))
+        return
+    deliver(cb.answer())
\ No newline at end of file
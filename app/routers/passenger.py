@@ -5,8 +5,13 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove
 
-from app.db import get_user, set_user_phone, create_order, get_passenger_active_order
-from app.keyboards import request_phone_kb, passenger_menu_kb
+from app.dispatch import announce_order
+from app.repository import get_user, set_user_phone, create_order, get_passenger_active_order
+from app.expiry import schedule_expiry
+from app.geo import index_order
+from app.keyboards import request_location_kb, request_phone_kb, passenger_menu_kb
+from app.outbox import deliver
+from app.render import order_status, route
 
 
 class PassengerForm(StatesGroup):
@@ -21,64 +26,80 @@ router = Router(name="passenger")
 async def passenger_order_entry(cb: CallbackQuery, state: FSMContext) -> None:
     user = await get_user(cb.from_user.id)
     if not user or not user.get("phone"):
-        await cb.message.answer(
+        deliver(cb.message.answer(
             "Отправьте номер телефона для регистрации.",
             reply_markup=request_phone_kb(),
-        )
-        await cb.answer()
+        ))
+        deliver(cb.answer())
         return
 
     active = await get_passenger_active_order(cb.from_user.id)
     if active:
-        await cb.message.answer(
-            f"У вас уже есть активный заказ #{active['id']}: {active['pickup']} → {active['destination']} (статус: {active['status']})",
+        deliver(cb.message.answer(
+            order_status("У вас уже есть активный заказ", active),
             reply_markup=passenger_menu_kb(has_active=True),
-        )
-        await cb.answer()
+        ))
+        deliver(cb.answer())
         return
 
     await state.clear()
     await state.set_state(PassengerForm.waiting_pickup)
-    await cb.message.answer("Где вас забрать? Укажите адрес отправления.")
-    await cb.answer()
+    deliver(cb.message.answer(
+        "Где вас забрать? Укажите адрес отправления или отправьте геопозицию.",
+        reply_markup=request_location_kb(),
+    ))
+    deliver(cb.answer())
 
 
 @router.message(F.contact)
 async def on_contact(message: Message) -> None:
     phone = message.contact.phone_number
     await set_user_phone(message.from_user.id, phone)
-    await message.answer("Телефон сохранен. Теперь можно оформить заказ.", reply_markup=ReplyKeyboardRemove())
-    await message.answer("Нажмите: 'Вызвать такси'", reply_markup=passenger_menu_kb(has_active=False))
+    deliver(message.answer("Телефон сохранен. Теперь можно оформить заказ.", reply_markup=ReplyKeyboardRemove()))
+    deliver(message.answer("Нажмите: 'Вызвать такси'", reply_markup=passenger_menu_kb(has_active=False)))
 
 
-@router.message(PassengerForm.waiting_pickup)
+@router.message(PassengerForm.waiting_pickup, F.location)
+async def on_pickup_location(message: Message, state: FSMContext) -> None:
+    lat, lon = message.location.latitude, message.location.longitude
+    await state.update_data(pickup=f"📍 {lat:.5f}, {lon:.5f}", pickup_lat=lat, pickup_lon=lon)
+    await state.set_state(PassengerForm.waiting_destination)
+    deliver(message.answer("Куда поедем? Укажите адрес назначения.", reply_markup=ReplyKeyboardRemove()))
+
+
+@router.message(PassengerForm.waiting_pickup, F.text)
 async def on_pickup(message: Message, state: FSMContext) -> None:
     await state.update_data(pickup=message.text.strip())
     await state.set_state(PassengerForm.waiting_destination)
-    await message.answer("Куда поедем? Укажите адрес назначения.")
+    deliver(message.answer("Куда поедем? Укажите адрес назначения.", reply_markup=ReplyKeyboardRemove()))
 
 
-@router.message(PassengerForm.waiting_destination)
+@router.message(PassengerForm.waiting_destination, F.text)
 async def on_destination(message: Message, state: FSMContext) -> None:
     data = await state.get_data()
     pickup = data.get("pickup", "")
     destination = message.text.strip()
-    order_id = await create_order(message.from_user.id, pickup, destination)
+    lat, lon = data.get("pickup_lat"), data.get("pickup_lon")
+    order_id = await create_order(message.from_user.id, pickup, destination, lat, lon)
     await state.clear()
-    await message.answer(
-        f"Заказ создан #{order_id}: {pickup} → {destination}. Ожидайте подтверждения водителя.",
+    if lat is not None and lon is not None:
+        index_order(order_id, lat, lon)
+    schedule_expiry(order_id)
+    announce_order(order_id, pickup, destination)
+    deliver(message.answer(
+        f"Заказ создан #{order_id}: {route(pickup, destination)}. Ожидайте подтверждения водителя.",
         reply_markup=passenger_menu_kb(has_active=True),
-    )
+    ))
 
 
 @router.callback_query(F.data == "pass:my")
 async def passenger_my_order(cb: CallbackQuery) -> None:
     active = await get_passenger_active_order(cb.from_user.id)
     if not active:
-        await cb.message.edit_text("Активных заказов нет.", reply_markup=passenger_menu_kb(has_active=False))
+        deliver(cb.message.edit_text("Активных заказов нет.", reply_markup=passenger_menu_kb(has_active=False)))
     else:
-        await cb.message.edit_text(
-            f"Мой заказ #{active['id']}: {active['pickup']} → {active['destination']} (статус: {active['status']})",
+        deliver(cb.message.edit_text(
+            order_status("Мой заказ", active),
             reply_markup=passenger_menu_kb(has_active=True),
-        )
-    await cb.answer()
\ No newline at end of file
+        ))
+    deliver(cb.answer())
\ No newline at end of file
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, List, Set, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from app.metrics import REGISTRY, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+UPDATE_QUEUE_DEPTH: Gauge = REGISTRY.register(
+    Gauge("bot_update_queue_depth", "Updates accepted but not started, behind their user's earlier updates or a slot")
+)
+UPDATE_QUEUE_USERS: Gauge = REGISTRY.register(
+    Gauge("bot_update_queue_users", "Users with updates queued or running")
+)
+UPDATE_QUEUE_MAX_USER_DEPTH: Gauge = REGISTRY.register(
+    Gauge("bot_update_queue_max_user_depth", "Updates queued or running for the busiest user")
+)
+UPDATE_QUEUE_WAIT: Histogram = REGISTRY.register(
+    Histogram("bot_update_queue_wait_seconds", "Time from accepting an update to starting its handlers")
+)
+
+
+def update_key(update: Update) -> Hashable:
+    """Updates with the same key run one after another: the sender, else the chat."""
+    try:
+        event = update.event
+    except Exception:
+        # An update type this aiogram does not know; nothing to order it against
+        return ("update", update.update_id)
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return ("update", update.update_id)
+
+
+class UpdateScheduler:
+    """Runs updates through the dispatcher in order per user, at most ``concurrency`` at once.
+
+    Every user with pending updates has a FIFO lane drained by one worker
+    task, so a user's second tap (drv:arrived right after drv:take, say)
+    starts only once the first has finished, while different users run in
+    parallel. A worker takes one of ``concurrency`` slots per update, which
+    bounds the handlers (and pooled connections) in use however many users
+    are busy; waiting for a turn or a slot holds nothing.
+
+    At most ``backlog`` updates are queued or running: :meth:`offer` refuses
+    beyond that (the webhook answers 503), :meth:`put` waits for room (the
+    poller stops fetching). An update stays in its lane until its handlers
+    finish, so :meth:`stop` can hand the updates that never started back to
+    the caller to carry over. Handlers still running at the deadline are
+    cancelled and their updates dropped, not carried over: what they wrote
+    may already be committed, and running them again would repeat it.
+    """
+
+    def __init__(
+        self, bot: Bot, dp: Dispatcher, concurrency: int = 32, backlog: int = 1000, **workflow_data: Any
+    ) -> None:
+        self._bot = bot
+        self._dp = dp
+        self._workflow_data = workflow_data
+        self.concurrency = concurrency
+        self.backlog = backlog
+        self._slots = asyncio.Semaphore(concurrency)
+        # key -> [(update, accepted at)], the head is running or next to run
+        self._lanes: Dict[Hashable, Deque[Tuple[Update, float]]] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+        # Keys whose lane head has entered the dispatcher
+        self._started: Set[Hashable] = set()
+        self._room = asyncio.Event()
+        self._room.set()
+        self.accepting = False
+        self.pending = 0
+        self.running = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.abandoned = 0
+
+    @property
+    def queued(self) -> int:
+        return self.pending - self.running
+
+    @property
+    def users(self) -> int:
+        return len(self._lanes)
+
+    @property
+    def max_user_depth(self) -> int:
+        return max((len(lane) for lane in self._lanes.values()), default=0)
+
+    def start(self) -> None:
+        self.accepting = True
+        UPDATE_QUEUE_DEPTH.set_function(lambda: self.queued)
+        UPDATE_QUEUE_USERS.set_function(lambda: self.users)
+        UPDATE_QUEUE_MAX_USER_DEPTH.set_function(lambda: self.max_user_depth)
+
+    def offer(self, update: Update) -> bool:
+        """Queue ``update`` without waiting; False when stopping or the backlog is full."""
+        if not self.accepting or self.pending >= self.backlog:
+            self.rejected += 1
+            return False
+        key = update_key(update)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+        lane.append((update, time.monotonic()))
+        self.pending += 1
+        if self.pending >= self.backlog:
+            self._room.clear()
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key, lane))
+        return True
+
+    async def put(self, update: Update) -> bool:
+        """Queue ``update`` once the backlog has room; False when stopping."""
+        while self.accepting and self.pending >= self.backlog:
+            await self._room.wait()
+        return self.offer(update)
+
+    async def _drain(self, key: Hashable, lane: Deque[Tuple[Update, float]]) -> None:
+        try:
+            while lane:
+                update, accepted = lane[0]
+                async with self._slots:
+                    UPDATE_QUEUE_WAIT.observe(time.monotonic() - accepted)
+                    self.running += 1
+                    self._started.add(key)
+                    try:
+                        await self._dp.feed_update(self._bot, update, **self._workflow_data)
+                        self.processed += 1
+                    except Exception:
+                        self.failed += 1
+                        logger.exception("Failed to process update %d", update.update_id)
+                    finally:
+                        self.running -= 1
+                        self._started.discard(key)
+                lane.popleft()
+                self.pending -= 1
+                self._room.set()
+        finally:
+            # Only left early when cancelled by stop(), which has taken the rest already
+            self.pending -= len(lane)
+            del self._lanes[key]
+            del self._workers[key]
+
+    async def stop(self, timeout: float = 8.0) -> List[Update]:
+        """Stop accepting, let the lanes drain for ``timeout`` seconds; returns the updates that never started."""
+        self.accepting = False
+        # Wake put() callers so they see the scheduler stopping
+        self._room.set()
+        if self._workers:
+            await asyncio.wait(list(self._workers.values()), timeout=timeout)
+        leftovers: List[Update] = []
+        for key, lane in self._lanes.items():
+            updates = [update for update, _ in lane]
+            if key in self._started:
+                update = updates.pop(0)
+                self.abandoned += 1
+                logger.warning("Update %d was still being handled at shutdown and is dropped", update.update_id)
+            leftovers.extend(updates)
+        leftovers.sort(key=lambda update: update.update_id)
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        return leftovers
@@ -0,0 +1,381 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Set
+
+from fastapi import FastAPI, WebSocket
+from fastapi.responses import FileResponse, PlainTextResponse
+from starlette.websockets import WebSocketState
+
+from app.metrics import REGISTRY, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Pages served next to the endpoint; video_chat.html connects to /ws on its own host
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Server -> client control frames understood by video_chat.html
+WAIT = json.dumps({"type": "wait"})
+INIT = json.dumps({"type": "init"})
+LEAVE = json.dumps({"type": "leave"})
+
+SIGNALING_CONNECTIONS: Gauge = REGISTRY.register(Gauge("signaling_connections", "Open signaling WebSockets"))
+SIGNALING_WAITING: Gauge = REGISTRY.register(Gauge("signaling_waiting", "Clients waiting for a partner"))
+SIGNALING_PAIRS: Gauge = REGISTRY.register(Gauge("signaling_pairs", "Paired clients"))
+SIGNALING_FRAMES: Counter = REGISTRY.register(
+    Counter("signaling_frames_total", "Frames relayed between partners", ["type"])
+)
+SIGNALING_DROPPED: Counter = REGISTRY.register(
+    Counter("signaling_dropped_total", "Frames or clients dropped by the signaling server", ["reason"])
+)
+
+
+class Peer:
+    """One connected client and its bounded outgoing buffer.
+
+    ``send`` only queues; a flush task exists while there is something to
+    write, so an idle connection costs its receive loop and nothing else.
+    A peer whose buffer holds more than ``max_buffer`` bytes is too slow and
+    ``send`` refuses further frames.
+    """
+
+    __slots__ = (
+        "id", "ws", "partner", "last_partner", "closed",
+        "_max_buffer", "_buffer", "_buffered", "_flusher", "_waiters", "_candidates", "_candidate_timer",
+    )
+
+    def __init__(self, peer_id: int, ws: WebSocket, max_buffer: int) -> None:
+        self.id = peer_id
+        self.ws = ws
+        self.partner: Optional[Peer] = None
+        self.last_partner: Optional[int] = None
+        self.closed = False
+        self._max_buffer = max_buffer
+        self._buffer: Deque[str] = deque()
+        self._buffered = 0
+        self._flusher: Optional[asyncio.Task] = None
+        self._waiters: Optional[List[asyncio.Future]] = None
+        # Trickle ICE candidates from this peer waiting to be relayed as one batch
+        self._candidates: Optional[List[str]] = None
+        self._candidate_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def congested(self) -> bool:
+        return self._buffered > self._max_buffer // 2
+
+    def send(self, frame: str) -> bool:
+        if self.closed:
+            return False
+        if self._buffered + len(frame) > self._max_buffer:
+            return False
+        self._buffer.append(frame)
+        self._buffered += len(frame)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush())
+        return True
+
+    def send_many(self, frames: List[str]) -> bool:
+        return all(self.send(frame) for frame in frames)
+
+    async def _flush(self) -> None:
+        try:
+            while self._buffer:
+                frame = self._buffer[0]
+                await self.ws.send_text(frame)
+                self._buffer.popleft()
+                self._buffered -= len(frame)
+                if self._waiters and not self.congested:
+                    self._wake_writers()
+        except Exception:
+            # The socket is gone; the receive loop notices and cleans up
+            self.closed = True
+            self._buffer.clear()
+            self._buffered = 0
+        finally:
+            self._flusher = None
+            self._wake_writers()
+
+    def _wake_writers(self) -> None:
+        waiters, self._waiters = self._waiters, None
+        for waiter in waiters or ():
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_writable(self, timeout: float) -> bool:
+        """Wait until the buffer is at most half full; False if that took longer than ``timeout``."""
+        if not self.congested or self.closed:
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        if self._waiters is None:
+            self._waiters = []
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class SignalingHub:
+    """Matchmaking and relay for the chat-roulette pages.
+
+    A new client is paired with the longest-waiting one (O(1) from an
+    OrderedDict), gets ``init`` and sends the WebRTC offer; the waiting side
+    got ``wait`` when it queued. Every other frame goes to the partner as is,
+    which also carries the plain-text chat of index.html. When a client
+    leaves or sends ``{"type": "next"}`` its partner gets ``leave`` and goes
+    back to matchmaking.
+
+    Trickle ICE candidates are held for ``ice_batch_window`` seconds and
+    relayed together, so a burst of candidates costs the partner one flush
+    instead of one wake-up each. While the partner's buffer is over half full
+    the sender's frames are not read (TCP pushes back on the sender); a
+    partner that does not drain within ``send_timeout`` or overflows its
+    buffer is disconnected.
+    """
+
+    def __init__(
+        self,
+        max_buffer: int = 256 * 1024,
+        max_frame: int = 64 * 1024,
+        send_timeout: float = 10.0,
+        ice_batch_window: float = 0.02,
+    ) -> None:
+        self.max_buffer = max_buffer
+        self.max_frame = max_frame
+        self.send_timeout = send_timeout
+        self.ice_batch_window = ice_batch_window
+        self._ids = itertools.count(1)
+        self._waiting: OrderedDict[int, Peer] = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self.connections = 0
+        self.paired = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def _take_waiting(self, avoid: Optional[int]) -> Optional[Peer]:
+        # Skip the partner the client just left, but look no further than one entry
+        peers = iter(self._waiting.values())
+        other = next(peers, None)
+        if other is not None and other.id == avoid:
+            other = next(peers, None)
+        if other is not None:
+            del self._waiting[other.id]
+        return other
+
+    def _match(self, peer: Peer) -> None:
+        other = self._take_waiting(peer.last_partner)
+        if other is None:
+            self._waiting[peer.id] = peer
+            self._deliver(peer, WAIT)
+            return
+        peer.partner, other.partner = other, peer
+        self.paired += 2
+        self._deliver(peer, INIT)
+
+    def _unpair(self, peer: Peer) -> Optional[Peer]:
+        partner = peer.partner
+        if partner is None:
+            return None
+        peer.partner = partner.partner = None
+        peer.last_partner, partner.last_partner = partner.id, peer.id
+        self.paired -= 2
+        self._drop_candidates(peer)
+        self._drop_candidates(partner)
+        return partner
+
+    def _release(self, peer: Peer) -> None:
+        # Unpair ``peer`` (already requeued or leaving) and send its partner back to matchmaking
+        partner = self._unpair(peer)
+        if partner is not None and not partner.closed:
+            self._deliver(partner, LEAVE)
+            if not partner.closed:
+                self._match(partner)
+
+    def connect(self, ws: WebSocket) -> Peer:
+        peer = Peer(next(self._ids), ws, self.max_buffer)
+        self.connections += 1
+        self._match(peer)
+        return peer
+
+    def disconnect(self, peer: Peer) -> None:
+        if peer.closed and peer.partner is None and peer.id not in self._waiting:
+            return
+        peer.closed = True
+        self._waiting.pop(peer.id, None)
+        self._release(peer)
+
+    def next_partner(self, peer: Peer) -> None:
+        self._waiting.pop(peer.id, None)
+        self._release(peer)
+        self._match(peer)
+
+    def _deliver(self, peer: Peer, frame: str) -> None:
+        if not peer.send(frame) and not peer.closed:
+            self._drop_slow(peer)
+
+    def _drop_slow(self, peer: Peer) -> None:
+        SIGNALING_DROPPED.inc("slow_client")
+        logger.info("Disconnecting slow signaling client %s", peer.id)
+        self.disconnect(peer)
+        self._spawn(self._close(peer.ws, 1013))
+
+    async def _close(self, ws: WebSocket, code: int) -> None:
+        if ws.application_state != WebSocketState.DISCONNECTED:
+            try:
+                await ws.close(code)
+            except Exception:
+                pass
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _queue_candidate(self, peer: Peer, frame: str) -> None:
+        if peer._candidates is None:
+            peer._candidates = []
+        peer._candidates.append(frame)
+        if peer._candidate_timer is None:
+            peer._candidate_timer = asyncio.get_running_loop().call_later(
+                self.ice_batch_window, self._flush_candidates, peer
+            )
+
+    def _flush_candidates(self, peer: Peer) -> None:
+        if peer._candidate_timer is not None:
+            peer._candidate_timer.cancel()
+            peer._candidate_timer = None
+        frames, peer._candidates = peer._candidates, None
+        partner = peer.partner
+        if frames and partner is not None:
+            if not partner.send_many(frames) and not partner.closed:
+                self._drop_slow(partner)
+
+    def _drop_candidates(self, peer: Peer) -> None:
+        if peer._candidate_timer is not None:
+            peer._candidate_timer.cancel()
+            peer._candidate_timer = None
+        peer._candidates = None
+
+    def relay(self, peer: Peer, frame: str) -> None:
+        kind = "text"
+        if frame.startswith("{"):
+            try:
+                kind = str(json.loads(frame).get("type", "other"))
+            except (ValueError, AttributeError):
+                kind = "other"
+        if kind == "next":
+            self.next_partner(peer)
+            return
+        partner = peer.partner
+        if partner is None:
+            SIGNALING_DROPPED.inc("unpaired")
+            return
+        if kind == "candidate":
+            SIGNALING_FRAMES.inc("candidate")
+            if self.ice_batch_window > 0:
+                self._queue_candidate(peer, frame)
+                return
+        else:
+            SIGNALING_FRAMES.inc(kind if kind in ("offer", "answer", "text") else "other")
+            # Candidates gathered so far must not be overtaken
+            self._flush_candidates(peer)
+        self._deliver(partner, frame)
+
+    async def serve(self, ws: WebSocket) -> None:
+        await ws.accept()
+        peer = self.connect(ws)
+        try:
+            while not peer.closed:
+                partner = peer.partner
+                if partner is not None and partner.congested:
+                    if not await partner.wait_writable(self.send_timeout) and not partner.closed:
+                        self._drop_slow(partner)
+                message = await ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                frame = message.get("text")
+                if frame is None:
+                    continue
+                if len(frame) > self.max_frame:
+                    SIGNALING_DROPPED.inc("too_large")
+                    continue
+                self.relay(peer, frame)
+        finally:
+            self.connections -= 1
+            self._drop_candidates(peer)
+            self.disconnect(peer)
+
+
+def create_signaling_app(hub: Optional[SignalingHub] = None) -> FastAPI:
+    """WebSocket signaling at /ws, the video chat at /, the text chat at /chat."""
+    hub = hub or SignalingHub()
+    SIGNALING_CONNECTIONS.set_function(lambda: hub.connections)
+    SIGNALING_WAITING.set_function(lambda: hub.waiting)
+    SIGNALING_PAIRS.set_function(lambda: hub.paired // 2)
+
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+    app.state.hub = hub
+
+    @app.websocket("/ws")
+    async def ws_endpoint(ws: WebSocket) -> None:
+        await hub.serve(ws)
+
+    @app.get("/")
+    async def video_chat() -> FileResponse:
+        return FileResponse(os.path.join(_ROOT, "video_chat.html"))
+
+    @app.get("/chat")
+    async def text_chat() -> FileResponse:
+        return FileResponse(os.path.join(_ROOT, "index.html"))
+
+    @app.get("/metrics")
+    async def metrics() -> PlainTextResponse:
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+def _raise_fd_limit() -> None:
+    # Every socket is a file descriptor; the default soft limit is often 1024
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.signaling --port 8000
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="WebSocket signaling server for the chat-roulette pages")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--backlog", type=int, default=4096)
+    # The sans-I/O protocol runs no tasks of its own per connection
+    parser.add_argument("--ws", default="websockets-sansio", help="uvicorn WebSocket implementation")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    _raise_fd_limit()
+    uvicorn.run(
+        create_signaling_app(),
+        host=args.host,
+        port=args.port,
+        backlog=args.backlog,
+        ws=args.ws,
+        ws_ping_interval=30.0,
+        ws_ping_timeout=30.0,
+        # One log line per connection is too much at this scale
+        log_level="warning",
+    )
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import sqlite3
+from datetime import datetime
+from typing import Any, Mapping, Optional
+
+# Order statistics are maintained incrementally by the write ops in app.db,
+# inside the same transaction as the order change they describe:
+#   order_counters  one row per status with the number of orders in it
+#   order_rollups   one row per UTC hour ('YYYY-MM-DD HH') with created/accepted/
+#                   completed/expired counts and summed new->accepted / accepted->completed
+#                   durations, so averages over any window are sum/count
+
+_HOUR = "strftime('%Y-%m-%d %H', 'now')"
+
+
+def seconds_between(start: Optional[str], end: Optional[str]) -> Optional[float]:
+    if not start or not end:
+        return None
+    return (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds()
+
+
+def bump_status(conn: sqlite3.Connection, status: str, delta: int) -> None:
+    conn.execute(
+        """
+        INSERT INTO order_counters (status, cnt) VALUES (?, ?)
+        ON CONFLICT(status) DO UPDATE SET cnt = cnt + excluded.cnt
+        """,
+        (status, delta),
+    )
+
+
+def _bump_rollup(conn: sqlite3.Connection, column: str, secs_column: Optional[str] = None, secs: Optional[float] = None) -> None:
+    if secs_column and secs is not None:
+        conn.execute(
+            f"""
+            INSERT INTO order_rollups (bucket, {column}, {secs_column}_secs, {secs_column}_n)
+            VALUES ({_HOUR}, 1, ?, 1)
+            ON CONFLICT(bucket) DO UPDATE SET
+                {column} = {column} + 1,
+                {secs_column}_secs = {secs_column}_secs + excluded.{secs_column}_secs,
+                {secs_column}_n = {secs_column}_n + 1
+            """,
+            (secs,),
+        )
+    else:
+        conn.execute(
+            f"""
+            INSERT INTO order_rollups (bucket, {column}) VALUES ({_HOUR}, 1)
+            ON CONFLICT(bucket) DO UPDATE SET {column} = {column} + 1
+            """
+        )
+
+
+def record_created(conn: sqlite3.Connection) -> None:
+    bump_status(conn, "new", 1)
+    _bump_rollup(conn, "created")
+
+
+def record_transition(conn: sqlite3.Connection, old_status: str, order: Mapping[str, Any]) -> None:
+    """Account for ``order`` (the row after the update) having left ``old_status``."""
+    new_status = order["status"]
+    if old_status == new_status:
+        return
+    bump_status(conn, old_status, -1)
+    bump_status(conn, new_status, 1)
+    if new_status == "accepted":
+        _bump_rollup(conn, "accepted", "wait", seconds_between(order["created_at"], order["accepted_at"]))
+    elif new_status == "completed":
+        _bump_rollup(conn, "completed", "ride", seconds_between(order["accepted_at"], order["completed_at"]))
+    elif new_status == "expired":
+        _bump_rollup(conn, "expired")
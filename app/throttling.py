@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from app.metrics import REGISTRY, Counter
+from app.outbox import deliver
+
+logger = logging.getLogger(__name__)
+
+UPDATES_SUPPRESSED: Counter = REGISTRY.register(
+    Counter("bot_updates_suppressed_total", "Updates dropped before reaching a handler", ["reason"])
+)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Outer message/callback middleware that drops repeated taps and flooding users.
+
+    * A callback with the same data from the same user within ``dedup_window``
+      seconds is a double tap and is dropped.
+    * Every user has a token bucket of ``burst`` tokens refilled at ``rate``
+      per second; an update arriving with the bucket empty is dropped.
+
+    Suppressed callbacks are only answered through the outbox (so the client
+    stops its spinner), suppressed messages are ignored: neither touches the
+    database or the FSM storage. Both tables are LRU-bounded by ``max_users``. ``rate`` 0 or
+    ``dedup_window`` 0 switches the corresponding check off.
+    """
+
+    def __init__(
+        self, rate: float = 2.0, burst: int = 5, dedup_window: float = 1.0, max_users: int = 10000
+    ) -> None:
+        self.rate = rate
+        self.burst = float(burst)
+        self.dedup_window = dedup_window
+        self.max_users = max_users
+        # user id -> [tokens, last refill]
+        self._buckets: OrderedDict[int, List[float]] = OrderedDict()
+        # (user id, callback data) -> time of the last accepted tap
+        self._recent: OrderedDict[Tuple[int, str], float] = OrderedDict()
+
+    def _allow(self, user_id: int, now: float) -> bool:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [self.burst, now]
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1.0:
+            return False
+        bucket[0] -= 1.0
+        return True
+
+    def _duplicate(self, user_id: int, data: str, now: float) -> bool:
+        key = (user_id, data)
+        seen = self._recent.get(key)
+        if seen is not None and now - seen < self.dedup_window:
+            return True
+        self._recent[key] = now
+        self._recent.move_to_end(key)
+        # Entries are in tap order, so anything at the front older than the window can go
+        while self._recent:
+            oldest_key, oldest = next(iter(self._recent.items()))
+            if now - oldest < self.dedup_window and len(self._recent) <= self.max_users:
+                break
+            del self._recent[oldest_key]
+        return False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return await handler(event, data)
+        now = time.monotonic()
+        reason = None
+        if isinstance(event, CallbackQuery) and self.dedup_window > 0 and event.data is not None:
+            if self._duplicate(user.id, event.data, now):
+                reason = "duplicate"
+        if reason is None and self.rate > 0 and not self._allow(user.id, now):
+            reason = "throttled"
+        if reason is None:
+            return await handler(event, data)
+
+        UPDATES_SUPPRESSED.inc(reason)
+        if isinstance(event, CallbackQuery):
+            # Handed to the outbox rather than awaited, so a flood does not hold scheduler slots
+            if reason == "throttled":
+                deliver(event.answer("Слишком часто. Подождите немного."))
+            else:
+                deliver(event.answer())
+        elif isinstance(event, Message):
+            logger.debug("Dropped message from user %s: %s", user.id, reason)
+        return None
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+
+from app.db import save_pending_updates
+from app.lifecycle import replay_pending
+from app.scheduler import UpdateScheduler
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def _validate(bot: Bot, data: Dict[str, Any]) -> Update:
+    return Update.model_validate(data, context={"bot": bot})
+
+
+def create_app(
+    bot: Bot,
+    dp: Dispatcher,
+    path: str = "/webhook",
+    secret: Optional[str] = None,
+    queue_size: int = 1000,
+    concurrency: int = 32,
+    drain_timeout: float = 8.0,
+    on_startup: Optional[Callable[[], Awaitable[None]]] = None,
+) -> FastAPI:
+    """Serve ``dp`` over HTTP: POST updates to ``path``, GET /healthz for liveness.
+
+    Updates are acknowledged as soon as they are queued on the
+    UpdateScheduler, which runs each user's updates in order. When
+    ``queue_size`` updates are pending the endpoint answers 503 so Telegram
+    (or any other client) backs off and redelivers later instead of piling up
+    unbounded handler tasks. On shutdown the scheduler is drained for
+    ``drain_timeout`` seconds; updates that never started are stored and
+    replayed by the next worker to start, those still running are dropped.
+    """
+    updates = UpdateScheduler(bot, dp, concurrency=concurrency, backlog=queue_size)
+
+    async def replay(data: Dict[str, Any]) -> None:
+        await updates.put(_validate(bot, data))
+
+    @asynccontextmanager
+    async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+        if on_startup is not None:
+            await on_startup()
+        await dp.emit_startup(bot=bot, **dp.workflow_data)
+        updates.start()
+        replaying = asyncio.create_task(replay_pending(replay, recheck_after=drain_timeout + 1.0))
+        try:
+            yield
+        finally:
+            replaying.cancel()
+            await asyncio.gather(replaying, return_exceptions=True)
+            leftovers = await updates.stop(timeout=drain_timeout)
+            if leftovers:
+                await save_pending_updates(
+                    [(u.update_id, u.model_dump_json(by_alias=True, exclude_unset=True)) for u in leftovers]
+                )
+                logger.warning("Carried %d updates that never started over to the next process", len(leftovers))
+            await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+            await bot.session.close()
+
+    app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+    app.state.updates = updates
+
+    @app.post(path)
+    async def webhook(request: Request) -> Response:
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return Response(status_code=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            # Empty, malformed or not a JSON object: not an update from Telegram
+            return Response(status_code=400)
+        try:
+            update = _validate(bot, data)
+        except ValidationError:
+            # Redelivering would not make it valid; acknowledge and move on
+            updates.failed += 1
+            logger.exception("Failed to parse update %s", data.get("update_id"))
+            return Response(status_code=200)
+        if not updates.offer(update):
+            return Response(status_code=503, headers={"Retry-After": "1"})
+        return Response(status_code=200)
+
+    @app.get("/healthz")
+    async def healthz() -> JSONResponse:
+        return JSONResponse(
+            {
+                "status": "ok" if updates.accepting else "stopping",
+                "pid": os.getpid(),
+                "queue_depth": updates.queued,
+                "queue_capacity": updates.backlog,
+                "running": updates.running,
+                "users": updates.users,
+                "processed": updates.processed,
+                "rejected": updates.rejected,
+                "failed": updates.failed,
+            }
+        )
+
+    return app
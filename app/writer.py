@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A write operation runs on the writer thread inside an open transaction and
+# returns its own result (rowcount check, lastrowid, RETURNING row, ...)
+WriteOp = Callable[[sqlite3.Connection], Any]
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    return conn
+
+
+def _apply(conn: sqlite3.Connection, ops: List[WriteOp]) -> List[Tuple[bool, Any]]:
+    """Run ``ops`` in one transaction; each op is isolated by a savepoint."""
+    results: List[Tuple[bool, Any]] = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for op in ops:
+            conn.execute("SAVEPOINT op")
+            try:
+                results.append((True, op(conn)))
+                conn.execute("RELEASE op")
+            except Exception as e:
+                conn.execute("ROLLBACK TO op")
+                conn.execute("RELEASE op")
+                results.append((False, e))
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    return results
+
+
+def run_once(path: str, op: WriteOp) -> Any:
+    """Apply a single op on a throwaway connection (used when no writer is running)."""
+    conn = _connect(path)
+    try:
+        ok, result = _apply(conn, [op])[0]
+    finally:
+        conn.close()
+    if not ok:
+        raise result
+    return result
+
+
+class GroupCommitWriter:
+    """Single writer that commits queued write operations in groups.
+
+    All ops run on one dedicated thread and connection. The writer takes the
+    first queued op, collects everything else queued within ``window``
+    seconds (up to ``max_batch``), and commits the group with one fsync.
+    While a group is being committed, new ops pile up for the next one, so
+    batches grow with load. A failing op rolls back only its own savepoint.
+    """
+
+    def __init__(self, path: str, window: float = 0.001, max_batch: int = 256) -> None:
+        self._path = path
+        self._window = window
+        self._max_batch = max_batch
+        self._queue: asyncio.Queue[Optional[Tuple[WriteOp, asyncio.Future]]] = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.batches = 0
+        self.ops = 0
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._conn = await loop.run_in_executor(self._executor, _connect, self._path)
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, op: WriteOp) -> Any:
+        if self._task is None or self._closing:
+            raise RuntimeError("Writer is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, future))
+        return await future
+
+    async def _collect(self, first: Tuple[WriteOp, asyncio.Future]) -> Tuple[List[Tuple[WriteOp, asyncio.Future]], bool]:
+        batch = [first]
+        stop = False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._window
+        while len(batch) < self._max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch, stop = await self._collect(first)
+            ops = [op for op, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, _apply, self._conn, ops)
+            except Exception as e:
+                logger.exception("Write batch of %d ops failed", len(ops))
+                results = [(False, e)] * len(ops)
+            self.batches += 1
+            self.ops += len(ops)
+            for (_, future), (ok, result) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+
+    async def close(self) -> None:
+        """Commit everything already queued, then stop the writer thread."""
+        self._closing = True
+        if self._task is not None:
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,77 @@
+"""Nearest open orders: in-memory grid index vs scanning the open orders in SQLite.
+
+    python bench/bench_geo.py --orders 5000 --queries 1000
+
+Pickups are spread uniformly over a 30 x 30 km city; each query asks for the
+10 orders nearest to a random point.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, geo  # noqa: E402
+
+CITY = (55.60, 37.40, 0.27, 0.45)  # south-west corner and size in degrees, about 30 x 30 km
+
+
+def _point(rng: random.Random) -> tuple:
+    lat, lon, dlat, dlon = CITY
+    return lat + rng.random() * dlat, lon + rng.random() * dlon
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_db_path(os.path.join(tmp, "bench.sqlite3"))
+        await db.init_db()
+        await db.open_pool()
+        await db.open_writer()
+        await db.upsert_user(1, "bench")
+        await asyncio.gather(
+            *(db.create_order(1, "a", "b", *_point(rng)) for _ in range(args.orders))
+        )
+        started = time.perf_counter()
+        loaded = await geo.load_open_orders()
+        print(f"index rebuilt from SQLite: {loaded} orders in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        points = [_point(rng) for _ in range(args.queries)]
+
+        started = time.perf_counter()
+        for lat, lon in points:
+            geo._ORDERS.nearest(lat, lon, k=10)
+        index_ms = (time.perf_counter() - started) * 1000 / args.queries
+
+        started = time.perf_counter()
+        for lat, lon in points:
+            await geo.nearest_open_orders(lat, lon, limit=10)
+        confirmed_ms = (time.perf_counter() - started) * 1000 / args.queries
+
+        started = time.perf_counter()
+        for lat, lon in points[: max(1, args.queries // 10)]:
+            rows = await db.list_open_order_locations()
+            sorted(rows, key=lambda r: geo.distance_km(lat, lon, r[1], r[2]))[:10]
+        scan_ms = (time.perf_counter() - started) * 1000 / max(1, args.queries // 10)
+
+        await db.close_writer()
+        await db.close_pool()
+
+    print(f"{'grid index':>28}: {index_ms:8.3f} ms/query")
+    print(f"{'grid index + DB check':>28}: {confirmed_ms:8.3f} ms/query")
+    print(f"{'SQLite scan + sort':>28}: {scan_ms:8.3f} ms/query")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""Keyboard rendering: building markups per call vs the cached/pre-serialized ones.
+
+    python bench/bench_render.py --rounds 20000
+
+Each round renders what a typical driver update sends: the driver menu, a
+list of 5 open orders and the order action buttons, each attached to a
+SendMessage and turned into the form fields the Bot API request carries.
+  rebuilt   the markups as app.keyboards built them before (validated
+            pydantic objects, dumped and JSON-encoded by AiohttpSession)
+  rendered  app.keyboards now, sent through app.render.RenderingSession
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+from app import keyboards  # noqa: E402
+from app.render import RenderingSession  # noqa: E402
+
+ORDER_IDS = [101, 102, 103, 104, 105]
+
+
+# The builders as they were before app.render
+def _driver_menu_kb(has_active: bool, on_shift: bool = False) -> InlineKeyboardMarkup:
+    buttons = [[InlineKeyboardButton(text="🆕 Свободные заказы", callback_data="drv:new")]]
+    if has_active:
+        buttons.append([InlineKeyboardButton(text="🚗 Мой заказ", callback_data="drv:my")])
+    if on_shift:
+        buttons.append([InlineKeyboardButton(text="⏸ Уйти с линии", callback_data="drv:shift")])
+    else:
+        buttons.append([InlineKeyboardButton(text="🟢 Выйти на линию", callback_data="drv:shift")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def _list_orders_kb(order_ids: List[int]) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton(text=f"Взять заказ #{oid}", callback_data=f"drv:take:{oid}")] for oid in order_ids
+    ]
+    if not keyboard:
+        keyboard = [[InlineKeyboardButton(text="Обновить", callback_data="drv:new")]]
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def _driver_actions_kb(order_id: int, status: str) -> InlineKeyboardMarkup:
+    buttons = []
+    if status == "accepted":
+        buttons.append([InlineKeyboardButton(text="🅿️ На месте", callback_data=f"drv:arrived:{order_id}")])
+    if status in {"accepted", "arrived"}:
+        buttons.append([InlineKeyboardButton(text="✅ Завершить", callback_data=f"drv:complete:{order_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def _round(session: AiohttpSession, bot: Bot, menu, orders, actions) -> None:
+    for markup in (menu(True, True), orders(ORDER_IDS), actions(ORDER_IDS[0], "accepted")):
+        session.build_form_data(bot, SendMessage(chat_id=1, text="Свободные заказы:", reply_markup=markup))
+
+
+def _measure(name: str, rounds: int, run: Callable[[], None]) -> None:
+    for _ in range(min(rounds, 200)):
+        run()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        run()
+    cpu_us = (time.perf_counter() - started) * 1e6 / rounds
+
+    # Peak memory above the baseline while one update is rendered
+    sample = max(1, rounds // 20)
+    tracemalloc.start()
+    total = 0
+    for _ in range(sample):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        run()
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    print(f"{name:>10}: {cpu_us:8.1f} us/update   {total / sample:8.0f} B peak allocation/update")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    bot = Bot("1:bench")
+    plain, rendering = AiohttpSession(), RenderingSession()
+    _measure("rebuilt", args.rounds, lambda: _round(plain, bot, _driver_menu_kb, _list_orders_kb, _driver_actions_kb))
+    _measure(
+        "rendered",
+        args.rounds,
+        lambda: _round(
+            rendering, bot, keyboards.driver_menu_kb, keyboards.list_orders_kb, keyboards.driver_actions_kb
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Repository engines side by side: SQLite (app.db) vs in-memory.
+
+    python bench/bench_repository.py --orders 2000 --concurrency 50
+
+Each engine starts empty and goes through the same phases:
+  create    passengers open --orders orders
+  browse    drivers list the open orders, look up a page of them and
+            check their own active order, as drv:new does
+  claim     every driver tries to take every listed order at once;
+            exactly one claim per order must win
+  finish    the winners mark arrival and complete
+  admin     the order browser pages through everything by status
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db  # noqa: E402
+from app.memory_repository import MemoryRepository  # noqa: E402
+from app.repository import Repository, SQLiteRepository  # noqa: E402
+
+
+async def _phase(name: str, concurrency: int, calls: List[Callable[[], Awaitable[object]]]) -> float:
+    queue = iter(calls)
+
+    async def worker() -> None:
+        for call in queue:
+            await call()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<8}{len(calls):>8} calls {elapsed * 1000:9.1f} ms {len(calls) / elapsed:10.0f} calls/s")
+    return elapsed
+
+
+async def workload(repo: Repository, orders: int, drivers: int, concurrency: int) -> float:
+    passengers = list(range(10_000, 10_000 + orders))
+    driver_ids = list(range(1_000, 1_000 + drivers))
+    for tg_id in passengers:
+        await repo.upsert_user(tg_id, f"user_{tg_id}")
+    await repo.add_drivers([(tg_id, f"driver_{tg_id}") for tg_id in driver_ids])
+
+    total = await _phase(
+        "create",
+        concurrency,
+        [lambda p=p: repo.create_order(p, "Ленина 1", "Вокзал", 55.75, 37.61) for p in passengers],
+    )
+
+    async def browse(driver: int) -> None:
+        await repo.is_driver(driver)
+        await repo.get_driver_active_order(driver)
+        listed = await repo.list_new_orders(limit=10)
+        await repo.get_new_orders([o["id"] for o in listed])
+
+    total += await _phase("browse", concurrency, [lambda d=d: browse(d) for d in driver_ids * 10])
+
+    won: Dict[int, int] = {}
+
+    async def claim(order_id: int, driver: int) -> None:
+        if await repo.driver_accept_order(order_id, driver):
+            assert order_id not in won, f"order {order_id} taken twice"
+            won[order_id] = driver
+
+    open_ids = [o["id"] for o in await repo.list_new_orders(limit=orders)]
+    total += await _phase(
+        "claim", concurrency, [lambda o=o, d=d: claim(o, d) for o in open_ids for d in driver_ids[:5]]
+    )
+    assert len(won) == len(open_ids), "an order was not taken"
+
+    async def finish(order_id: int, driver: int) -> None:
+        await repo.driver_mark_arrived(order_id, driver)
+        await repo.driver_complete_order(order_id, driver)
+
+    total += await _phase("finish", concurrency, [lambda o=o, d=d: finish(o, d) for o, d in won.items()])
+
+    async def browse_all(status: str) -> None:
+        rows, _, has_next = await repo.page_orders(status=status, limit=10)
+        while has_next:
+            rows, _, has_next = await repo.page_orders(status=status, after_id=rows[-1]["id"], limit=10)
+
+    total += await _phase("admin", 1, [lambda s=s: browse_all(s) for s in ("completed", "new", "accepted")])
+    stats = await repo.order_stats()
+    assert stats.get("completed") == orders, stats
+    return total
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--drivers", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_db_path(os.path.join(tmp, "bench.sqlite3"))
+        await db.open_pool()
+        await db.init_db()
+        await db.open_writer()
+        try:
+            print("sqlite")
+            results["sqlite"] = await workload(SQLiteRepository(), args.orders, args.drivers, args.concurrency)
+        finally:
+            await db.close_writer()
+            await db.close_pool()
+    print("memory")
+    results["memory"] = await workload(MemoryRepository(), args.orders, args.drivers, args.concurrency)
+    baseline = results["sqlite"]
+    for name, elapsed in results.items():
+        print(f"{name:>8}: {elapsed * 1000:9.1f} ms total  ({baseline / elapsed:6.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
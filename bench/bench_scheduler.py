@@ -0,0 +1,175 @@
+"""Bursts of updates: one task per update vs app.scheduler's per-user lanes.
+
+    python bench/bench_scheduler.py --passengers 300 --drivers 30 --concurrency 16
+
+Every user sends their whole flow at once, the way a client with a bad
+connection delivers queued taps: passengers /start -> contact -> pass:order
+-> pickup -> destination, then drivers drv:take -> drv:arrived ->
+drv:complete for each of their orders. The real Dispatcher runs against a
+temporary SQLite file and a stub Bot API (see load_test.py), once per mode,
+each in its own process:
+
+  tasks      every update is its own task, as polling did before app.scheduler
+  scheduler  UpdateScheduler with --concurrency slots
+
+Reported: how many flows went through (a step that overtakes the one before
+it fails or is dropped by the FSM), the most handlers running at once, and
+the time from submitting an update to its handlers finishing.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.types import TelegramObject, Update  # noqa: E402
+
+import main  # noqa: E402
+from app import presence, repository  # noqa: E402
+from app.config import Config  # noqa: E402
+from app.scheduler import UpdateScheduler  # noqa: E402
+from load_test import BOT_TOKEN, Harness, StubSession, _percentile  # noqa: E402
+
+
+class BurstHarness(Harness):
+    """Submits the updates of a flow without waiting for each to be handled."""
+
+    def __init__(self, bot: Bot, dp: Any, submit: Callable[[Update], None]) -> None:
+        super().__init__(bot, dp)
+        self.submit = submit
+        self.submitted: Dict[int, float] = {}
+
+    async def _feed(self, label: str, data: Dict[str, Any]) -> None:
+        update = Update.model_validate({"update_id": next(self._update_ids), **data}, context={"bot": self.bot})
+        self.submitted[update.update_id] = time.perf_counter()
+        self.submit(update)
+
+
+class Tracker:
+    """Outer update middleware: handlers running at once and when each update finished."""
+
+    def __init__(self) -> None:
+        self.running = 0
+        self.peak = 0
+        self.finished: Dict[int, float] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            return await handler(event, data)
+        finally:
+            self.running -= 1
+            self.finished[event.update_id] = time.perf_counter()
+
+
+async def run(mode: str, passengers: int, drivers: int, concurrency: int, api_latency: float, db_path: str) -> None:
+    config = Config(
+        bot_token=BOT_TOKEN,
+        admin_ids=[1],
+        db_path=db_path,
+        dispatch_rate=0.0,
+        throttle_rate=0.0,
+        callback_dedup_window=0.0,
+        outbox_rate=0.0,
+        outbox_chat_rate=0.0,
+        metrics_port=0,
+    )
+    session = StubSession(latency=api_latency)
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    dp = main.create_dispatcher(config)
+    tracker = Tracker()
+    dp.update.outer_middleware(tracker)
+    await main.setup_services(config, bot)
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+
+    tasks: List[asyncio.Task] = []
+    scheduler = UpdateScheduler(bot, dp, concurrency=concurrency, backlog=1_000_000)
+    scheduler.start()
+    if mode == "tasks":
+        def submit(update: Update) -> None:
+            tasks.append(asyncio.create_task(dp.feed_update(bot, update)))
+    else:
+        submit = scheduler.offer  # type: ignore[assignment]
+
+    async def settle() -> None:
+        while tasks or scheduler.pending:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            tasks.clear()
+            await asyncio.sleep(0.01)
+
+    passenger_ids = list(range(10_000, 10_000 + passengers))
+    driver_ids = list(range(1_000, 1_000 + drivers))
+    for driver_id in driver_ids:
+        await repository.add_driver(driver_id, f"driver_{driver_id}")
+        await presence.go_online(driver_id)
+
+    harness = BurstHarness(bot, dp, submit)
+    try:
+        started = time.perf_counter()
+        for uid in passenger_ids:
+            await harness.passenger(uid)
+        await settle()
+        new_orders = [o["id"] for o in await repository.list_new_orders(limit=passengers)]
+        for i, driver_id in enumerate(driver_ids):
+            await harness.driver(driver_id, new_orders[i::drivers])
+        await settle()
+        elapsed = time.perf_counter() - started
+        stats = await repository.order_stats()
+    finally:
+        await scheduler.stop(timeout=0)
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+
+    latencies = [tracker.finished[uid] - at for uid, at in harness.submitted.items() if uid in tracker.finished]
+    print(
+        f"{mode:<10} orders {len(new_orders):>5}/{passengers:<5} completed {stats.get('completed', 0):>5} "
+        f"peak handlers {tracker.peak:>5} {elapsed:7.2f}s "
+        f"p50 {_percentile(latencies, 50) * 1000:8.1f} ms p99 {_percentile(latencies, 99) * 1000:8.1f} ms"
+    )
+
+
+async def amain() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--passengers", type=int, default=300)
+    parser.add_argument("--drivers", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--api-latency-ms", type=float, default=5.0, help="simulated Bot API round trip")
+    parser.add_argument("--mode", choices=("tasks", "scheduler"), help="run only one of the two")
+    args = parser.parse_args()
+
+    if args.mode is None:
+        # The routers attach to one Dispatcher per process, so each mode gets its own
+        for mode in ("tasks", "scheduler"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--mode", mode], check=True)
+        return
+
+    logging.basicConfig(level=logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmp:
+        await run(
+            args.mode,
+            args.passengers,
+            args.drivers,
+            args.concurrency,
+            args.api_latency_ms / 1000,
+            os.path.join(tmp, "bench.sqlite3"),
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(amain())
@@ -0,0 +1,113 @@
+"""Write throughput: one commit per call vs the group-commit writer.
+
+    python bench/bench_writes.py --ops 5000 --concurrency 100
+
+Modes, each on a fresh temporary database:
+  connect-per-op  new connection + commit per write (app.db before pooling)
+  pool-per-op     pooled WAL connections, still one commit per write
+  group-commit    app.db with the single writer (create_order via _write)
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db  # noqa: E402
+from app.pool import ConnectionPool  # noqa: E402
+
+INSERT_ORDER = "INSERT INTO orders (passenger_tg_id, pickup, destination, status) VALUES (?, ?, ?, 'new')"
+
+
+async def _prepare(path: str) -> None:
+    db.set_db_path(path)
+    await db.init_db()
+    await db.upsert_user(1, "bench")
+
+
+async def _run(concurrency: int, ops: int, write) -> float:
+    per_task = ops // concurrency
+
+    async def worker(n: int) -> None:
+        for i in range(per_task):
+            await write(n * per_task + i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return per_task * concurrency / (time.perf_counter() - started)
+
+
+async def connect_per_op(path: str, concurrency: int, ops: int) -> float:
+    await _prepare(path)
+
+    async def write(i: int) -> None:
+        conn = await aiosqlite.connect(path, timeout=30)
+        try:
+            await conn.execute("PRAGMA foreign_keys = ON;")
+            await conn.execute(INSERT_ORDER, (1, "a", str(i)))
+            await conn.commit()
+        finally:
+            await conn.close()
+
+    return await _run(concurrency, ops, write)
+
+
+async def pool_per_op(path: str, concurrency: int, ops: int) -> float:
+    await _prepare(path)
+    pool = ConnectionPool(path, size=4)
+    await pool.open()
+
+    async def write(i: int) -> None:
+        async with pool.acquire() as conn:
+            await conn.execute(INSERT_ORDER, (1, "a", str(i)))
+            await conn.commit()
+
+    try:
+        return await _run(concurrency, ops, write)
+    finally:
+        await pool.close()
+
+
+async def group_commit(path: str, concurrency: int, ops: int) -> float:
+    await _prepare(path)
+    await db.open_writer()
+
+    async def write(i: int) -> None:
+        await db.create_order(1, "a", str(i))
+
+    try:
+        return await _run(concurrency, ops, write)
+    finally:
+        writer = db._WRITER
+        await db.close_writer()
+        print(f"  group-commit: {writer.ops} ops in {writer.batches} transactions")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    for name, bench in (
+        ("connect-per-op", connect_per_op),
+        ("pool-per-op", pool_per_op),
+        ("group-commit", group_commit),
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            results[name] = await bench(os.path.join(tmp, "bench.sqlite3"), args.concurrency, args.ops)
+    baseline = results["connect-per-op"]
+    for name, rate in results.items():
+        print(f"{name:>15}: {rate:9.0f} writes/s  ({rate / baseline:5.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
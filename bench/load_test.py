@@ -0,0 +1,281 @@
+"""End-to-end load test of the real Dispatcher against a temporary SQLite file.
+
+The routers, middlewares and services are built exactly as main.py builds
+them; only the Bot session is replaced with an in-process stub, so no
+network is involved. Synthetic passengers run /start -> contact ->
+pass:order -> pickup -> destination, then drivers run drv:new ->
+drv:take -> drv:arrived -> drv:complete on the created orders.
+
+    python bench/load_test.py --passengers 500 --drivers 50 --concurrency 50
+    python bench/load_test.py --repository memory   # orders etc. in app.memory_repository
+    python bench/load_test.py --profile             # per-function query table (app.profiler)
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import TelegramMethod  # noqa: E402
+from aiogram.types import Message, Update  # noqa: E402
+
+import main  # noqa: E402
+from app import presence, repository  # noqa: E402
+from app.config import Config  # noqa: E402
+from app.memory_repository import MemoryRepository  # noqa: E402
+from app.metrics import instrument_bot  # noqa: E402
+from app.profiler import PROFILER  # noqa: E402
+
+BOT_TOKEN = "123456:load-test"
+
+
+class StubSession(BaseSession):
+    """Answers every Bot API call locally, optionally after a fixed delay."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is Message or "Message" in str(method.__returning__):
+            chat_id = getattr(method, "chat_id", None) or 0
+            return Message.model_validate(
+                {
+                    "message_id": getattr(method, "message_id", None) or next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": getattr(method, "text", None) or "",
+                },
+                context={"bot": bot},
+            )
+        return True
+
+    async def stream_content(self, *args: Any, **kwargs: Any) -> AsyncGenerator[bytes, None]:
+        raise NotImplementedError
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+class Harness:
+    def __init__(self, bot: Bot, dp: Dispatcher) -> None:
+        self.bot = bot
+        self.dp = dp
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _message(self, user_id: int, **fields: Any) -> Dict[str, Any]:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **fields,
+        }
+
+    async def _feed(self, label: str, data: Dict[str, Any]) -> None:
+        update = Update.model_validate({"update_id": next(self._update_ids), **data}, context={"bot": self.bot})
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            self.errors[label] += 1
+            logging.exception("Update %s failed", label)
+        self.latencies[label].append(time.perf_counter() - started)
+
+    async def message(self, label: str, user_id: int, **fields: Any) -> None:
+        await self._feed(label, {"message": self._message(user_id, **fields)})
+
+    async def callback(self, user_id: int, data: str) -> None:
+        label = "callback:" + ":".join(part for part in data.split(":") if not part.isdigit())
+        await self._feed(
+            label,
+            {
+                "callback_query": {
+                    "id": str(next(self._update_ids)),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": data,
+                    "message": self._message(user_id, text="menu"),
+                }
+            },
+        )
+
+    async def passenger(self, user_id: int) -> None:
+        await self.message("message:/start", user_id, text="/start")
+        await self.message(
+            "message:contact",
+            user_id,
+            contact={"phone_number": f"+7900{user_id:07d}", "first_name": "p", "user_id": user_id},
+        )
+        await self.callback(user_id, "pass:order")
+        await self.message("message:pickup", user_id, text=f"Улица {user_id}")
+        await self.message("message:destination", user_id, text=f"Проспект {user_id}")
+        await self.callback(user_id, "pass:my")
+
+    async def driver(self, user_id: int, order_ids: List[int]) -> None:
+        for order_id in order_ids:
+            await self.callback(user_id, "drv:new")
+            await self.callback(user_id, f"drv:take:{order_id}")
+            await self.callback(user_id, f"drv:arrived:{order_id}")
+            await self.callback(user_id, f"drv:complete:{order_id}")
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def _limited(semaphore: asyncio.Semaphore, coro) -> None:
+    async with semaphore:
+        await coro
+
+
+async def run(
+    passengers: int,
+    drivers: int,
+    concurrency: int,
+    api_latency: float,
+    dispatch_rate: float,
+    db_path: str,
+    engine: str = "sqlite",
+    profile: bool = False,
+) -> Harness:
+    config = Config(
+        bot_token=BOT_TOKEN,
+        admin_ids=[1],
+        db_path=db_path,
+        dispatch_rate=dispatch_rate,
+        # Synthetic users tap far faster than people; throttling would drop most of the load
+        throttle_rate=0.0,
+        callback_dedup_window=0.0,
+        # The stub API has no flood limits to respect
+        outbox_rate=0.0,
+        outbox_chat_rate=0.0,
+        metrics_port=0,
+        db_profile=profile,
+        # Only the table is wanted here, not a log line per slow call
+        db_slow_query=60.0,
+    )
+    session = StubSession(latency=api_latency)
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    instrument_bot(bot)
+    dp = main.create_dispatcher(config)
+    await main.setup_services(config, bot)
+    if engine == "memory":
+        repository.use_repository(MemoryRepository())
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+
+    passenger_ids = list(range(10_000, 10_000 + passengers))
+    driver_ids = list(range(1_000, 1_000 + drivers))
+    for driver_id in driver_ids:
+        await repository.add_driver(driver_id, f"driver_{driver_id}")
+        await presence.go_online(driver_id)
+
+    harness = Harness(bot, dp)
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(_limited(semaphore, harness.passenger(uid)) for uid in passenger_ids))
+        passenger_elapsed = time.perf_counter() - started
+
+        new_orders = [o["id"] for o in await repository.list_new_orders(limit=passengers)]
+        assignments = {d: new_orders[i::drivers] for i, d in enumerate(driver_ids)}
+        started = time.perf_counter()
+        await asyncio.gather(*(_limited(semaphore, harness.driver(d, ids)) for d, ids in assignments.items()))
+        driver_elapsed = time.perf_counter() - started
+    finally:
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+
+    total = sum(len(v) for v in harness.latencies.values())
+    print(
+        f"repository={engine} passengers={passengers} drivers={drivers} concurrency={concurrency} "
+        f"api_latency={api_latency * 1000:.1f}ms orders={len(new_orders)}"
+    )
+    print(f"passenger phase {passenger_elapsed:.2f}s, driver phase {driver_elapsed:.2f}s, "
+          f"{total / (passenger_elapsed + driver_elapsed):.0f} updates/s overall")
+    print(f"{'update':<24}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label in sorted(harness.latencies):
+        values = harness.latencies[label]
+        print(
+            f"{label:<24}{len(values):>8}{harness.errors.get(label, 0):>8}"
+            f"{_percentile(values, 50) * 1000:>10.2f}{_percentile(values, 95) * 1000:>10.2f}"
+            f"{_percentile(values, 99) * 1000:>10.2f}{max(values) * 1000:>10.2f}"
+        )
+    print("api calls: " + ", ".join(f"{k}={v}" for k, v in sorted(session.calls.items())))
+    if profile:
+        print(PROFILER.report())
+    return harness
+
+
+async def amain() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--passengers", type=int, default=200)
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="simulated Bot API round trip")
+    parser.add_argument(
+        "--dispatch-rate", type=float, default=0.0, help="order fan-out sends per second (0 = unlimited)"
+    )
+    parser.add_argument("--db", help="SQLite file to use (default: a temporary file)")
+    parser.add_argument(
+        "--repository",
+        choices=("sqlite", "memory"),
+        default="sqlite",
+        help="engine for users, drivers and orders; FSM state and presence stay in SQLite",
+    )
+    parser.add_argument("--profile", action="store_true", help="time the app.db query functions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.db:
+        await run(
+            args.passengers,
+            args.drivers,
+            args.concurrency,
+            args.api_latency_ms / 1000,
+            args.dispatch_rate,
+            args.db,
+            args.repository,
+            args.profile,
+        )
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            await run(
+                args.passengers,
+                args.drivers,
+                args.concurrency,
+                args.api_latency_ms / 1000,
+                args.dispatch_rate,
+                os.path.join(tmp, "load_test.sqlite3"),
+                args.repository,
+                args.profile,
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(amain())
@@ -1,48 +1,214 @@
 import asyncio
 import logging
 
+import uvicorn
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
+from fastapi import FastAPI
 
-from app.config import load_config, settings
-from app.db import init_db, set_db_path
+from app.archive import start_archiver, stop_archiver
+from app.config import Config, load_config
+from app.fsm_storage import SQLiteStorage
+from app.geo import load_open_orders
+from app.lifecycle import run_polling
+from app.presence import PresenceMiddleware, start_presence, stop_presence
+from app.expiry import start_expiry, stop_expiry
+from app.feed import start_feed, stop_feed
+from app.dispatch import close_dispatch, setup_dispatch
+from app.outbox import close_outbox, setup_outbox
+from app.profiler import configure_profiler, log_report_on_signal
+from app.render import RenderingSession
+from app.metrics import instrument_bot, instrument_dispatcher, start_metrics_server, stop_metrics_server
+from app.db import (
+    close_pool,
+    close_writer,
+    configure_cache,
+    init_db,
+    open_pool,
+    open_writer,
+    set_db_path,
+)
+from app.throttling import ThrottlingMiddleware
 from app.routers.common import router as common_router
 from app.routers.passenger import router as passenger_router
 from app.routers.driver import router as driver_router
 from app.routers.admin import router as admin_router
+from app.web import create_app
 
 
-async def on_startup() -> None:
-    # Initialize database schema
-    await init_db()
+async def on_startup(config: Config, bot: Bot) -> None:
+    # Independent warm-ups; in polling mode the first getUpdates is already in flight
+    await asyncio.gather(
+        load_open_orders(config.geo_refresh_interval),
+        start_presence(config.presence_timeout, config.presence_snapshot_interval),
+        start_expiry(bot, config.order_ttl, config.accept_timeout),
+        start_metrics_server(
+            config.metrics_host,
+            config.metrics_port,
+            ports=config.web_workers if config.run_mode == "webhook" else 1,
+        ),
+    )
+    start_archiver(config.archive_after_hours, config.archive_batch, config.archive_interval)
+    start_feed(bot, config.feed_poll_interval)
+    log_report_on_signal()
 
 
-async def main() -> None:
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+def create_bot(config: Config) -> Bot:
+    # Sends the pre-rendered keyboards from app.keyboards as their cached JSON
+    session = RenderingSession()
+    if config.telegram_api_url:
+        session = RenderingSession(api=TelegramAPIServer.from_base(config.telegram_api_url))
+    bot = Bot(token=config.bot_token, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    instrument_bot(bot)
+    return bot
 
-    # Load configuration from environment
-    load_config()
 
-    # Configure DB path for DB module
-    set_db_path(settings.db_path)
+def create_dispatcher(config: Config) -> Dispatcher:
+    # FSM state lives in the bot's database so it survives restarts and is shared between processes
+    dp = Dispatcher(storage=SQLiteStorage(config.db_path, state_ttl=config.fsm_state_ttl), config=config)
 
-    bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher()
+    # Drop double taps and flooding users before any filter, DB or FSM work
+    throttling = ThrottlingMiddleware(
+        rate=config.throttle_rate, burst=config.throttle_burst, dedup_window=config.callback_dedup_window
+    )
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    # Any update from an on-shift driver is a heartbeat
+    dp.update.outer_middleware(PresenceMiddleware())
 
     # Routers
     dp.include_router(common_router)
     dp.include_router(passenger_router)
     dp.include_router(driver_router)
     dp.include_router(admin_router)
+    instrument_dispatcher(dp)
 
     # Register startup task
     dp.startup.register(on_startup)
+    dp.shutdown.register(stop_archiver)
+    dp.shutdown.register(stop_metrics_server)
+    dp.shutdown.register(stop_expiry)
+    # Before the outbox closes, so the batch being pushed is sent and acknowledged
+    dp.shutdown.register(stop_feed)
+    dp.shutdown.register(close_dispatch)
+    dp.shutdown.register(close_outbox)
+    dp.shutdown.register(stop_presence)
+    # Shutdown runs once the updates have drained, so the last FSM writes are flushed here;
+    # it also ends the storage's connection thread, which would otherwise keep the process alive
+    dp.shutdown.register(dp.storage.close)
+    dp.shutdown.register(close_writer)
+    dp.shutdown.register(close_pool)
+    return dp
+
+
+async def setup_services(config: Config, bot: Bot) -> None:
+    # Configure DB path for DB module
+    set_db_path(config.db_path)
+    configure_profiler(config.db_profile, config.db_slow_query)
+    await open_pool(config.db_pool_size)
+    # Schema first: the update offset and carried-over updates live in the database too
+    await init_db(config.db_check_plans)
+    await open_writer(config.db_write_window, config.db_write_batch)
+    # The caches only see this process's writes, and with several webhook workers a
+    # user's next tap may be handled by another one, so they are off there
+    multi_process = config.run_mode == "webhook" and config.web_workers > 1
+    configure_cache(0 if multi_process else config.cache_size, config.cache_ttl)
+    setup_outbox(
+        bot,
+        rate=config.outbox_rate,
+        chat_rate=config.outbox_chat_rate,
+        chat_burst=config.outbox_chat_burst,
+        concurrency=config.outbox_concurrency,
+    )
+    setup_dispatch(bot, rate=config.dispatch_rate, concurrency=config.dispatch_concurrency)
 
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+async def start_services(config: Config, bot: Bot, dp: Dispatcher) -> None:
+    """setup_services(), undone if it fails so the process can exit.
+
+    The pool, writer and FSM storage each run an aiosqlite thread that
+    would keep the interpreter alive after a failed migration or query plan
+    check (DB_CHECK_PLANS).
+    """
+    try:
+        await setup_services(config, bot)
+    except BaseException:
+        await close_writer()
+        await close_pool()
+        await dp.storage.close()
+        raise
+
+
+def create_webhook_app() -> FastAPI:
+    """Application factory used by every uvicorn worker process in webhook mode."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    config = load_config()
+    bot = create_bot(config)
+    dp = create_dispatcher(config)
+    return create_app(
+        bot,
+        dp,
+        path=config.webhook_path,
+        secret=config.webhook_secret or None,
+        queue_size=config.update_backlog,
+        concurrency=config.update_concurrency,
+        drain_timeout=config.drain_timeout,
+        on_startup=lambda: start_services(config, bot, dp),
+    )
+
+
+async def register_webhook(config: Config) -> None:
+    bot = create_bot(config)
+    try:
+        dp = create_dispatcher(config)
+        await bot.set_webhook(
+            config.webhook_url,
+            secret_token=config.webhook_secret or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    finally:
+        await bot.session.close()
+
+
+def run_webhook(config: Config) -> None:
+    # Register once here; the worker processes only serve the endpoint
+    if config.webhook_url:
+        asyncio.run(register_webhook(config))
+    uvicorn.run(
+        "main:create_webhook_app",
+        factory=True,
+        host=config.web_host,
+        port=config.web_port,
+        workers=config.web_workers,
+    )
+
+
+async def main() -> None:
+    # Load configuration from environment
+    config = load_config()
+
+    bot = create_bot(config)
+    dp = create_dispatcher(config)
+    await start_services(config, bot, dp)
+
+    # Drains handlers and saves the update offset on SIGTERM (see app.lifecycle)
+    await run_polling(
+        bot,
+        dp,
+        drain_timeout=config.drain_timeout,
+        concurrency=config.update_concurrency,
+        backlog=config.update_backlog,
+    )
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     try:
-        asyncio.run(main())
+        config = load_config()
+        if config.run_mode == "webhook":
+            run_webhook(config)
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logging.info("Bot stopped")
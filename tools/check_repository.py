@@ -0,0 +1,304 @@
+"""Conformance checks for the repository engines in app.repository.
+
+    python tools/check_repository.py
+
+Every check runs against a fresh SQLiteRepository (temporary database, with
+the pool and group-commit writer as the bot runs it) and a fresh
+MemoryRepository. A check asserts the invariants that must hold for any
+engine (one winner per claimed order, keyset pages that cover the table
+exactly once) and returns what it saw; the two engines must return the
+same. Timestamps are compared as present or absent only, since the two
+engines read the clock at slightly different moments. Exits with status 1
+if any check fails.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import traceback
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db  # noqa: E402
+from app.memory_repository import MemoryRepository  # noqa: E402
+from app.repository import Page, Repository, SQLiteRepository  # noqa: E402
+
+Check = Callable[[Repository], Awaitable[Any]]
+CHECKS: List[Check] = []
+
+
+def check(fn: Check) -> Check:
+    CHECKS.append(fn)
+    return fn
+
+
+@asynccontextmanager
+async def sqlite_repository() -> AsyncIterator[Repository]:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_db_path(os.path.join(tmp, "check.sqlite3"))
+        await db.open_pool()
+        await db.init_db()
+        await db.open_writer()
+        db.configure_cache()
+        try:
+            yield SQLiteRepository()
+        finally:
+            await db.close_writer()
+            await db.close_pool()
+
+
+@asynccontextmanager
+async def memory_repository() -> AsyncIterator[Repository]:
+    yield MemoryRepository()
+
+
+ENGINES = {"sqlite": sqlite_repository, "memory": memory_repository}
+
+
+def _mask(value: Any, key: str = "") -> Any:
+    if isinstance(value, dict):
+        return {k: _mask(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_mask(v) for v in value)
+    if value is not None and (key.endswith("_at") or key.endswith("_secs")):
+        return "<set>"
+    return value
+
+
+def _ids(page: Page) -> Tuple[List[int], bool, bool]:
+    rows, has_prev, has_next = page
+    return [r.get("id", r.get("tg_id")) for r in rows], has_prev, has_next
+
+
+async def _walk(fetch: Callable[..., Awaitable[Page]], key: Callable[[Dict[str, Any]], Any]) -> List[Any]:
+    """Page forward to the end and back to the start; both walks must agree."""
+    forward = []
+    page = await fetch()
+    assert not page[1], "first page has a previous page"
+    forward.append(page)
+    while page[2]:
+        page = await fetch(after=key(page[0][-1]))
+        forward.append(page)
+    backward = [page]
+    while page[1]:
+        page = await fetch(before=key(page[0][0]))
+        backward.append(page)
+    assert [p[0] for p in backward[::-1]] == [p[0] for p in forward], "walking back gave other pages"
+    return forward
+
+
+# Users
+@check
+async def users(repo: Repository) -> Any:
+    seen = []
+    await repo.upsert_user(1, "Анна")
+    await repo.upsert_user(1, "Анна К.")
+    await repo.upsert_user(2, "Борис")
+    await repo.set_user_phone(1, "+70000000001")
+    await repo.set_user_phone(3, "+70000000003")
+    for tg_id in (1, 2, 3):
+        seen.append(await repo.get_user(tg_id))
+    user = await repo.get_user(2)
+    user["full_name"] = "changed by the caller"
+    seen.append(await repo.get_user(2))
+    return seen
+
+
+# Drivers
+@check
+async def drivers(repo: Repository) -> Any:
+    seen: List[Any] = [
+        await repo.add_driver(10, "d10"),
+        await repo.add_driver(11, "d11"),
+        await repo.add_driver(10, "again"),
+        await repo.is_driver(10),
+        await repo.is_driver(12),
+        await repo.remove_driver(11),
+        await repo.remove_driver(11),
+        await repo.is_driver(11),
+        sorted(await repo.add_drivers([(12, "d12"), (10, "d10"), (13, "d13")])),
+        await repo.add_drivers([]),
+    ]
+    for tg_id in (10, 11, 12, 13):
+        seen.append(await repo.is_driver(tg_id))
+    return seen
+
+
+@check
+async def driver_pages(repo: Repository) -> Any:
+    ids = random.Random(1).sample(range(100, 1000), 47)
+    for tg_id in ids[:30]:
+        await repo.add_driver(tg_id, f"driver_{tg_id}")
+    await repo.add_drivers([(tg_id, f"driver_{tg_id}") for tg_id in ids[30:]])
+    await repo.remove_driver(ids[5])
+
+    async def fetch(**cursor: Any) -> Page:
+        return await repo.page_drivers(limit=10, **cursor)
+
+    pages = await _walk(fetch, lambda r: (r["added_at"], r["tg_id"]))
+    rows = [r for page in pages for r in page[0]]
+    assert rows == sorted(rows, key=lambda r: (r["added_at"], r["tg_id"]), reverse=True), "not newest first"
+    # Which drivers come first depends on where the second ticked over, so only the sets are compared
+    return [len(page[0]) for page in pages], sorted((_mask(r) for r in rows), key=lambda r: r["tg_id"])
+
+
+# Orders
+async def _passengers(repo: Repository, *tg_ids: int) -> None:
+    for tg_id in tg_ids:
+        await repo.upsert_user(tg_id, f"user_{tg_id}")
+
+
+@check
+async def order_lifecycle(repo: Repository) -> Any:
+    await _passengers(repo, 1, 2, 3)
+    a = await repo.create_order(1, "Ленина 1", "Вокзал", 55.75, 37.61)
+    b = await repo.create_order(2, "Мира 5", "Аэропорт")
+    c = await repo.create_order(3, "Садовая 2", "Парк", 55.70, 37.50)
+    seen: List[Any] = [
+        (a, b, c),
+        await repo.list_new_orders(),
+        await repo.list_new_orders(limit=2),
+        sorted(o["id"] for o in await repo.get_new_orders([c, a, 999, a])),
+        await repo.get_new_orders([]),
+        sorted(await repo.list_open_order_locations()),
+        await repo.driver_accept_order(a, 100),
+        await repo.driver_accept_order(a, 101),
+        await repo.driver_accept_order(999, 101),
+        await repo.driver_mark_arrived(a, 101),
+        await repo.driver_complete_order(a, 101),
+        await repo.get_driver_active_order(100),
+        await repo.get_passenger_active_order(1),
+        await repo.driver_mark_arrived(a, 100),
+        await repo.driver_mark_arrived(a, 100),
+        await repo.release_order(a, 100),
+        await repo.driver_complete_order(a, 100),
+        await repo.driver_complete_order(a, 100),
+        await repo.get_driver_active_order(100),
+        await repo.get_passenger_active_order(1),
+        await repo.get_order(a),
+        await repo.get_order(999),
+        await repo.driver_accept_order(b, 101),
+        await repo.release_order(b, 100),
+        await repo.release_order(b, 101),
+        await repo.driver_accept_order(b, 102),
+        await repo.expire_order(c, 3600),
+        await repo.expire_order(b, 0),
+        await repo.expire_order(c, 0),
+        await repo.expire_order(c, 0),
+        await repo.driver_accept_order(c, 101),
+        await repo.get_passenger_active_order(3),
+        sorted(await repo.list_pending_orders(), key=lambda o: o["id"]),
+        sorted(await repo.list_open_order_locations()),
+        await repo.order_stats(),
+        await repo.order_activity(),
+    ]
+    return seen
+
+
+@check
+async def concurrent_claims(repo: Repository) -> Any:
+    """Forty drivers race for every one of thirty orders; each order goes to exactly one of them."""
+    await _passengers(repo, *range(1, 31))
+    order_ids = [await repo.create_order(p, f"from {p}", f"to {p}") for p in range(1, 31)]
+    attempts = [(order_id, driver) for order_id in order_ids for driver in range(100, 140)]
+    random.Random(2).shuffle(attempts)
+    results = await asyncio.gather(*(repo.driver_accept_order(o, d) for o, d in attempts))
+    winners: Dict[int, List[int]] = {}
+    for (order_id, driver), won in zip(attempts, results):
+        if won:
+            winners.setdefault(order_id, []).append(driver)
+    assert sorted(winners) == order_ids, "an order was not taken"
+    for order_id, drivers in winners.items():
+        assert len(drivers) == 1, f"order {order_id} taken by {drivers}"
+        order = await repo.get_order(order_id)
+        assert order["status"] == "accepted" and order["driver_tg_id"] == drivers[0], order
+
+    # And the winners race the expiry timer and their own release
+    races = [repo.driver_complete_order(o, d[0]) for o, d in winners.items()]
+    races += [repo.release_order(o, d[0]) for o, d in winners.items()]
+    races += [repo.expire_order(o, 0) for o in order_ids]
+    await asyncio.gather(*races)
+    finished = [(await repo.get_order(o))["status"] for o in order_ids]
+    assert all(s in ("completed", "new", "expired") for s in finished), finished
+    stats = await repo.order_stats()
+    assert sum(v for k, v in stats.items() if k != "total") == stats["total"] == 30, stats
+    return len(winners), stats["total"]
+
+
+@check
+async def order_pages(repo: Repository) -> Any:
+    await _passengers(repo, 1, 2, 3)
+    rnd = random.Random(3)
+    for i in range(75):
+        order_id = await repo.create_order(rnd.choice((1, 2, 3)), f"from {i}", f"to {i}")
+        step = rnd.randrange(5)
+        driver = rnd.choice((100, 101, 102))
+        if step >= 1:
+            await repo.driver_accept_order(order_id, driver)
+        if step >= 2:
+            await repo.driver_mark_arrived(order_id, driver)
+        if step >= 3:
+            await repo.driver_complete_order(order_id, driver)
+        if step == 4 and rnd.random() < 0.5:
+            await repo.create_order(rnd.choice((1, 2, 3)), "extra", "extra")
+    seen = []
+    for filters in (
+        {},
+        {"status": "new"},
+        {"status": "completed"},
+        {"status": "nope"},
+        {"driver_tg_id": 101},
+        {"passenger_tg_id": 2},
+        {"status": "accepted", "passenger_tg_id": 3},
+        {"status": "completed", "driver_tg_id": 100, "passenger_tg_id": 1},
+    ):
+        async def fetch(after: Optional[int] = None, before: Optional[int] = None) -> Page:
+            return await repo.page_orders(after_id=after, before_id=before, limit=7, **filters)
+
+        pages = await _walk(fetch, lambda r: r["id"])
+        rows = [r for page in pages for r in page[0]]
+        assert all(rows[i]["id"] > rows[i + 1]["id"] for i in range(len(rows) - 1)), "not newest first"
+        for name, value in filters.items():
+            assert all(r[name] == value for r in rows), f"row outside the {name} filter"
+        seen.append((filters, [_ids(page) for page in pages]))
+    seen.append(await repo.order_stats())
+    return seen
+
+
+async def run_checks(engines: Dict[str, Callable[[], Any]]) -> int:
+    failures = 0
+    for fn in CHECKS:
+        results: Dict[str, Any] = {}
+        for name, open_repository in engines.items():
+            try:
+                async with open_repository() as repo:
+                    results[name] = _mask(await fn(repo))
+            except Exception:
+                results[name] = f"failed:\n{traceback.format_exc()}"
+        values = list(results.values())
+        ok = not any(isinstance(v, str) and v.startswith("failed:") for v in values)
+        ok = ok and all(v == values[0] for v in values[1:])
+        print(f"{'ok' if ok else 'FAIL':>4}  {fn.__name__}")
+        if not ok:
+            failures += 1
+            for name, value in results.items():
+                print(f"      {name}: {value}")
+    return failures
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    failures = await run_checks(ENGINES)
+    print(f"{len(CHECKS) - failures}/{len(CHECKS)} checks passed on {', '.join(ENGINES)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+"""Local stand-in for Telegram when testing webhook mode.
+
+It serves a minimal Bot API that accepts every method the bot calls, and
+POSTs synthetic updates to the bot's webhook endpoint. Start the bot with
+
+    RUN_MODE=webhook TELEGRAM_API_URL=http://127.0.0.1:8081 WEBHOOK_URL= python main.py
+
+and then run
+
+    python tools/fake_telegram.py --webhook http://127.0.0.1:8080/webhook --users 200
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import time
+from typing import Any, Dict
+
+from aiohttp import ClientSession, web
+
+# Methods whose result aiogram parses as a Message; everything else gets True
+_MESSAGE_METHODS = {
+    "sendmessage",
+    "editmessagetext",
+    "editmessagereplymarkup",
+    "sendlocation",
+    "senddocument",
+}
+_message_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def _message(chat_id: int, text: str, message_id: int | None = None) -> Dict[str, Any]:
+    return {
+        "message_id": message_id or next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": _user(chat_id),
+        "text": text,
+    }
+
+
+async def _api(request: web.Request) -> web.Response:
+    method = request.match_info["method"].lower()
+    form = await request.post()
+    if method == "getme":
+        result: Any = {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+    elif method in _MESSAGE_METHODS:
+        chat_id = int(form.get("chat_id") or 0)
+        result = _message(chat_id, str(form.get("text") or ""))
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+def _start_update(update_id: int, user_id: int) -> Dict[str, Any]:
+    return {"update_id": update_id, "message": _message(user_id, "/start")}
+
+
+def _callback_update(update_id: int, user_id: int, data: str) -> Dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": _message(user_id, "menu"),
+        },
+    }
+
+
+async def _post_updates(url: str, secret: str, users: int, concurrency: int) -> None:
+    update_ids = itertools.count(1)
+    statuses: Dict[int, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+
+    async with ClientSession() as session:
+
+        async def post(update: Dict[str, Any]) -> None:
+            async with semaphore:
+                async with session.post(url, json=update, headers=headers) as resp:
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+
+        started = time.perf_counter()
+        user_ids = range(100_000, 100_000 + users)
+        await asyncio.gather(*(post(_start_update(next(update_ids), uid)) for uid in user_ids))
+        await asyncio.gather(*(post(_callback_update(next(update_ids), uid, "role:passenger")) for uid in user_ids))
+        elapsed = time.perf_counter() - started
+
+    total = sum(statuses.values())
+    print(f"posted {total} updates in {elapsed:.2f}s ({total / elapsed:.0f}/s), statuses: {statuses}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--api-host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--serve", action="store_true", help="keep serving the fake Bot API after posting")
+    args = parser.parse_args()
+
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", _api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, args.api_host, args.api_port).start()
+    try:
+        await _post_updates(args.webhook, args.secret, args.users, args.concurrency)
+        if args.serve:
+            await asyncio.Event().wait()
+        else:
+            # Give the bot time to finish replying before the fake API goes away
+            await asyncio.sleep(2)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
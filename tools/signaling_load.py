@@ -0,0 +1,200 @@
+"""Simulated chat-roulette clients for the WebSocket signaling server.
+
+Start the server and point the generator at it:
+
+    python -m app.signaling --port 8000
+    python tools/signaling_load.py --url ws://127.0.0.1:8000/ws --idle 20000 --active 200 --duration 30
+
+Every client behaves like video_chat.html: on ``init`` it sends an offer
+followed by trickle ICE candidates, on ``offer`` it answers and sends its own
+candidates. ``--idle`` clients then just hold their socket open; ``--active``
+clients keep asking for the next partner (or reconnect, see ``--reconnect``)
+for ``--duration`` seconds. The report gives connect and handshake latency
+percentiles and, with ``--server-pid``, the server's resident memory.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, WSMsgType
+
+# Roughly the size of a real SDP with audio and video
+_SDP = "v=0\r\n" + "a=fake-sdp-line-padding-to-realistic-size\r\n" * 80
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.connect_ms: List[float] = []
+        self.handshake_ms: List[float] = []
+        self.handshakes = 0
+        self.candidates = 0
+        self.partner_left = 0
+        self.errors: Dict[str, int] = {}
+
+    def error(self, name: str) -> None:
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+async def _session(ws, stats: Stats, candidates: int) -> None:
+    """Run one pairing, until the partner's offer or answer and all its candidates are in (or it left)."""
+    started = time.perf_counter()
+    got_remote = False
+    remote_candidates = 0
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            raise ConnectionError(f"socket {msg.type.name.lower()}")
+        data = json.loads(msg.data)
+        kind = data.get("type")
+        if kind == "wait":
+            started = time.perf_counter()
+        elif kind == "init":
+            await ws.send_str(json.dumps({"type": "offer", "offer": {"type": "offer", "sdp": _SDP}}))
+            for i in range(candidates):
+                await ws.send_str(json.dumps({"type": "candidate", "candidate": {"candidate": f"c{i}", "sdpMid": "0"}}))
+        elif kind == "offer":
+            got_remote = True
+            await ws.send_str(json.dumps({"type": "answer", "answer": {"type": "answer", "sdp": _SDP}}))
+            for i in range(candidates):
+                await ws.send_str(json.dumps({"type": "candidate", "candidate": {"candidate": f"c{i}", "sdpMid": "0"}}))
+        elif kind == "answer":
+            got_remote = True
+        elif kind == "candidate":
+            remote_candidates += 1
+            stats.candidates += 1
+        elif kind == "leave":
+            stats.partner_left += 1
+            return
+        if got_remote and remote_candidates >= candidates:
+            stats.handshake_ms.append((time.perf_counter() - started) * 1000)
+            stats.handshakes += 1
+            return
+    raise ConnectionError("socket closed")
+
+
+async def _client(
+    http: ClientSession,
+    url: str,
+    stats: Stats,
+    candidates: int,
+    stop_at: Optional[float],
+    reconnect: bool,
+    rng: random.Random,
+) -> None:
+    """One client; idle clients (``stop_at`` None) stay connected and only rematch when left."""
+    while stop_at is None or time.time() < stop_at:
+        started = time.perf_counter()
+        try:
+            ws = await http.ws_connect(url, heartbeat=None, max_msg_size=0)
+        except Exception as exc:
+            stats.error(type(exc).__name__)
+            await asyncio.sleep(1.0)
+            continue
+        stats.connect_ms.append((time.perf_counter() - started) * 1000)
+        try:
+            while stop_at is None or time.time() < stop_at:
+                if stop_at is None:
+                    await _session(ws, stats, candidates)
+                    continue
+                try:
+                    await asyncio.wait_for(_session(ws, stats, candidates), max(0.0, stop_at - time.time()))
+                except asyncio.TimeoutError:
+                    break
+                await asyncio.sleep(rng.uniform(0.0, 0.2))
+                if reconnect:
+                    break
+                await ws.send_str(json.dumps({"type": "next"}))
+        except Exception as exc:
+            stats.error(type(exc).__name__)
+            await asyncio.sleep(1.0)
+        finally:
+            await ws.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--idle", type=int, default=1000, help="clients that pair once and then hold the socket")
+    parser.add_argument("--active", type=int, default=100, help="clients that keep rematching")
+    parser.add_argument("--candidates", type=int, default=8, help="ICE candidates sent per side")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds the active clients keep going")
+    parser.add_argument("--connect-rate", type=float, default=2000.0, help="new idle connections per second")
+    parser.add_argument("--reconnect", action="store_true", help="rematch by reconnecting instead of 'next'")
+    parser.add_argument("--server-pid", type=int, help="report this process's resident memory")
+    args = parser.parse_args()
+
+    try:
+        import resource
+
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError):
+        pass
+
+    rng = random.Random(1)
+    idle_stats, active_stats = Stats(), Stats()
+    async with ClientSession(connector=TCPConnector(limit=0), timeout=ClientTimeout(total=None)) as http:
+        started = time.perf_counter()
+        idle = []
+        for i in range(args.idle):
+            idle.append(asyncio.create_task(_client(http, args.url, idle_stats, args.candidates, None, False, rng)))
+            if args.connect_rate > 0 and i % 100 == 99:
+                await asyncio.sleep(100 / args.connect_rate)
+        while idle_stats.handshakes < args.idle - 1 and time.perf_counter() - started < 120:
+            await asyncio.sleep(0.2)
+        ramp = time.perf_counter() - started
+        print(f"idle: {len(idle_stats.connect_ms)} connected, {idle_stats.handshakes} paired in {ramp:.1f}s")
+        if args.server_pid:
+            print(f"server RSS with idle clients: {_rss_mb(args.server_pid):.0f} MB")
+
+        stop_at = time.time() + args.duration
+        active = [
+            asyncio.create_task(
+                _client(http, args.url, active_stats, args.candidates, stop_at, args.reconnect, rng)
+            )
+            for _ in range(args.active)
+        ]
+        await asyncio.gather(*active)
+        print(
+            f"active: {active_stats.handshakes} handshakes in {args.duration:.0f}s "
+            f"({active_stats.handshakes / args.duration:.0f}/s), {active_stats.candidates} candidates relayed"
+        )
+        for name, stats in (("idle", idle_stats), ("active", active_stats)):
+            print(
+                f"{name:>7} connect ms p50 {_percentile(stats.connect_ms, 0.5):7.2f} "
+                f"p99 {_percentile(stats.connect_ms, 0.99):7.2f}   handshake ms p50 "
+                f"{_percentile(stats.handshake_ms, 0.5):7.2f} p99 {_percentile(stats.handshake_ms, 0.99):7.2f}"
+            )
+            if stats.errors:
+                print(f"{name:>7} errors: {stats.errors}")
+        if args.server_pid:
+            print(f"server RSS: {_rss_mb(args.server_pid):.0f} MB")
+        for task in idle:
+            task.cancel()
+        await asyncio.gather(*idle, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())